@@ -7,14 +7,17 @@ Note: beforehand we call our dependency mechanism (see
 :doc:`linked_external-dependencies_readme`) to ensure all dependencies are
 there.
 
+Worker processes (see :py:mod:`threedi_results_analysis.utils.processes`) also
+import this package, to find the functions they run. In these processes, qgis is
+not imported and the dependency mechanism is skipped: the dependencies are
+already on the ``sys.path`` that they inherit from the QGIS process.
+
 """
 from pathlib import Path
 import faulthandler
+import multiprocessing
 import sys
 
-from . import dependencies
-from .utils.qlogging import setup_logging
-
 
 #: Handy constant for building relative paths.
 PLUGIN_DIR = Path(__file__).parent
@@ -47,6 +50,8 @@ def classFactory(iface):
         iface (QgsInterface): A QGIS interface instance.
 
     """
+    from .utils.qlogging import setup_logging
+
     setup_logging()
     enable_high_dpi_scaling()
 
@@ -54,5 +59,11 @@ def classFactory(iface):
     return ThreeDiPlugin(iface)
 
 
-dependencies.ensure_everything_installed()
-dependencies.check_importability()
+#: Whether this is a worker process started with multiprocessing, instead of QGIS
+IN_WORKER_PROCESS = multiprocessing.parent_process() is not None
+
+if not IN_WORKER_PROCESS:
+    from . import dependencies
+
+    dependencies.ensure_everything_installed()
+    dependencies.check_importability()
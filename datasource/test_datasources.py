@@ -130,6 +130,26 @@ def test_get_timeseries_filter_fill_value(threedi_result):
         np.testing.assert_equal(time_series[0, 1], 42)
 
 
+def test_get_timeseries_by_ids(threedi_result):
+    node_ids = [5, 3, 5]
+    time_series = threedi_result.get_timeseries_by_ids("s1", node_ids)
+    np.testing.assert_equal(time_series[:, 0], threedi_result.get_timestamps())
+    assert time_series.shape[1] == len(node_ids) + 1
+    for i, node_id in enumerate(node_ids):
+        np.testing.assert_equal(
+            time_series[:, i + 1], threedi_result.get_timeseries("s1", node_id=node_id)[:, 1]
+        )
+
+
+def test_get_timeseries_by_ids_missing_id(threedi_result):
+    node_ids = [5, 10 ** 9, 3]
+    time_series = threedi_result.get_timeseries_by_ids("s1", node_ids, fill_value=np.nan)
+    assert time_series.shape[1] == len(node_ids) + 1
+    assert np.isnan(time_series[:, 2]).all()
+    np.testing.assert_equal(time_series[:, 1], threedi_result.get_timeseries("s1", node_id=5)[:, 1])
+    np.testing.assert_equal(time_series[:, 3], threedi_result.get_timeseries("s1", node_id=3)[:, 1])
+
+
 def test_get_model_instance_by_field_name(threedi_result):
     """A bug in threedigrid <= 1.0.12
 
@@ -236,6 +236,54 @@ class ThreediResult():
         timestamps = timestamps.reshape(-1, 1)  # reshape (n,) to (n, 1)
         return np.hstack([timestamps, values])
 
+    def get_timeseries_by_ids(self, nc_variable, node_ids, fill_value=None):
+        """Return a time series array of the given variable for multiple nodes
+
+        Same as get_timeseries(), but the values of all node_ids are read in a
+        single (fancy-indexed) read from the result file instead of one read per
+        node. The value columns are in the order of node_ids, duplicates allowed.
+        Ids that are not in the result file get a column of NO_DATA_VALUE (or
+        fill_value) and are logged.
+
+        :param nc_variable:
+        :param node_ids: sequence of ids of nodes (or lines, pumps)
+        :param fill_value:
+        :return: 2D array, first column being the timestamps
+        """
+        node_ids = np.asarray(node_ids, dtype=int)
+        unique_ids = np.unique(node_ids)
+
+        ga = self.get_gridadmin(nc_variable)
+        filtered_result = ga.get_model_instance_by_field_name(nc_variable).timeseries(
+            indexes=slice(None)
+        ).filter(id__in=unique_ids.tolist())
+
+        # the value columns belong to the returned ids, which can lack requested ids
+        returned_ids = np.asarray(filtered_result.id, dtype=int)
+        returned_values = self.get_timeseries_values(filtered_result, nc_variable)
+        if returned_ids.size and returned_values.shape[1:] != returned_ids.shape:
+            raise ValueError(
+                f"Got {returned_values.shape[1]} {nc_variable} timeseries for {returned_ids.size} ids"
+            )
+        order = np.argsort(returned_ids)
+        columns = np.searchsorted(returned_ids, node_ids, sorter=order).clip(max=max(returned_ids.size - 1, 0))
+        if returned_ids.size:
+            found = returned_ids[order[columns]] == node_ids
+        else:
+            found = np.zeros(node_ids.size, dtype=bool)
+        if not found.all():
+            logger.warning(f"No {nc_variable} timeseries for ids {np.unique(node_ids[~found]).tolist()}")
+
+        timestamps = self.get_timestamps(nc_variable)
+        values = np.full((timestamps.size, node_ids.size), NO_DATA_VALUE, dtype=float)
+        if found.any():
+            values[:, found] = returned_values[:, order[columns[found]]]
+        if fill_value is not None:
+            values[values == NO_DATA_VALUE] = fill_value
+
+        timestamps = timestamps.reshape(-1, 1)  # reshape (n,) to (n, 1)
+        return np.hstack([timestamps, values])
+
     def get_values_by_timestep_nr(self, variable, timestamp_idx, node_ids):
         """Return an array of values of the given variable on the specified
         timestamp(s)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+from pathlib import Path
+from qgis.core import QgsProcessingAlgorithm
+from qgis.core import QgsProcessingException
+from qgis.core import QgsProcessingParameterBoolean
+from qgis.core import QgsProcessingParameterEnum
+from qgis.core import QgsProcessingParameterFile
+from qgis.core import QgsProcessingParameterNumber
+from qgis.PyQt.QtCore import QCoreApplication
+from threedigrid.admin.constants import NO_DATA_VALUE
+from threedi_results_analysis.datasource.result_constants import H_TYPES
+from threedi_results_analysis.datasource.result_constants import NEGATIVE_POSSIBLE
+from threedi_results_analysis.datasource.result_constants import SUBGRID_MAP_VARIABLES
+from threedi_results_analysis.datasource.result_constants import WATERLEVEL
+from threedi_results_analysis.datasource.threedi_results import ThreediResult
+from threedi_results_analysis.processing.threedidepth_algorithms import CancelError
+from threedi_results_analysis.processing.threedidepth_algorithms import ProcessingParameterNetcdfNumber
+from threedi_results_analysis.tool_animation.animation_styler import DEFAULT_LOWER_THRESHOLD
+from threedi_results_analysis.tool_animation.frame_export import color_table
+from threedi_results_analysis.tool_animation.frame_export import export_frames
+from threedi_results_analysis.tool_animation.frame_export import frames_to_video
+from threedi_results_analysis.tool_animation.map_animator import threedi_result_legend_class_bounds
+from threedi_results_analysis.utils.cell_raster import cell_label_image
+from threedi_results_analysis.utils.color import COLOR_RAMP_OCEAN_HALINE
+
+import logging
+import numpy as np
+import os
+import subprocess
+
+
+logger = logging.getLogger(__name__)
+
+# Number of timesteps that are read from the result file at once
+READ_CHUNK_SIZE = 32
+FRAME_NAME_TEMPLATE = "frame_{:05d}.png"
+
+
+class ExportAnimationFramesAlgorithm(QgsProcessingAlgorithm):
+    """
+    Renders the 2D cell values of a node variable to a sequence of PNG frames
+    """
+
+    VARIABLES = [v for v in SUBGRID_MAP_VARIABLES if v.name in H_TYPES]
+
+    GRIDADMIN_INPUT = "GRIDADMIN_INPUT"
+    RESULTS_3DI_INPUT = "RESULTS_3DI_INPUT"
+    VARIABLE_INPUT = "VARIABLE_INPUT"
+    START_STEP_INPUT = "START_STEP_INPUT"
+    END_STEP_INPUT = "END_STEP_INPUT"
+    PIXEL_SIZE_INPUT = "PIXEL_SIZE_INPUT"
+    WORKERS_INPUT = "WORKERS_INPUT"
+    VIDEO_INPUT = "VIDEO_INPUT"
+    FRAME_RATE_INPUT = "FRAME_RATE_INPUT"
+    OUTPUT_DIRECTORY = "OUTPUT_DIRECTORY"
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return ExportAnimationFramesAlgorithm()
+
+    def name(self):
+        """Returns the algorithm name, used for identifying the algorithm"""
+        return "export_animation_frames"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Export animation frames")
+
+    def group(self):
+        """Returns the name of the group this algorithm belongs to"""
+        return self.tr("Post-process results")
+
+    def groupId(self):
+        """Returns the unique ID of the group this algorithm belongs to"""
+        return "postprocessing"
+
+    def shortHelpString(self):
+        """Returns a localised short helper string for the algorithm"""
+        return self.tr(
+            """
+            <p>Render the 2D cell values of a node variable to a sequence of georeferenced PNG images, one for each timestep.</p>
+            <p>The frames are rendered directly from the result file, without the map canvas, in several worker processes. They are styled in the same way as the cell layer of the animation tool.</p>
+            <h3>Parameters</h3>
+            <h4>Pixel size</h4>
+            <p>Pixel size of the frames, in the units of the computational grid's coordinate reference system.</p>
+            <h4>Number of worker processes</h4>
+            <p>Number of frames that are rendered at the same time. Use 0 to use all but one CPU cores.</p>
+            <h4>Create video</h4>
+            <p>Also encode the frames to an MP4 video. This requires <i>ffmpeg</i> to be installed.</p>
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """Here we define the inputs and output of the algorithm"""
+        self.addParameter(
+            QgsProcessingParameterFile(self.GRIDADMIN_INPUT, self.tr("Gridadmin.h5 file"), extension="h5")
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(self.RESULTS_3DI_INPUT, self.tr("Results_3di.nc file"), extension="nc")
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                name=self.VARIABLE_INPUT,
+                description=self.tr("Variable"),
+                options=[f"{v.verbose_name} [{v.unit}]" for v in self.VARIABLES],
+                defaultValue=self.VARIABLES.index(WATERLEVEL),
+            )
+        )
+        self.addParameter(
+            ProcessingParameterNetcdfNumber(
+                name=self.START_STEP_INPUT,
+                description=self.tr("First timestep"),
+                defaultValue=-1,
+                parentParameterName=self.RESULTS_3DI_INPUT,
+            )
+        )
+        self.addParameter(
+            ProcessingParameterNetcdfNumber(
+                name=self.END_STEP_INPUT,
+                description=self.tr("Last timestep"),
+                defaultValue=-2,
+                parentParameterName=self.RESULTS_3DI_INPUT,
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.PIXEL_SIZE_INPUT,
+                description=self.tr("Pixel size"),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0.001,
+                defaultValue=10,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.WORKERS_INPUT,
+                description=self.tr("Number of worker processes"),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name=self.VIDEO_INPUT,
+                description=self.tr("Create video"),
+                defaultValue=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.FRAME_RATE_INPUT,
+                description=self.tr("Video frame rate [frames/s]"),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=10,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.OUTPUT_DIRECTORY,
+                self.tr("Destination folder for the frames"),
+                behavior=QgsProcessingParameterFile.Folder,
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        gridadmin_path = parameters[self.GRIDADMIN_INPUT]
+        results_3di_path = parameters[self.RESULTS_3DI_INPUT]
+        variable = self.VARIABLES[self.parameterAsEnum(parameters, self.VARIABLE_INPUT, context)].name
+        step = parameters[self.START_STEP_INPUT]
+        endstep = parameters[self.END_STEP_INPUT]
+        if endstep:
+            if endstep <= step:
+                feedback.reportError(
+                    "The last timestep should be larger than the first timestep.",
+                    fatalError=True,
+                )
+                return {}
+        else:
+            endstep = step + 1
+        pixel_size = self.parameterAsDouble(parameters, self.PIXEL_SIZE_INPUT, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS_INPUT, context) or None
+        create_video = self.parameterAsBool(parameters, self.VIDEO_INPUT, context)
+        frame_rate = self.parameterAsInt(parameters, self.FRAME_RATE_INPUT, context)
+        output_location = parameters[self.OUTPUT_DIRECTORY]
+        if not output_location:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.OUTPUT_DIRECTORY))
+        os.makedirs(output_location, exist_ok=True)
+
+        threedi_result = ThreediResult(results_3di_path, gridadmin_path)
+        if variable not in threedi_result.available_subgrid_map_vars:
+            raise QgsProcessingException(f"Variable '{variable}' is not available in {results_3di_path}")
+
+        feedback.setProgressText("Rasterize computational grid...")
+        cells = threedi_result.gridadmin.cells.subset("2D_OPEN_WATER")
+        cell_ids = cells.id
+        bottom_levels = cells.dmax
+        labels, geotransform = cell_label_image(cells.cell_coords, pixel_size)
+
+        feedback.setProgressText("Calculate legend classes...")
+        if NEGATIVE_POSSIBLE[variable]:
+            lower_threshold = float("-Inf")
+        else:
+            lower_threshold = DEFAULT_LOWER_THRESHOLD
+        class_bounds = np.asarray(
+            threedi_result_legend_class_bounds(
+                threedi_result=threedi_result,
+                groundwater=False,
+                variable=variable,
+                absolute=False,
+                lower_threshold=lower_threshold,
+                lower_cutoff_percentile=2,
+                upper_cutoff_percentile=98,
+                relative_to_t0=False,
+                method="pretty",
+            ),
+            dtype=float,
+        )
+        table = color_table(COLOR_RAMP_OCEAN_HALINE.colors, len(class_bounds) - 1)
+
+        model_instance = threedi_result.result_admin.get_model_instance_by_field_name(variable)
+
+        def frames():
+            for chunk_start in range(step, endstep, READ_CHUNK_SIZE):
+                chunk_end = min(chunk_start + READ_CHUNK_SIZE, endstep)
+                timeseries = model_instance.timeseries(indexes=slice(chunk_start, chunk_end))
+                values = threedi_result.get_timeseries_values(timeseries, variable)[:, cell_ids]
+                values = values.astype(float)
+                if variable == WATERLEVEL.name:
+                    # dry cells are shown with their bottom level, like in the animation tool
+                    dry = values == NO_DATA_VALUE
+                    values[dry] = np.broadcast_to(bottom_levels, values.shape)[dry]
+                else:
+                    values[values == NO_DATA_VALUE] = np.nan
+                for i, frame_values in enumerate(values):
+                    frame_path = Path(output_location) / FRAME_NAME_TEMPLATE.format(chunk_start + i - step)
+                    yield frame_path, frame_values
+
+        nr_frames = endstep - step
+
+        def progress(nr_done):
+            feedback.setProgress(100 * nr_done / nr_frames)
+            if feedback.isCanceled():
+                raise CancelError()
+
+        feedback.setProgressText(f"Render {nr_frames} frames...")
+        try:
+            frame_paths = export_frames(
+                frames(),
+                labels=labels,
+                class_bounds=class_bounds,
+                table=table,
+                geotransform=geotransform,
+                workers=workers,
+                progress_func=progress,
+            )
+        except CancelError:
+            return {}
+
+        results = {self.OUTPUT_DIRECTORY: output_location}
+        if create_video:
+            feedback.setProgressText("Create video...")
+            video_path = Path(output_location) / f"{variable}.mp4"
+            try:
+                frames_to_video(
+                    Path(output_location) / FRAME_NAME_TEMPLATE.replace("{:05d}", "%05d"),
+                    video_path,
+                    frame_rate=frame_rate,
+                )
+                results["VIDEO"] = str(video_path)
+            except (FileNotFoundError, subprocess.CalledProcessError) as e:
+                logger.exception(e)
+                feedback.reportError(f"Unable to create video: {e}")
+
+        feedback.pushInfo(f"Exported {len(frame_paths)} frames to {output_location}")
+        return results
@@ -40,6 +40,7 @@ from qgis.core import QgsFields
 from qgis.core import QgsMarkerSymbol
 from qgis.core import QgsProcessing
 from qgis.core import QgsProcessingAlgorithm
+from qgis.core import QgsProcessingParameterBoolean
 from qgis.core import QgsProcessingContext
 from qgis.core import QgsProcessingParameterNumber
 from qgis.core import QgsProcessingParameterEnum
@@ -65,6 +66,8 @@ from threedigrid.admin.constants import TYPE_V2_ORIFICE
 from threedigrid.admin.constants import TYPE_V2_WEIR
 
 from threedi_results_analysis.processing.deps.discharge.cross_sectional_discharge import left_to_right_discharge_ogr
+from threedi_results_analysis.processing.deps.discharge.cross_sectional_discharge import left_to_right_discharges
+from threedi_results_analysis.processing.deps.discharge.cross_sectional_discharge import left_to_right_flowlines_ogr
 
 MEMORY_DRIVER = ogr.GetDriverByName("MEMORY")
 STYLE_DIR = Path(__file__).parent / "styles"
@@ -114,6 +117,7 @@ class CrossSectionalDischargeAlgorithm(QgsProcessingAlgorithm):
     SUBSET = "SUBSET"
     INCLUDE_TYPES_1D = "INCLUDE_TYPES_1D"
     FIELD_NAME_INPUT = "FIELD_NAME_INPUT"
+    SINGLE_PASS = "SINGLE_PASS"
     OUTPUT_CROSS_SECTION_LINES = "OUTPUT_CROSS_SECTION_LINES"
     OUTPUT_FLOWLINES = "OUTPUT_FLOWLINES"
     OUTPUT_TIME_SERIES = "OUTPUT_TIME_SERIES"
@@ -198,6 +202,14 @@ class CrossSectionalDischargeAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SINGLE_PASS,
+                self.tr("Read the discharges of all cross-section lines at once"),
+                defaultValue=True,
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterString(
                 self.FIELD_NAME_INPUT,
@@ -263,6 +275,7 @@ class CrossSectionalDischargeAlgorithm(QgsProcessingAlgorithm):
         self.field_name = self.parameterAsString(
             parameters, self.FIELD_NAME_INPUT, context
         )
+        single_pass = self.parameterAsBool(parameters, self.SINGLE_PASS, context)
         self.csv_output_file_path = self.parameterAsFileOutput(
             parameters, self.OUTPUT_TIME_SERIES, context
         )
@@ -324,27 +337,52 @@ class CrossSectionalDischargeAlgorithm(QgsProcessingAlgorithm):
         else:
             iterator = cross_section_lines.getFeatures()
             nr_features = cross_section_lines.featureCount()
-        for i, gauge_line in enumerate(iterator):
-            if feedback.isCanceled():
-                return {}
-            feedback.setProgressText(
-                f"Processing cross-section line {gauge_line.id()}..."
-            )
+        gauge_lines = list(iterator)
+        shapely_linestrings = []
+        for gauge_line in gauge_lines:
             transformed_geometry = gauge_line.geometry()
             transformed_geometry.transform(coordinate_transform)
-            shapely_linestring = wkt.loads(transformed_geometry.asWkt())
-            tgt_ds = MEMORY_DRIVER.CreateDataSource("")
-            ts_gauge_line, total_discharge = left_to_right_discharge_ogr(
+            shapely_linestrings.append(wkt.loads(transformed_geometry.asWkt()))
+        if single_pass:
+            # read the discharges of the flowlines of all cross-section lines once
+            feedback.setProgressText("Calculate discharges of all cross-section lines...")
+            discharges = left_to_right_discharges(
                 gr=gr,
-                gridadmin_gpkg=gridadmin_gpkg,
-                gauge_line=shapely_linestring,
-                tgt_ds=tgt_ds,
-                gauge_line_id=gauge_line.id(),
+                gauge_lines=shapely_linestrings,
                 start_time=start_time,
                 end_time=end_time,
                 subset=subset,
                 content_types=content_types,
             )
+        for i, (gauge_line, shapely_linestring) in enumerate(zip(gauge_lines, shapely_linestrings)):
+            if feedback.isCanceled():
+                return {}
+            feedback.setProgressText(
+                f"Processing cross-section line {gauge_line.id()}..."
+            )
+            tgt_ds = MEMORY_DRIVER.CreateDataSource("")
+            if single_pass:
+                flowline_ids, is_left_to_right, ts_gauge_line, q_net_sum_left_to_right, total_discharge = discharges[i]
+                left_to_right_flowlines_ogr(
+                    tgt_ds=tgt_ds,
+                    gridadmin_gpkg=gridadmin_gpkg,
+                    flowline_ids=flowline_ids,
+                    is_left_to_right=is_left_to_right,
+                    q_net_sum_left_to_right=q_net_sum_left_to_right,
+                    gauge_line_id=gauge_line.id(),
+                )
+            else:
+                ts_gauge_line, total_discharge = left_to_right_discharge_ogr(
+                    gr=gr,
+                    gridadmin_gpkg=gridadmin_gpkg,
+                    gauge_line=shapely_linestring,
+                    tgt_ds=tgt_ds,
+                    gauge_line_id=gauge_line.id(),
+                    start_time=start_time,
+                    end_time=end_time,
+                    subset=subset,
+                    content_types=content_types,
+                )
             feedback.pushInfo(
                 f"Net sum of discharge for cross-section line {gauge_line.id()}: {total_discharge}"
             )
@@ -485,6 +523,8 @@ class CrossSectionalDischargeAlgorithm(QgsProcessingAlgorithm):
             <p>Further filtering of specific 1D flowlines. This setting does not affect 2D or 1D/2D flowlines.</p>
             <h4>Output field name</h4>
             <p>Name of the field in the <i>cross-section lines</i> layer to which total net discharge will be written.</p>
+            <h4>Read the discharges of all cross-section lines at once</h4>
+            <p>Read the discharge time series of the flowlines that intersect any of the cross-section lines once, instead of once per cross-section line. This is faster if there are many cross-section lines, but the time series of all these flowlines are kept in memory. The results are the same.</p>
             <h3>Outputs</h3>
             <h4>Total net discharge per cross-section line</h4>
             <p>This result will be written to the <i>cross-section lines</i> layer, in a field specified by <i>output field name</i>. This field will be created if it does not exist.</p>
@@ -1,9 +1,12 @@
 import numpy as np
-from typing import List, Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 from osgeo import ogr
+from scipy import sparse
 
-from shapely.geometry import Point, LineString, MultiLineString, MultiPoint
+import shapely
+from shapely.geometry import LineString, MultiLineString
+from shapely.strtree import STRtree
 from threedigrid.admin.gridresultadmin import GridH5ResultAdmin
 from threedigrid.admin.lines.models import Lines
 
@@ -29,91 +32,79 @@ Q_NET_SUM = Aggregation(
 )
 
 
-def intersected_segments(
-    line: Union[LineString, MultiLineString], intersecting_line: LineString
-) -> List[LineString]:
+def line_segments(line: Union[LineString, MultiLineString]) -> np.ndarray:
     """
-    Returns the segments of `line` that are intersected by `intersecting_line`.
-
-    If a line segment is intersected multiple times, it is returned multiple times.
+    Returns the segments of all parts of `line` as an array of LineStrings with 2 vertices
     """
-    if not line.intersects(intersecting_line):
-        return []
-    if type(line) == MultiLineString:
-        lines = line.geoms
-    elif type(line) == LineString:
-        lines = [line]
-    else:
-        raise TypeError("line is not a LineString or MultiLinestring")
-    for single_line in lines:
-        line_segments = [
-            LineString([single_line.coords[i], single_line.coords[i + 1]])
-            for i in range(len(single_line.coords) - 1)
-        ]
-        intersection = single_line.intersection(intersecting_line)
-        intersection_points = (
-            intersection.geoms
-            if type(intersection) == MultiPoint
-            else [intersection]
-        )
-        result = []
-        for line_segment in line_segments:
-            for point in intersection_points:
-                if point.distance(line_segment) < 10e-9:
-                    result.append(line_segment)
-    return result
+    coords, part_indices = shapely.get_coordinates(shapely.get_parts(line), return_index=True)
+    same_part = part_indices[:-1] == part_indices[1:]
+    return shapely.linestrings(np.stack([coords[:-1][same_part], coords[1:][same_part]], axis=1))
 
 
-def is_left_of_line(point: Point, line: LineString) -> Union[bool, None]:
+def flowline_start_nodes_left_of_line(
+    flowlines: Lines, gauge_line: Union[LineString, MultiLineString]
+) -> List[Optional[bool]]:
     """
-    Is `point` to the left of `line`?
+    For each flowline that intersects `gauge_line`, is its start node to the left of the gauge line segment it
+    intersects? None if the start node intersects the gauge line
 
-    Returns None if `point` intersects `line`
+    All flowlines are tested against all gauge line segments at once
 
-    Based on:
-    https://stackoverflow.com/questions/1560492/how-to-tell-whether-a-point-is-to-the-right-or-left-side-of-a-line
-
-    :param point: the Point to analyse
-    :param line: LineString with 2 vertices
+    :raises ValueError: if a flowline intersects more than one gauge line segment
     """
-    assert len(line.coords) == 2
-    if point.intersects(line):
-        return None
-    start, end = [Point(coord) for coord in line.coords]
-    return (
-        (end.x - start.x) * (point.y - start.y)
-        - (end.y - start.y) * (point.x - start.x)
-    ) > 0
+    if flowlines.count == 0:
+        return []
+    flowline_coords = np.asarray(flowlines.line_coords, dtype=float).T.reshape(-1, 2, 2)
+    segments = line_segments(gauge_line)
+    flowline_indices, segment_indices = STRtree(segments).query(
+        shapely.linestrings(flowline_coords), predicate="intersects"
+    )
+    multiple_intersections = np.bincount(flowline_indices, minlength=len(flowline_coords)) > 1
+    if np.any(multiple_intersections):
+        raise ValueError(
+            f"Gauge line intersects flowline {flowlines.id[np.argmax(multiple_intersections)]} multiple times"
+        )
+    order = np.argsort(flowline_indices)
+    flowline_indices = flowline_indices[order]
+    segment_indices = segment_indices[order]
 
+    start_points = flowline_coords[flowline_indices, 0]
+    segment_starts, segment_ends = np.moveaxis(
+        shapely.get_coordinates(segments).reshape(-1, 2, 2)[segment_indices], 1, 0
+    )
+    cross_products = (
+        (segment_ends[:, 0] - segment_starts[:, 0]) * (start_points[:, 1] - segment_starts[:, 1])
+        - (segment_ends[:, 1] - segment_starts[:, 1]) * (start_points[:, 0] - segment_starts[:, 0])
+    )
+    on_line = shapely.intersects(shapely.points(start_points), segments[segment_indices])
+    return [None if on else bool(left) for on, left in zip(on_line, cross_products > 0)]
 
-def flowline_start_nodes_left_of_line(
-    flowlines: Lines, gauge_line: LineString
-) -> List[bool]:
-    result = []
-    for i in range(flowlines.count):
-        line_coords = flowlines.line_coords[:, i]
-        shapely_flowline = LineString(
-            [
-                Point((line_coords[0], line_coords[1])),
-                Point((line_coords[2], line_coords[3])),
-            ]
-        )
-        gauge_line_segments = intersected_segments(
-            line=gauge_line, intersecting_line=shapely_flowline
-        )
-        if len(gauge_line_segments) == 0:
-            continue
-        elif len(gauge_line_segments) > 1:
-            raise ValueError(
-                f"Gauge line intersects flowline {flowlines.id[i]} multiple times"
-            )
-        else:
-            gauge_line_segment = gauge_line_segments[0]
-        shapely_flowline_start_point = Point(flowlines.line_coords[0:2, i])
-        result.append(
-            is_left_of_line(shapely_flowline_start_point, gauge_line_segment)
+
+def intersecting_flowlines(
+    gr: GridH5ResultAdmin,
+    gauge_line: LineString,
+    subset: str = None,
+    content_types: List[str] = None,
+) -> Lines:
+    """
+    Return the flowlines that intersect `gauge_line`, see left_to_right_discharge() for `subset` and `content_types`
+    """
+    intersecting_lines = gr.lines.filter(
+        line_coords__intersects_bbox=gauge_line.bounds
+    ).filter(line_coords__intersects_geometry=gauge_line)
+    if subset:
+        intersecting_lines = intersecting_lines.subset(subset)
+    if content_types:
+        # filtering on content_type only affects flowlines with a content_type (i.e. 1D flowlines)
+        # therefore we append b''
+        # 1D/2D flowlines between an added calculation point and a 2D node should are not affected either
+        # therefore we append v2_added_c
+        # convert to bytes because filtering with a mix of empty and non-empty strings does not work otherwise
+        content_types = [s.encode("utf-8") for s in list(content_types) + ["", "v2_added_c"]]
+        intersecting_lines = intersecting_lines.filter(
+            content_type__in=content_types
         )
-    return result
+    return intersecting_lines
 
 
 def left_to_right_discharge(
@@ -136,23 +127,9 @@ def left_to_right_discharge(
     sum of net discharge per flowline in left -> right direction,
     total left -> right discharge
     """
-    intersecting_lines = gr.lines.filter(
-        line_coords__intersects_bbox=gauge_line.bounds
-    ).filter(line_coords__intersects_geometry=gauge_line)
-    if subset:
-        intersecting_lines = intersecting_lines.subset(subset)
-    if content_types:
-        # filtering on content_type only affects flowlines with a content_type (i.e. 1D flowlines)
-        # therefore we append b''
-        content_types.append("")
-        # 1D/2D flowlines between an added calculation point and a 2D node should are not affected either
-        # therefore we append v2_added_c
-        content_types.append("v2_added_c")
-        # convert to bytes because filtering with a mix of empty and non-empty strings does not work otherwise
-        content_types = [s.encode("utf-8") for s in content_types]
-        intersecting_lines = intersecting_lines.filter(
-            content_type__in=content_types
-        )
+    intersecting_lines = intersecting_flowlines(
+        gr=gr, gauge_line=gauge_line, subset=subset, content_types=content_types
+    )
     ts, tintervals = prepare_timeseries(
         threedigrid_object=intersecting_lines,
         start_time=start_time,
@@ -187,6 +164,129 @@ def left_to_right_discharge(
     )
 
 
+def left_to_right_discharges(
+    gr: GridH5ResultAdmin,
+    gauge_lines: Sequence[LineString],
+    start_time: float = None,
+    end_time: float = None,
+    subset: str = None,
+    content_types: List[str] = None,
+) -> List[Tuple[np.array, List[bool], np.array, np.array, float]]:
+    """
+    Calculate the total net discharge from the left to the right of each of the `gauge_lines`
+
+    The discharge timeseries of the union of the flowlines that intersect any gauge line are read once. The
+    timeseries of the gauge lines are the product of a sparse (gauge line x flowline) matrix of directions (1 for
+    left -> right, -1 for right -> left, 0 if the gauge line does not intersect the flowline) and these timeseries.
+
+    See left_to_right_discharge() for the arguments
+
+    :returns: for each gauge line, a tuple of: ids of the flowlines that intersect the gauge line,
+    List of boolean values indicating if these lines' drawing directions are left-to-right
+    timeseries of total discharge in left -> right direction,
+    sum of net discharge per flowline in left -> right direction,
+    total left -> right discharge
+    """
+    gauge_lines__flowline_ids = []
+    gauge_lines__is_left_to_right = []
+    for gauge_line in gauge_lines:
+        intersecting_lines = intersecting_flowlines(
+            gr=gr, gauge_line=gauge_line, subset=subset, content_types=content_types
+        )
+        gauge_lines__flowline_ids.append(np.asarray(intersecting_lines.id))
+        gauge_lines__is_left_to_right.append(
+            flowline_start_nodes_left_of_line(flowlines=intersecting_lines, gauge_line=gauge_line)
+        )
+
+    flowlines = gr.lines.filter(id__in=np.unique(np.concatenate(gauge_lines__flowline_ids + [[]]).astype(int)))
+    ts, tintervals = prepare_timeseries(
+        threedigrid_object=flowlines,
+        start_time=start_time,
+        end_time=end_time,
+        aggregation=Q_NET_SUM,
+    )
+    agg_by_flowline = aggregate_prepared_timeseries(
+        timeseries=ts,
+        tintervals=tintervals,
+        start_time=start_time,
+        aggregation=Q_NET_SUM,
+    )
+
+    flowline_order = np.argsort(flowlines.id)
+    gauge_lines__columns = [
+        flowline_order[np.searchsorted(flowlines.id[flowline_order], flowline_ids)]
+        for flowline_ids in gauge_lines__flowline_ids
+    ]
+    gauge_lines__direction = [
+        np.where(is_left_to_right, 1, -1) for is_left_to_right in gauge_lines__is_left_to_right
+    ]
+    directions = sparse.csr_matrix(
+        (
+            np.concatenate(gauge_lines__direction + [[]]),
+            (
+                np.repeat(np.arange(len(gauge_lines)), [len(columns) for columns in gauge_lines__columns]),
+                np.concatenate(gauge_lines__columns + [[]]).astype(int),
+            ),
+        ),
+        shape=(len(gauge_lines), len(flowline_order)),
+    )
+    ts_values_gauge_lines = (directions @ np.asarray(ts).T).T
+    summed_vals = directions @ np.nan_to_num(agg_by_flowline)
+    if not start_time:
+        start_time = 0
+    timesteps = np.cumsum(np.concatenate(([0], tintervals[:-1]))) + start_time
+
+    return [
+        (
+            gauge_lines__flowline_ids[i],
+            gauge_lines__is_left_to_right[i],
+            np.column_stack([timesteps, ts_values_gauge_lines[:, i]]),
+            agg_by_flowline[gauge_lines__columns[i]] * gauge_lines__direction[i],
+            summed_vals[i],
+        )
+        for i in range(len(gauge_lines))
+    ]
+
+
+def left_to_right_flowlines_ogr(
+    tgt_ds: ogr.DataSource,
+    gridadmin_gpkg: str,
+    flowline_ids: Sequence[int],
+    is_left_to_right: List[bool],
+    q_net_sum_left_to_right: np.array,
+    gauge_line_id: int = None,
+):
+    """
+    Write the flowlines with attribute 'q_net_sum' to provided `tgt_ds`, reversing the flowlines whose start vertex
+    is left of the gauge line
+    """
+    attributes = {
+        "gauge_line_id": [gauge_line_id] * len(flowline_ids),
+        "q_net_sum": q_net_sum_left_to_right,
+    }
+    attr_data_types = {
+        "gauge_line_id": ogr.OFTInteger,
+        "q_net_sum": ogr.OFTReal,
+    }
+
+    threedigrid_to_ogr(
+        tgt_ds=tgt_ds,
+        layer_name="flowline",
+        gridadmin_gpkg=gridadmin_gpkg,
+        attributes=attributes,
+        attr_data_types=attr_data_types,
+        ids=list(flowline_ids),
+    )
+    ogr_lyr = tgt_ds.GetLayerByName("flowline")
+    features = [feature for i, feature in enumerate(ogr_lyr) if is_left_to_right[i]]
+    reversed_geometries = shapely.to_wkb(
+        shapely.reverse(shapely.from_wkb([bytes(feature.GetGeometryRef().ExportToWkb()) for feature in features]))
+    )
+    for feature, reversed_geometry in zip(features, reversed_geometries):
+        feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(reversed_geometry))
+        ogr_lyr.SetFeature(feature)
+
+
 def left_to_right_discharge_ogr(
     gr: GridH5ResultAdmin,
     gridadmin_gpkg: str,
@@ -223,34 +323,13 @@ def left_to_right_discharge_ogr(
         subset=subset,
         content_types=content_types,
     )
-    gauge_line_ids = [gauge_line_id] * intersecting_lines.count
-    attributes = {
-        "gauge_line_id": gauge_line_ids,
-        "q_net_sum": q_net_sum_left_to_right,
-    }
-    attr_data_types = {
-        "gauge_line_id": ogr.OFTInteger,
-        "q_net_sum": ogr.OFTReal,
-    }
-
-    threedigrid_to_ogr(
+    left_to_right_flowlines_ogr(
         tgt_ds=tgt_ds,
-        layer_name="flowline",
         gridadmin_gpkg=gridadmin_gpkg,
-        attributes=attributes,
-        attr_data_types=attr_data_types,
-        ids=list(intersecting_lines.id),
+        flowline_ids=intersecting_lines.id,
+        is_left_to_right=is_left_to_right,
+        q_net_sum_left_to_right=q_net_sum_left_to_right,
+        gauge_line_id=gauge_line_id,
     )
-    ogr_lyr = tgt_ds.GetLayerByName("flowline")
-    for i, feature in enumerate(ogr_lyr):
-        if is_left_to_right[i]:
-            geom = feature.GetGeometryRef()
-            points = geom.GetPoints()
-            points.reverse()
-            reversed_geom = ogr.Geometry(ogr.wkbLineString)
-            for point in points:
-                reversed_geom.AddPoint(*point)
-            feature.SetGeometryDirectly(reversed_geom)
-            ogr_lyr.SetFeature(feature)
 
     return ts_gauge_line, summed_vals
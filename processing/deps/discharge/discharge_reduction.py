@@ -31,6 +31,100 @@ from threedigrid.admin.gridresultadmin import GridH5ResultAdmin
 OLD = "OLD"
 NEW = "NEW"
 
+# Maximum number of exchange levels and water levels of the edges whose discharge reduction is calculated at once.
+# count_below() sorts these together, which takes several times their size in memory
+MAX_CHUNK_ELEMENTS = 10 ** 7
+
+
+def count_below(sorted_values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    For each row i and column j, count the values in `sorted_values[i]` that are smaller than `queries[i, j]`
+
+    All rows are searched at once by sorting the values and the queries of all rows together.
+
+    :param sorted_values: 2D array, sorted along axis 1, NaN values at the end of each row
+    :param queries: 2D array with the same number of rows as `sorted_values`. NaN queries have a count of 0
+    """
+    nr_rows, nr_values = sorted_values.shape
+    nr_queries = queries.shape[1]
+    rows = np.concatenate([np.repeat(np.arange(nr_rows), nr_values), np.repeat(np.arange(nr_rows), nr_queries)])
+    values = np.concatenate([sorted_values.ravel(), queries.ravel()])
+    is_value = np.concatenate([np.ones(sorted_values.size, dtype=int), np.zeros(queries.size, dtype=int)])
+    # queries are sorted before values that are equal to them, so that only smaller values are counted
+    order = np.lexsort((is_value, values, rows))
+    nr_values_up_to = np.cumsum(is_value[order])
+    query_positions = np.empty(queries.size, dtype=int)
+    query_positions[order[is_value[order] == 0] - sorted_values.size] = np.flatnonzero(is_value[order] == 0)
+    result = nr_values_up_to[query_positions].reshape(queries.shape) - np.arange(nr_rows)[:, np.newaxis] * nr_values
+    result[np.isnan(queries)] = 0
+    return result
+
+
+def wet_cross_sections(
+        bed_levels: np.ndarray,
+        water_levels: np.ndarray,
+        pixel_size: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the wet cross-sectional areas and wetted perimeters of cross-sections for multiple water levels
+
+    Only the horizontal wet surface is included in the wetted perimeter.
+
+    :param bed_levels: 2D array, one row per cross-section, padded with NaN
+    :param water_levels: 2D array, one row per cross-section, one column per water level
+    :returns: wet cross-sectional areas and wetted perimeters, both with the shape of `water_levels`
+    """
+    sorted_bed_levels = np.sort(bed_levels, axis=1)
+    nr_wet = count_below(sorted_bed_levels, water_levels)
+    # the sum of the water depths is nr_wet * water level - the sum of the wet bed levels. Levels are taken relative
+    # to the lowest bed level to limit the loss of precision in this subtraction
+    lowest_bed_levels = np.nan_to_num(sorted_bed_levels[:, :1])
+    cumulative_bed_levels = np.hstack([
+        np.zeros((len(bed_levels), 1)),
+        np.cumsum(np.nan_to_num(sorted_bed_levels - lowest_bed_levels), axis=1)
+    ])
+    sum_wet_bed_levels = np.take_along_axis(cumulative_bed_levels, nr_wet, axis=1)
+    water_depth_sums = np.where(
+        nr_wet > 0,
+        nr_wet * np.nan_to_num(water_levels - lowest_bed_levels) - sum_wet_bed_levels,
+        0
+    )
+    return np.maximum(water_depth_sums, 0) * pixel_size, nr_wet * pixel_size
+
+
+def discharge_reduction_factors(
+        exchange_levels: np.ndarray,
+        old_crest_levels: np.ndarray,
+        new_crest_levels: np.ndarray,
+        water_levels: np.ndarray,
+        pixel_size: float
+) -> np.ndarray:
+    """
+    Calculate the discharge reduction factors of multiple cross-sections for multiple water levels
+
+    See EdgeWithDischargeThreshold.discharge_reduction_factors()
+
+    :param exchange_levels: 2D array, one row per cross-section, padded with NaN
+    :param old_crest_levels: 1D array, crest level of the existing obstacle of each cross-section
+    :param new_crest_levels: 1D array, crest level of the new obstacle of each cross-section
+    :param water_levels: 2D array, one row per cross-section, one column per water level
+    :returns: array with the shape of `water_levels`
+    """
+    old_areas, old_perimeters = wet_cross_sections(
+        bed_levels=np.maximum(exchange_levels, old_crest_levels[:, np.newaxis]),
+        water_levels=water_levels,
+        pixel_size=pixel_size
+    )
+    new_areas, new_perimeters = wet_cross_sections(
+        bed_levels=np.maximum(exchange_levels, new_crest_levels[:, np.newaxis]),
+        water_levels=water_levels,
+        pixel_size=pixel_size
+    )
+    result = np.zeros(water_levels.shape)
+    wet = (old_perimeters > 0) & (new_perimeters > 0)
+    result[wet] = np.sqrt(new_areas[wet] / new_perimeters[wet]) / np.sqrt(old_areas[wet] / old_perimeters[wet])
+    return result
+
 
 class LeakDetectorWithDischargeThreshold(LeakDetector):
     # TODO: re-implement result_edges() and result_obstacles()
@@ -52,7 +146,9 @@ class LeakDetectorWithDischargeThreshold(LeakDetector):
             obstacles: List[Tuple[LineString, float]] = None,
             feedback=None,
             start_time: float = None,
-            end_time: float = None
+            end_time: float = None,
+            tile_size: int = None,
+            cache_prepared_grid: bool = False
     ):
         """
         Initialize LeakDetector with GridH5ResultAdmin instead of GridH5Admin
@@ -88,7 +184,9 @@ class LeakDetectorWithDischargeThreshold(LeakDetector):
             search_precision=search_precision,
             min_peak_prominence=min_peak_prominence,
             obstacles=obstacles,
-            feedback=feedback
+            feedback=feedback,
+            tile_size=tile_size,
+            cache_prepared_grid=cache_prepared_grid
         )
 
         # convert edges to EdgeWithDischargeThreshold
@@ -107,8 +205,8 @@ class LeakDetectorWithDischargeThreshold(LeakDetector):
         self.water_levels = None
         self.tintervals = None
 
-    def run(self, feedback=None):
-        super().run(feedback)
+    def run(self, feedback=None, workers: int = 1):
+        super().run(feedback, workers=workers)
         self.calculate_water_levels_at_cross_section(feedback)
         self.calculate_discharge_reduction(feedback)
 
@@ -138,11 +236,34 @@ class LeakDetectorWithDischargeThreshold(LeakDetector):
             feedback.pushInfo(f"{datetime.now()}")
             feedback.setProgressText("Calculate discharge reduction...")
 
-        for i, edge in enumerate(self.edges):
-            if feedback:
-                feedback.setProgress(100 * i / len(self.edges))
-            if edge.obstacles:  # skip if no obstacle has been identified
-                edge.calculate_discharge_reduction()
+        edges = [edge for edge in self.edges if edge.obstacles]  # skip if no obstacle has been identified
+        if not edges:
+            return
+        max_nr_exchange_levels = max(len(edge.exchange_levels) for edge in edges)
+        chunk_size = max(MAX_CHUNK_ELEMENTS // (max_nr_exchange_levels + len(self.tintervals)), 1)
+        discharges_with_obstacle = np.concatenate([
+            self._discharges_with_obstacle(edges[i:i + chunk_size]) for i in range(0, len(edges), chunk_size)
+        ])
+        for edge, discharge_with_obstacle in zip(edges, discharges_with_obstacle):
+            edge.discharge_with_obstacle = discharge_with_obstacle
+            edge.discharge_reduction = abs(discharge_with_obstacle - edge.discharge_without_obstacle)
+        if feedback:
+            feedback.setProgress(100)
+
+    def _discharges_with_obstacle(self, edges: List["EdgeWithDischargeThreshold"]) -> np.ndarray:
+        """Return the net cumulative discharge of each edge when its highest obstacle is applied"""
+        max_nr_exchange_levels = max(len(edge.exchange_levels) for edge in edges)
+        exchange_levels = np.full((len(edges), max_nr_exchange_levels), np.nan)
+        for i, edge in enumerate(edges):
+            exchange_levels[i, :len(edge.exchange_levels)] = edge.exchange_levels
+        factors = discharge_reduction_factors(
+            exchange_levels=exchange_levels,
+            old_crest_levels=np.array([edge.obstacle_crest_level(OLD) for edge in edges]),
+            new_crest_levels=np.array([edge.obstacle_crest_level(NEW) for edge in edges]),
+            water_levels=np.vstack([edge.water_levels_at_cross_section for edge in edges]),
+            pixel_size=self.dem.RasterXSize
+        )
+        return np.nansum(np.vstack([edge.discharges for edge in edges]) * factors * self.tintervals, axis=1)
 
     def flowlines_with_high_discharge_reduction(self) -> List[int]:
         """Return a list of ids of flowlines for which the discharge reduction exceeds the threshold"""
@@ -217,7 +338,11 @@ class EdgeWithDischargeThreshold(Edge):
         result["discharge_reduction"] = self.discharge_reduction
         return result
 
-    def _get_obstacle_crest_level(self, which_obstacle: str):
+    def obstacle_crest_level(self, which_obstacle: str) -> float:
+        """
+        Return the crest level of the existing (OLD) obstacle, i.e. the exchange level, or the NEW obstacle, i.e. the
+        highest obstacle that has been found. Falls back to the lowest exchange level.
+        """
         if which_obstacle == OLD:
             obstacle_crest_level = self.exchange_level
         elif which_obstacle == NEW:
@@ -227,28 +352,20 @@ class EdgeWithDischargeThreshold(Edge):
         obstacle_crest_level = np.min(self.exchange_levels) if obstacle_crest_level is None else obstacle_crest_level
         return obstacle_crest_level
 
-    def wet_cross_sectional_area(self, water_level: float, which_obstacle: str):
+    def wet_cross_section(self, water_levels: np.ndarray, which_obstacle: str) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Calculate the wet cross-sectional area from a 1D array of exchange levels (bed level values) and a water level.
-        obstacle_crest_level may be specified to overrule exchange levels that are lower
+        Calculate the wet cross-sectional areas and wetted perimeters for a 1D array of water levels from the exchange
+        levels (bed level values). The crest level of `which_obstacle` overrules exchange levels that are lower.
         """
-        obstacle_crest_level = self._get_obstacle_crest_level(which_obstacle)
-        bed_levels = np.maximum(self.exchange_levels, obstacle_crest_level)
-        water_depths = np.maximum(water_level - np.minimum(water_level, bed_levels), 0)
-        return np.nansum(water_depths * self.ld.dem.RasterXSize)
-
-    def wetted_perimeter(self, water_level: float, which_obstacle: str):
-        """
-        Calculate the wetted perimeter of a 2D cross-section; only the horizontal wet surface are taken into account
-        """
-        obstacle_crest_level = self._get_obstacle_crest_level(which_obstacle)
-        return np.nansum(
-            (
-                np.maximum(self.exchange_levels, obstacle_crest_level) < water_level
-            ) * self.ld.dem.RasterXSize
+        bed_levels = np.maximum(self.exchange_levels, self.obstacle_crest_level(which_obstacle))
+        areas, perimeters = wet_cross_sections(
+            bed_levels=bed_levels[np.newaxis, :],
+            water_levels=np.atleast_1d(water_levels)[np.newaxis, :],
+            pixel_size=self.ld.dem.RasterXSize
         )
+        return areas[0], perimeters[0]
 
-    def discharge_reduction_factor(self, water_level: float):
+    def discharge_reduction_factors(self, water_levels: np.array):
         """
         reduction = Q_new/Q_old
         Based on:
@@ -264,20 +381,16 @@ class EdgeWithDischargeThreshold(Edge):
 
         Assuming C and i are constant, we can ignore them when dividing Q_new by Q_old:
          reduction = (A_new * sqrt(A_new/P_new)) / (A_old * sqrt(A_old/P_old))
-        """
-        old_wet_cross_sectional_area = self.wet_cross_sectional_area(water_level=water_level, which_obstacle=OLD)
-        new_wet_cross_sectional_area = self.wet_cross_sectional_area(water_level=water_level, which_obstacle=NEW)
-        if old_wet_cross_sectional_area == 0 or new_wet_cross_sectional_area == 0:
-            return 0
-        old_wetted_perimeter = self.wetted_perimeter(water_level=water_level, which_obstacle=OLD)
-        new_wetted_perimeter = self.wetted_perimeter(water_level=water_level, which_obstacle=NEW)
-        result = np.sqrt(new_wet_cross_sectional_area / new_wetted_perimeter) / np.sqrt(old_wet_cross_sectional_area / old_wetted_perimeter)
-        return result
 
-    def discharge_reduction_factors(self, water_levels: np.array):
-        """Vectorized version of `discharge_reduction_factor`"""
-        v_discharge_reduction_factors = np.vectorize(self.discharge_reduction_factor, otypes=[float])
-        return v_discharge_reduction_factors(water_levels)
+        See discharge_reduction_factors() for multiple edges at once
+        """
+        return discharge_reduction_factors(
+            exchange_levels=self.exchange_levels[np.newaxis, :],
+            old_crest_levels=np.array([self.obstacle_crest_level(OLD)]),
+            new_crest_levels=np.array([self.obstacle_crest_level(NEW)]),
+            water_levels=np.atleast_1d(water_levels)[np.newaxis, :],
+            pixel_size=self.ld.dem.RasterXSize
+        )[0]
 
     def calculate_discharge_reduction(self):
         """
@@ -1,4 +1,9 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 from datetime import datetime
+from pathlib import Path
+from threading import Lock
 from typing import Dict, Union, List, Tuple, Optional, Iterator
 
 import numpy as np
@@ -6,9 +11,12 @@ from osgeo import gdal
 from shapely.geometry import LineString, Point
 from shapely.strtree import STRtree
 from scipy.ndimage import label, generate_binary_structure
-from scipy.signal import find_peaks
+from scipy.signal import find_peaks, peak_prominences
 from threedigrid.admin.gridadmin import GridH5Admin
 from threedigrid.admin.lines.models import Lines
+from threedi_results_analysis.utils.processes import bounded_map
+from threedi_results_analysis.utils.processes import default_workers
+from threedi_results_analysis.utils.processes import spawn_context
 
 SEARCH_STRUCTURE = generate_binary_structure(2, 2)
 TOP = 'top'
@@ -35,6 +43,10 @@ NEIGH = 'neigh'
 MERGED = 'merged'
 COORD_DECIMALS = 5
 PSEUDO_INFINITE = 9999
+DEM_BLOCK_SIZE = 256 * 1024 ** 2  # maximum size (bytes) of a block of DEM pixels that is read at once
+PARTITIONS_PER_WORKER = 4  # number of spatial partitions of the cell pairs per worker process
+CELL_PAIR_BATCH_SIZE = 1000  # number of cell pairs of which the maxima are found in a single batch
+PREPARED_GRID_CACHE_SIZE = 1  # number of prepared grids that are kept in memory, see PreparedGrid
 
 gdal.UseExceptions()
 
@@ -89,6 +101,107 @@ def read_as_array(
         return arr
 
 
+def pixel_windows(raster: gdal.Dataset, bboxes: np.ndarray, decimals: int = 5) -> np.ndarray:
+    """
+    Return the pixel windows of many bounding boxes at once, in the same way as read_as_array() determines them
+
+    :param bboxes: array of shape (n, 4) with bounding box corner coordinates in the rasters crs: [x0, y0, x1, y1]
+    :returns: int array of shape (n, 4): [row_start, row_end, col_start, col_end], which may be outside the raster
+    """
+    inv_gt = gdal.InvGeoTransform(raster.GetGeoTransform())
+    bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    corners_x = []
+    corners_y = []
+    for x, y in ((bboxes[:, 0], bboxes[:, 1]), (bboxes[:, 2], bboxes[:, 3])):
+        corners_x.append(np.round(inv_gt[0] + x * inv_gt[1] + y * inv_gt[2], decimals))
+        corners_y.append(np.round(inv_gt[3] + x * inv_gt[4] + y * inv_gt[5], decimals))
+    return np.column_stack([
+        np.minimum(*corners_y), np.maximum(*corners_y), np.minimum(*corners_x), np.maximum(*corners_x)
+    ]).astype(int)
+
+
+def read_as_arrays(
+        raster: gdal.Dataset,
+        bboxes: np.ndarray,
+        band_nr: int = 1,
+        max_block_size: int = DEM_BLOCK_SIZE,
+        feedback=None
+) -> List[np.ndarray]:
+    """
+    Read the parts of the raster that intersect with many bounding boxes, in a few large blocks
+
+    Equivalent to calling read_as_array(pad=True) for each bounding box, but the raster is read in blocks of rows
+    that contain many bounding boxes. The pixels of each bounding box are copied out of its block, so that a block is
+    freed as soon as it has been processed, and bounding boxes that overlap do not share pixels.
+
+    :param bboxes: array of shape (n, 4) with bounding box corner coordinates in the rasters crs: [x0, y0, x1, y1]
+    :param max_block_size: maximum size of a block in bytes, unless a single bounding box is larger than that
+    :param feedback: Object that has `setProgress()` and `isCanceled()` methods, like QgsProcessingFeedback
+    """
+    windows = pixel_windows(raster, bboxes)
+    gt = raster.GetGeoTransform()
+    itemsize = gdal.GetDataTypeSize(raster.GetRasterBand(band_nr).DataType) // 8
+    result = [None] * len(windows)
+
+    def read_block(indices):
+        row_start, col_start = windows[indices, 0].min(), windows[indices, 2].min()
+        row_end, col_end = windows[indices, 1].max(), windows[indices, 3].max()
+        block_bbox = [
+            gt[0] + col_start * gt[1], gt[3] + row_end * gt[5], gt[0] + col_end * gt[1], gt[3] + row_start * gt[5]
+        ]
+        block = read_as_array(raster=raster, bbox=block_bbox, band_nr=band_nr, pad=True)
+        for i in indices:
+            r0, r1, c0, c1 = windows[i]
+            result[i] = block[r0 - row_start:r1 - row_start, c0 - col_start:c1 - col_start].copy()
+
+    # group the bounding boxes into blocks of consecutive rows
+    block_indices = []
+    row_start = col_start = row_end = col_end = None
+    for nr_done, i in enumerate(np.argsort(windows[:, 0], kind="stable")):
+        r0, r1, c0, c1 = windows[i]
+        if block_indices:
+            new_size = (max(row_end, r1) - row_start) * (max(col_end, c1) - min(col_start, c0)) * itemsize
+            if new_size > max_block_size:
+                read_block(block_indices)
+                block_indices = []
+                if feedback:
+                    if feedback.isCanceled():
+                        return result
+                    feedback.setProgress(100 * nr_done / len(windows))
+        if not block_indices:
+            row_start, row_end, col_start, col_end = r0, r1, c0, c1
+        block_indices.append(i)
+        row_end, col_start, col_end = max(row_end, r1), min(col_start, c0), max(col_end, c1)
+    if block_indices:
+        read_block(block_indices)
+    return result
+
+
+def find_peaks_batched(profiles: List[np.ndarray], prominence: float) -> List[np.ndarray]:
+    """
+    Return the indices of the peaks in each of the `profiles`, like `scipy.signal.find_peaks(profile,
+    prominence=prominence)` for each profile separately
+
+    The profiles are concatenated, separated by +inf, and searched in one pass. A search for the bases of a peak
+    stops at the first higher value, i.e. at the separators, so the prominences are the same as in each profile.
+    """
+    if len(profiles) == 0:
+        return []
+    separator = np.array([np.inf])
+    lengths = np.array([len(profile) for profile in profiles])
+    starts = np.cumsum(lengths + 1) - lengths  # index of the first value of each profile in the concatenation
+    concatenated = np.concatenate(
+        [array for profile in profiles for array in (separator, profile)] + [separator]
+    ).astype(np.float64)
+    peaks, _ = find_peaks(concatenated)
+    peaks = peaks[np.isfinite(concatenated[peaks])]  # separators between empty profiles
+    prominences, _, _ = peak_prominences(concatenated, peaks)
+    peaks = peaks[prominences >= prominence]
+    profile_indices = np.searchsorted(starts, peaks, side="right") - 1
+    splits = np.searchsorted(profile_indices, np.arange(1, len(profiles)))
+    return np.split(peaks - starts[profile_indices], splits)
+
+
 def filter_lines_by_node_ids(lines: Lines, node_ids: np.array):
     boolean_mask = np.sum(np.isin(lines.line_nodes, node_ids), axis=1) > 0
     line_ids = lines.id[boolean_mask]
@@ -115,6 +228,68 @@ def intersection(
     return None
 
 
+class PreparedGrid:
+    """
+    Cells and edges that do not depend on the thresholds of the LeakDetector: the DEM pixels of the cells and the
+    geometries and exchange levels of the edges
+
+    If a LeakDetector is created with `cache_prepared_grid=True`, it takes the prepared grid of its gridadmin, DEM,
+    obstacles and tiling out of the cache (if any), so that re-running the leak detection with other thresholds or for
+    other flowlines only creates the cells and edges that are not in the prepared grid yet. The LeakDetector resets the
+    results of earlier LeakDetectors that used these cells and edges. Because the prepared grid is taken out of the
+    cache, no other LeakDetector uses it at the same time; LeakDetector.release_prepared_grid() puts it back. The last
+    PREPARED_GRID_CACHE_SIZE released prepared grids are kept.
+    """
+    _cache = OrderedDict()  # {key: PreparedGrid}
+    _lock = Lock()
+
+    def __init__(self, key: Optional[Tuple] = None):
+        self.key = key
+        self.cells = dict()  # {cell_id: Cell}
+        self.edges = dict()  # {flowline_id: Edge}
+
+    @staticmethod
+    def key(
+            gridadmin: GridH5Admin,
+            dem: gdal.Dataset,
+            obstacles: Optional[List[Tuple[LineString, float]]],
+            tile_size: Optional[int]
+    ) -> Optional[Tuple]:
+        """Return the cache key of the inputs, or None if they are not files, e.g. in-memory datasets"""
+        paths = [Path(str(getattr(gridadmin, "grid_file", ""))), Path(dem.GetDescription())]
+        if not all(path.is_file() for path in paths):
+            return None
+        obstacles_key = tuple((geometry.wkb, crest_level) for geometry, crest_level in obstacles or [])
+        return (
+            tuple((str(path.resolve()), path.stat().st_mtime) for path in paths),
+            obstacles_key,
+            bool(tile_size)
+        )
+
+    @classmethod
+    def take(cls, key: Optional[Tuple]) -> "PreparedGrid":
+        """Remove the prepared grid of `key` from the cache and return it, or return an empty one"""
+        with cls._lock:
+            prepared_grid = cls._cache.pop(key, None) if key is not None else None
+        return prepared_grid or cls(key)
+
+    @classmethod
+    def put(cls, prepared_grid: "PreparedGrid"):
+        """Add the prepared grid to the cache, removing the least recently added ones if the cache is full"""
+        if prepared_grid.key is None:
+            return
+        with cls._lock:
+            cls._cache[prepared_grid.key] = prepared_grid
+            cls._cache.move_to_end(prepared_grid.key)
+            while len(cls._cache) > PREPARED_GRID_CACHE_SIZE:
+                cls._cache.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._cache.clear()
+
+
 class LeakDetector:
     """
     Interface between the gridadmin and the classes in this module
@@ -130,7 +305,9 @@ class LeakDetector:
             search_precision: float = None,
             min_peak_prominence: float = None,
             obstacles: List[Tuple[LineString, float]] = None,
-            feedback=None
+            feedback=None,
+            tile_size: int = None,
+            cache_prepared_grid: bool = False
     ):
         """
         :param gridadmin:
@@ -140,8 +317,15 @@ class LeakDetector:
         :param search_precision:
         :param min_peak_prominence:
         :param feedback: Object that has .pushWarning() method, like QgsProcessingFeedback
+        :param tile_size: if given, the DEM pixels of the cells are not kept in memory. Instead, run() processes the
+        cells in square tiles of `tile_size` x `tile_size` DEM pixels and only reads the pixels of one tile at a time,
+        see run_tiled()
+        :param cache_prepared_grid: reuse the cells and edges of an earlier LeakDetector for the same inputs, if it
+        released them with release_prepared_grid(); see PreparedGrid
         """
         self.dem = dem
+        self.tile_size = tile_size
+        self.geotransform = dem.GetGeoTransform()
         self.min_obstacle_height = min_obstacle_height
         self.search_precision = search_precision or self.suitable_search_precision()
         self.min_peak_prominence = min_peak_prominence or min_obstacle_height
@@ -165,12 +349,45 @@ class LeakDetector:
         unique_cell_ids = np.unique(np.squeeze(self.flowlines.line_nodes.data))
         cells__cell_coords = dict(zip(gridadmin.cells.filter(id__in=unique_cell_ids).id, np.round(gridadmin.cells.filter(id__in=unique_cell_ids).cell_coords.T, COORD_DECIMALS)))
 
+        cells__bboxes = np.array(list(cells__cell_coords.values())).reshape(-1, 4)
+        self._cell_windows = dict(zip(cells__cell_coords, pixel_windows(self.dem, cells__bboxes)))
+        # maxima of cell pairs that have not been created yet, see find_maxima()
+        self._cell_pair_maxima_1d = dict()  # {(reference cell id, neigh cell id): maxima_1d}
+
+        # cells and edges that were created before for the same inputs are reused
+        prepared_grid_key = PreparedGrid.key(gridadmin, dem, obstacles, tile_size) if cache_prepared_grid else None
+        self._prepared_grid = PreparedGrid.take(prepared_grid_key)
+        new_cells__cell_coords = {
+            cell_id: cell_coords
+            for cell_id, cell_coords in cells__cell_coords.items()
+            if cell_id not in self._prepared_grid.cells
+        }
+        if self.tile_size:
+            # the pixels are read per tile in run_tiled()
+            new_cells__pixels = [None] * len(new_cells__cell_coords)
+        else:
+            # read the DEM pixels of all cells in a few large blocks
+            new_cells__pixels = read_as_arrays(
+                raster=self.dem,
+                bboxes=np.array(list(new_cells__cell_coords.values())).reshape(-1, 4),
+                feedback=feedback
+            )
+        new_cells__pixels = dict(zip(new_cells__cell_coords, new_cells__pixels))
         self._cell_dict = dict()
         for i, (cell_id, cell_coords) in enumerate(cells__cell_coords.items()):
             if feedback:
                 if feedback.isCanceled():
                     return
-            self._cell_dict[cell_id] = Cell(ld=self, id=cell_id, coords=cell_coords)
+            if cell_id in self._prepared_grid.cells:
+                cell = self._prepared_grid.cells[cell_id]
+                cell.reset(ld=self)
+            elif self.tile_size:
+                r0, r1, c0, c1 = self._cell_windows[cell_id]
+                cell = Cell(ld=self, id=cell_id, coords=cell_coords, shape=(r1 - r0, c1 - c0))
+            else:
+                cell = Cell(ld=self, id=cell_id, coords=cell_coords, pixels=new_cells__pixels[cell_id])
+            self._prepared_grid.cells[cell_id] = cell
+            self._cell_dict[cell_id] = cell
             if feedback:
                 feedback.setProgress(100 * i / len(cells__cell_coords))
 
@@ -198,33 +415,40 @@ class LeakDetector:
         self.edges = list()
         self._edge_by_line_nodes = dict()  # {line_nodes: Edge}
         self._edge_by_flowline_id = dict()  # {flowline_id: Edge}
+        new_edges = list()
         for i, flowline_id in enumerate(self.flowlines__id):
             if feedback:
                 if feedback.isCanceled():
                     return
             cell_ids = tuple(self.flowlines__line_nodes[flowline_id])
-            edge = Edge(
-                ld=self,
-                cell_ids=cell_ids,
-                flowline_id=flowline_id,
-            )
-            edge.calculate_geometries(flowline_coords=self.flowlines__line_coords[flowline_id])
-            edge.calculate_exchange_levels(
-                # exchange_level=flowline["dpumax"]  # Commented out because of a bug in how Tables writes to h5 file
-            )
+            if flowline_id in self._prepared_grid.edges:
+                edge = self._prepared_grid.edges[flowline_id]
+                edge.reset(ld=self)
+            else:
+                edge = Edge(
+                    ld=self,
+                    cell_ids=cell_ids,
+                    flowline_id=flowline_id,
+                )
+                edge.calculate_geometries(flowline_coords=self.flowlines__line_coords[flowline_id])
+                edge.calculate_exchange_levels(
+                    # exchange_level=flowline["dpumax"]  # Commented out because of a bug in how Tables writes to h5 file
+                )
+                self._prepared_grid.edges[flowline_id] = edge
+                new_edges.append(edge)
             self.edges.append(edge)
             self._edge_by_line_nodes[cell_ids] = edge
             self._edge_by_flowline_id[flowline_id] = edge
             if feedback:
                 feedback.setProgress(100 * i / len(self.flowlines__id))
 
-        # Update edge exchange level from obstacles
-        if obstacles:
+        # Update edge exchange level from obstacles; the exchange levels of reused edges have been updated before
+        if obstacles and new_edges:
             if feedback:
                 feedback.pushInfo(f"{datetime.now()}")
                 feedback.setProgressText("Update edge exchange level from obstacles...")
                 feedback.setProgress(0)
-            flowline_geometries = [edge.flowline_geometry for edge in self.edges]
+            flowline_geometries = [edge.flowline_geometry for edge in new_edges]
             flowline_geometry_tree = STRtree(flowline_geometries)
             if feedback:
                 if feedback.isCanceled():
@@ -249,11 +473,24 @@ class LeakDetector:
                 crest_level = obstacles[obstacle_index][1]
                 intersected_edge_indices = edge_finder[obstacle_index]
                 for i in intersected_edge_indices:
-                    edge = self.edges[i]
+                    edge = new_edges[i]
                     if edge.exchange_level < crest_level:
                         edge.exchange_level = crest_level
                 feedback.setProgress(100 * i / len(obstacle_indices))
 
+    def release_prepared_grid(self):
+        """
+        Put the cells and edges in the cache of prepared grids, if this LeakDetector was created with
+        `cache_prepared_grid=True`, so that the next LeakDetector for the same inputs can reuse them
+
+        The next LeakDetector resets the cells and edges, so the results of this LeakDetector should not be used after
+        calling this method. Only call it after the LeakDetector has been fully initialized, i.e. not if it has been
+        cancelled.
+        """
+        if self._prepared_grid is not None:
+            PreparedGrid.put(self._prepared_grid)
+            self._prepared_grid = None
+
     def suitable_search_precision(self):
         return min(self.min_obstacle_height/10, 0.1)
 
@@ -291,34 +528,112 @@ class LeakDetector:
     def get_edge_by_flowline_id(self, flowline_id):
         return self._edge_by_flowline_id[flowline_id]
 
-    def cell_pairs(self):
-        """Return an interator of all cell pairs that can be created by using the cell_ids as reference cell"""
+    def cell_pairs(self, cell_pair_ids: List[Tuple[int, int]] = None, find_maxima: bool = False):
+        """
+        Return an interator of all cell pairs that can be created by using the cell_ids as reference cell
+
+        :param cell_pair_ids: (reference cell id, neigh cell id) of the cell pairs; defaults to all (cell_pair_ids())
+        :param find_maxima: find the maxima of the cell pairs (see CellPair.maxima()) in batches of
+        CELL_PAIR_BATCH_SIZE cell pairs. The cell pairs themselves are created one at a time, when they are iterated.
+        """
+        if cell_pair_ids is None:
+            cell_pair_ids = self.cell_pair_ids()
+        batch = []
+        for reference_cell_id, neigh_cell_id in cell_pair_ids:
+            batch.append((reference_cell_id, neigh_cell_id))
+            if len(batch) == CELL_PAIR_BATCH_SIZE:
+                yield from self._cell_pair_batch(batch, find_maxima=find_maxima)
+                batch = []
+        yield from self._cell_pair_batch(batch, find_maxima=find_maxima)
+
+    def _cell_pair_batch(self, cell_pair_ids: List[Tuple[int, int]], find_maxima: bool):
+        if find_maxima:
+            self.find_maxima(cell_pair_ids=cell_pair_ids)
+        for reference_cell_id, neigh_cell_id in cell_pair_ids:
+            yield CellPair(self, self.cell(reference_cell_id), self.cell(neigh_cell_id))
+
+    def find_maxima(
+            self,
+            cell_pairs: List["CellPair"] = (),
+            cells: List["Cell"] = (),
+            cell_pair_ids: List[Tuple[int, int]] = ()
+    ):
+        """
+        Find the maxima along the sides of `cell_pairs`, their cells, `cells` and the cell pairs of `cell_pair_ids` in
+        a single call of find_peaks_batched(). Maxima that have been found before are not searched again.
+
+        The maxima of `cell_pair_ids` are found from the pixels along the sides of the cells, without creating the
+        cell pairs; they are picked up by the CellPair that is created for these cells next.
+
+        See Cell.maxima() and CellPair.maxima()
+        """
+        cell_pair_ids = [ids for ids in cell_pair_ids if ids not in self._cell_pair_maxima_1d]
+        cells = list(cells) + [cell for cell_pair in cell_pairs for cell in cell_pair.cells.values()]
+        cells += [self.cell(cell_id) for ids in cell_pair_ids for cell_id in ids]
+        cells = list({cell.id: cell for cell in cells if cell.maxima_1d is None}.values())
+        cell_pairs = [cell_pair for cell_pair in cell_pairs if cell_pair.maxima_1d is None]
+        cell_pairs__side_pixels = [cell_pair.aligned_side_pixels() for cell_pair in cell_pairs]
+        cell_pairs__side_pixels += [
+            CellPair.aligned_side_pixels_of(self.cell(reference_cell_id), self.cell(neigh_cell_id))
+            for reference_cell_id, neigh_cell_id in cell_pair_ids
+        ]
+        profiles = [cell.edge_pixels(side) for cell in cells for side in SIDE_INDEX]
+        for side_pixels in cell_pairs__side_pixels:
+            profiles += [pixels for pixels in side_pixels.values() if pixels is not None]
+        peaks = iter(find_peaks_batched(profiles, prominence=self.min_peak_prominence))
+        for cell in cells:
+            cell.maxima_1d = {side: next(peaks) for side in SIDE_INDEX}
+        cell_pairs__maxima_1d = [
+            {hand: None if pixels is None else next(peaks) for hand, pixels in side_pixels.items()}
+            for side_pixels in cell_pairs__side_pixels
+        ]
+        for cell_pair, maxima_1d in zip(cell_pairs, cell_pairs__maxima_1d):
+            cell_pair.maxima_1d = maxima_1d
+        for ids, maxima_1d in zip(cell_pair_ids, cell_pairs__maxima_1d[len(cell_pairs):]):
+            self._cell_pair_maxima_1d[ids] = maxima_1d
+
+    def cell_pair_ids(self) -> Iterator[Tuple[int, int]]:
+        """Return an iterator of the (reference cell id, neigh cell id) of all cell pairs, in cell_pairs() order"""
         for reference_cell in self.cells:
             neigh_cells = reference_cell.neigh_cells[TOP] + reference_cell.neigh_cells[RIGHT]
             for neigh_cell in neigh_cells:
-                cell_pair = CellPair(self, reference_cell, neigh_cell)
-                yield cell_pair
+                yield reference_cell.id, neigh_cell.id
 
-    def run(self, feedback=None):
+    def run(self, feedback=None, workers: int = 1):
         """
         Find all obstacles
 
         :param feedback: Object that has `setProgress()`, `isCanceled()` and `pushInfo()` methods,
         like QgsProcessingFeedback
+        :param workers: number of worker processes for finding the obstacles in each cell pair. Defaults to 1, i.e.
+        everything is done in this process. None means the number of CPUs minus one. Not used if `tile_size` is set.
         :return: None
         """
 
+        if self.tile_size:
+            for _ in self.run_tiled(feedback=feedback):
+                pass
+            return
+
         # find obstacles
-        for i, cell_pair in enumerate(self.cell_pairs()):
-            try:
-                cell_pair.find_obstacles()
-                if feedback:
-                    feedback.setProgress(50 * ((i + 1) / len(self.flowlines__id)))
-                    if feedback.isCanceled():
-                        return
-            except Exception as e:
-                print(f"Something went wrong in cell pair ({cell_pair.reference_cell.id, cell_pair.neigh_cell.id})")
-                raise e
+        if workers is None:
+            workers = default_workers()
+        if workers > 1:
+            if not self.find_obstacles_parallel(workers=workers, feedback=feedback):
+                return
+        else:
+            for i, cell_pair in enumerate(self.cell_pairs(find_maxima=True)):
+                try:
+                    cell_pair.find_obstacles()
+                    if feedback:
+                        feedback.setProgress(50 * ((i + 1) / len(self.flowlines__id)))
+                        if feedback.isCanceled():
+                            return
+                except Exception as e:
+                    print(
+                        f"Something went wrong in cell pair ({cell_pair.reference_cell.id, cell_pair.neigh_cell.id})"
+                    )
+                    raise e
 
         # find connecting obstacles
         for i, cell_pair in enumerate(self.cell_pairs()):
@@ -332,6 +647,177 @@ class LeakDetector:
                 print(f"Something went wrong in cell pair ({cell_pair.reference_cell.id, cell_pair.neigh_cell.id})")
                 raise e
 
+    def tiles(self) -> List[List[Tuple[int, int]]]:
+        """
+        Group the cell pairs by the tile of `tile_size` x `tile_size` DEM pixels that their reference cell is in
+
+        :returns: list of lists of (reference cell id, neigh cell id), ordered by tile row and column
+        """
+        tiles = dict()
+        for reference_cell_id, neigh_cell_id in self.cell_pair_ids():
+            row_start, _, col_start, _ = self._cell_windows[reference_cell_id]
+            key = (row_start // self.tile_size, col_start // self.tile_size)
+            tiles.setdefault(key, []).append((reference_cell_id, neigh_cell_id))
+        return [tiles[key] for key in sorted(tiles)]
+
+    def _load_pixels(self, cell_ids: List[int]):
+        cells = [self.cell(cell_id) for cell_id in cell_ids]
+        cells__pixels = read_as_arrays(raster=self.dem, bboxes=np.array([cell.coords for cell in cells]))
+        for cell, pixels in zip(cells, cells__pixels):
+            cell.set_pixels(pixels)
+
+    def _release_pixels(self, cell_ids: List[int]):
+        for cell_id in cell_ids:
+            self.cell(cell_id).release_pixels()
+
+    def run_tiled(self, feedback=None) -> Iterator[List["Edge"]]:
+        """
+        Find all obstacles, reading the DEM pixels of one tile (see tiles()) at a time
+
+        Each cell pair needs the pixels of both its cells, so the cells on the top and right of a tile (the halo) are
+        read together with the tile. The tiles are processed twice: first to find the obstacles, then to find the
+        connecting obstacles, which depend on the obstacles of the surrounding cell pairs. After the second pass
+        over a tile, the edges between the cells of its cell pairs are final; these are yielded per tile, so that
+        results can be written before the next tile is processed.
+
+        :param feedback: Object that has `setProgress()` and `isCanceled()` methods, like QgsProcessingFeedback
+        :returns: iterator of lists of the edges that are final after processing a tile
+        """
+        tiles = self.tiles()
+        for find_connecting, progress_offset in ((False, 0), (True, 50)):
+            for i, tile in enumerate(tiles):
+                cell_ids = list(set(cell_id for cell_pair_ids in tile for cell_id in cell_pair_ids))
+                self._load_pixels(cell_ids)
+                for cell_pair in self.cell_pairs(tile, find_maxima=not find_connecting):
+                    if find_connecting:
+                        cell_pair.find_connecting_obstacles()
+                    else:
+                        cell_pair.find_obstacles()
+                self._release_pixels(cell_ids)
+                if feedback:
+                    feedback.setProgress(progress_offset + 50 * (i + 1) / len(tiles))
+                    if feedback.isCanceled():
+                        return
+                if find_connecting:
+                    yield [self.edge(*cell_pair_ids) for cell_pair_ids in tile]
+
+    def spatial_partitions(self, cell_pair_ids: List[Tuple[int, int]], nr_partitions: int) -> List[np.ndarray]:
+        """
+        Split the cell pairs into `nr_partitions` groups of (almost) equal size of cell pairs that are close together
+
+        The cell pairs are ordered by the square tile their reference cell is in, row by row, and this order is split.
+
+        :returns: list of arrays of indices into `cell_pair_ids`
+        """
+        if len(cell_pair_ids) == 0:
+            return []
+        coords = np.array([self.cell(reference_cell_id).coords for reference_cell_id, _ in cell_pair_ids])
+        x = (coords[:, 0] + coords[:, 2]) / 2
+        y = (coords[:, 1] + coords[:, 3]) / 2
+        extent = max(np.ptp(x), np.ptp(y))
+        tile_size = (extent / np.ceil(np.sqrt(nr_partitions))) or 1.0
+        tile_col = np.floor((x - x.min()) / tile_size)
+        tile_row = np.floor((y - y.min()) / tile_size)
+        order = np.lexsort((x, tile_col, tile_row))
+        return [partition for partition in np.array_split(order, nr_partitions) if partition.size > 0]
+
+    def subset(self, cell_ids) -> "LeakDetector":
+        """
+        Return a LeakDetector that only contains the given cells and their edges, e.g. to send to a worker process
+
+        The returned LeakDetector shares the Cell and Edge objects with this one, and it has no DEM. It can be used to
+        find obstacles in cell pairs of the given cells.
+        """
+        cell_ids = set(cell_ids)
+        result = LeakDetector.__new__(LeakDetector)
+        result.dem = None
+        result.geotransform = self.geotransform
+        result.min_obstacle_height = self.min_obstacle_height
+        result.search_precision = self.search_precision
+        result.min_peak_prominence = self.min_peak_prominence
+        result._cell_dict = {cell_id: self._cell_dict[cell_id] for cell_id in cell_ids}
+        result._cell_pair_maxima_1d = dict()
+        result._edge_by_line_nodes = {
+            line_nodes: edge
+            for line_nodes, edge in self._edge_by_line_nodes.items()
+            if line_nodes[0] in cell_ids or line_nodes[1] in cell_ids
+        }
+        result._edge_by_flowline_id = {edge.flowline_id: edge for edge in result._edge_by_line_nodes.values()}
+        result.edges = list(result._edge_by_line_nodes.values())
+        return result
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["dem"] = None  # a gdal.Dataset can not be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Cells and Edges are pickled without references to the LeakDetector and to other cells; restore them
+        for cell in self._cell_dict.values():
+            cell.ld = self
+            for location, neigh_cells in cell.neigh_cells.items():
+                cell.neigh_cells[location] = [self._cell_dict.get(neigh_cell, neigh_cell) for neigh_cell in neigh_cells]
+        for edge in self._edge_by_line_nodes.values():
+            edge.ld = self
+
+    def find_obstacles_parallel(self, workers: int, feedback=None) -> bool:
+        """
+        Find the obstacles in all cell pairs using worker processes
+
+        The cell pairs are divided into spatial partitions. Each partition is sent to a worker process together with
+        the cells and edges it needs. The obstacles found by the workers are added to the edges in the same order as
+        run() does without workers, so the result does not depend on the number of workers.
+
+        :returns: False if cancelled
+        """
+        cell_pair_ids = list(self.cell_pair_ids())
+        partitions = self.spatial_partitions(cell_pair_ids, nr_partitions=workers * PARTITIONS_PER_WORKER)
+        partitions__cell_pair_ids = [[cell_pair_ids[i] for i in partition] for partition in partitions]
+        calls = (
+            (
+                _find_obstacles_in_cell_pairs,
+                self.subset(cell_id for cell_pair in partition_cell_pair_ids for cell_id in cell_pair),
+                partition_cell_pair_ids
+            )
+            for partition_cell_pair_ids in partitions__cell_pair_ids
+        )
+        obstacle_records = [None] * len(cell_pair_ids)
+        nr_done = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=spawn_context()) as executor, \
+                closing(bounded_map(executor, calls, max_pending=2 * workers)) as results:
+            for partition, partition_records in zip(partitions, results):
+                for i, records in zip(partition, partition_records):
+                    obstacle_records[i] = records
+                nr_done += len(partition)
+                if feedback:
+                    feedback.setProgress(50 * nr_done / len(cell_pair_ids))
+                    if feedback.isCanceled():
+                        return False
+
+        for records in obstacle_records:
+            for record in records:
+                self.add_obstacle_from_record(record)
+        return True
+
+    def add_obstacle_from_record(self, record: Tuple):
+        """Create an Obstacle from the output of Obstacle.as_record() and assign it to its edges"""
+        crest_level, from_cell_id, to_cell_id, from_pos, to_pos, from_side, to_side, flowline_ids = record
+        obstacle = Obstacle(
+            ld=self,
+            crest_level=crest_level,
+            from_side=from_side,
+            to_side=to_side,
+            from_cell=self.cell(from_cell_id),
+            to_cell=self.cell(to_cell_id),
+            from_pos=from_pos,
+            to_pos=to_pos
+        )
+        for flowline_id in flowline_ids:
+            edge = self.get_edge_by_flowline_id(flowline_id)
+            edge.obstacles.append(obstacle)
+            obstacle.edges.append(edge)
+
     def results(self, geometry: str, flowline_ids=None) -> Iterator[Dict]:
         """
         Iterate over all edges that have an obstacle
@@ -374,7 +860,7 @@ class Obstacle:
         self._to_edge = None
 
         # calculate geometry
-        gt = self.ld.dem.GetGeoTransform()
+        gt = self.ld.geotransform
         from_pos_y = self.from_pos[0]
         from_pos_x = self.from_pos[1]
         to_pos_y = self.to_pos[0]
@@ -385,6 +871,19 @@ class Obstacle:
         to_y = self.to_cell.coords[3] - (to_pos_y * abs(gt[5]) + abs(gt[5]) / 2)
         self.geometry = LineString([Point(from_x, from_y), Point(to_x, to_y)])
 
+    def as_record(self) -> Tuple:
+        """Return the obstacle as a picklable tuple, see LeakDetector.add_obstacle_from_record()"""
+        return (
+            self.crest_level,
+            self.from_cell.id,
+            self.to_cell.id,
+            self.from_pos,
+            self.to_pos,
+            self.from_side,
+            self.to_side,
+            [edge.flowline_id for edge in self.edges]
+        )
+
     @staticmethod
     def _find_edge(cell, side, pos):
         if side is None:
@@ -455,6 +954,16 @@ class Edge:
         self.exchange_level = None
         self.exchange_levels = None
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["ld"]  # restored by LeakDetector.__setstate__()
+        return state
+
+    def reset(self, ld: LeakDetector):
+        """Prepare this edge for reuse by `ld`, see PreparedGrid"""
+        self.ld = ld
+        self.obstacles = list()
+
     def calculate_geometries(self, flowline_coords: Tuple[float, float, float, float]):
         """
         Set the geometries of the edge and the flowline crossing the edge
@@ -525,26 +1034,69 @@ class Cell:
             self,
             ld: LeakDetector,
             id: int,
-            coords: np.ndarray
+            coords: np.ndarray,
+            pixels: np.ndarray = None,
+            shape: Tuple[int, int] = None
     ):
         """
         :param id: cell id
         :param ld:
         :param coords: corner coordinates the crs of the dem: [min_x, min_y, max_x, max_y]
+        :param pixels: DEM pixels within `coords`, padded with nodata (see read_as_arrays()). Read from the DEM if not
+        given. Nodata pixels are replaced in this array.
+        :param shape: (height, width) of the cell in DEM pixels. If given, the pixels are not read; they must be set
+        with set_pixels() before they are used
         """
         self.ld = ld
         self.id = id
         self.coords = coords
         self.xmax = np.max(coords[[0, 2]])
         self.xmin = np.min(coords[[0, 2]])
-        self.pixels = read_as_array(raster=ld.dem, bbox=coords, pad=True)
-        band = ld.dem.GetRasterBand(1)
+        self.pixels = None
+        self.maxima_1d = None  # {side: indices of the maxima along that side}, see LeakDetector.find_maxima()
+        if shape is not None:
+            self.height, self.width = shape
+        else:
+            self.set_pixels(pixels if pixels is not None else read_as_array(raster=ld.dem, bbox=coords, pad=True))
+        self.neigh_cells = {TOP: [], RIGHT: [], BOTTOM: [], LEFT: []}
+
+    def set_pixels(self, pixels: np.ndarray):
+        """Set the DEM pixels of this cell, replacing nodata pixels in `pixels`"""
+        self.pixels = pixels
+        band = self.ld.dem.GetRasterBand(1)
         ndv = band.GetNoDataValue()
-        maxval = np.nanmax(self.pixels)
-        self.pixels[self.pixels == ndv] = maxval + ld.min_obstacle_height + ld.search_precision
+        self.max_pixel_value = np.nanmax(self.pixels)
+        self.nodata_indices = np.flatnonzero(self.pixels == ndv)
+        self.replace_nodata()
         self.width = self.pixels.shape[1]
         self.height = self.pixels.shape[0]
+
+    def replace_nodata(self):
+        """Replace the nodata pixels by a value that is higher than any obstacle"""
+        self.pixels.flat[self.nodata_indices] = \
+            self.max_pixel_value + self.ld.min_obstacle_height + self.ld.search_precision
+
+    def reset(self, ld: LeakDetector):
+        """Prepare this cell for reuse by `ld`, see PreparedGrid"""
+        self.ld = ld
+        self.maxima_1d = None
         self.neigh_cells = {TOP: [], RIGHT: [], BOTTOM: [], LEFT: []}
+        if self.pixels is not None:
+            self.replace_nodata()
+
+    def release_pixels(self):
+        """Free the memory of the DEM pixels of this cell, see LeakDetector.run_tiled()"""
+        self.pixels = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # references to the LeakDetector and neighbouring cells are restored by LeakDetector.__setstate__()
+        del state["ld"]
+        state["neigh_cells"] = {
+            location: [neigh_cell.id if isinstance(neigh_cell, Cell) else neigh_cell for neigh_cell in neigh_cells]
+            for location, neigh_cells in self.neigh_cells.items()
+        }
+        return state
 
     def locate_cell(self, neigh_cell, neigh_is_next: bool) -> str:
         if neigh_is_next:
@@ -617,8 +1169,9 @@ class Cell:
         """
         Return the pixel indices of the local maxima (peaks) along the edge at given `side`
         """
-
-        maxima_1d, _ = find_peaks(self.edge_pixels(side), prominence=self.ld.min_peak_prominence)
+        if self.maxima_1d is None:
+            self.ld.find_maxima(cells=[self])
+        maxima_1d = self.maxima_1d[side]
         if side == TOP:
             row_indices = np.zeros(maxima_1d.shape)
             result = np.vstack([row_indices, maxima_1d]).T.astype(int)
@@ -653,6 +1206,8 @@ class CellPair:
 
     def __init__(self, ld: LeakDetector, reference_cell: Cell, neigh_cell: Cell):
         self.ld = ld
+        # {lhs/rhs: indices of the maxima along aligned sides}, see LeakDetector.find_maxima()
+        self.maxima_1d = ld._cell_pair_maxima_1d.pop((reference_cell.id, neigh_cell.id), None)
         self.reference_cell = reference_cell
         self.neigh_cell = neigh_cell
         self.cells = {REFERENCE: self.reference_cell, NEIGH: self.neigh_cell}
@@ -905,6 +1460,50 @@ class CellPair:
         elif isinstance(pos, np.ndarray):
             return (pos.T + shift).T
 
+    def aligned_side_pixels(self) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Return the pixel values along the right-hand-side and left-hand-side of the cell pair, if the cells are aligned
+        at that side, i.e. the pixel values form a continuous string. None for sides at which the cells are not aligned
+        """
+        return self.aligned_side_pixels_of(self.reference_cell, self.neigh_cell)
+
+    @staticmethod
+    def aligned_side_pixels_of(reference_cell: Cell, neigh_cell: Cell) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Return the aligned_side_pixels() of the cell pair of `reference_cell` and `neigh_cell`, without creating the
+        cell pair (and its merged pixels)
+        """
+        def aligned(coord_index):
+            return round(reference_cell.coords[coord_index], COORD_DECIMALS) == \
+                round(neigh_cell.coords[coord_index], COORD_DECIMALS)
+
+        if neigh_cell in reference_cell.neigh_cells[TOP]:
+            # right-hand-side edges are RIGHT, left-hand-side edges are LEFT
+            return {
+                RIGHTHANDSIDE: np.hstack([
+                    neigh_cell.edge_pixels(RIGHT),
+                    reference_cell.edge_pixels(RIGHT)
+                ]) if aligned(2) else None,
+                LEFTHANDSIDE: np.hstack([
+                    neigh_cell.edge_pixels(LEFT),
+                    reference_cell.edge_pixels(LEFT),
+                ]) if aligned(0) else None,
+            }
+        elif neigh_cell in reference_cell.neigh_cells[RIGHT]:
+            # right-hand-side edges are BOTTOM, left-hand-side edges are TOP
+            return {
+                RIGHTHANDSIDE: np.hstack([
+                    reference_cell.edge_pixels(BOTTOM),
+                    neigh_cell.edge_pixels(BOTTOM)
+                ]) if aligned(1) else None,
+                LEFTHANDSIDE: np.hstack([
+                    reference_cell.edge_pixels(TOP),
+                    neigh_cell.edge_pixels(TOP)
+                ]) if aligned(3) else None,
+            }
+        else:
+            raise ValueError("neigh_cell must be located at the top or right of reference_cell")
+
     def maxima(self) -> Dict[str, List[Tuple[int, int]]]:
         """
         Return a dict of right-hand-side and left-hand-side indices of maximum locations (cell pair coordinates)
@@ -912,15 +1511,14 @@ class CellPair:
         \n
         Only maxima higher than `min_obstacle_height` - `search_precision` are included.
         """
+        if self.maxima_1d is None:
+            self.ld.find_maxima(cell_pairs=[self])
+
         if self.neigh_primary_location == RIGHT:
             # right-hand-side edges are BOTTOM
             if self.bottom_aligned:
-                # Calculate maxima in the continuous string of values at this side of the cell pair
-                rhs_pixels = np.hstack([
-                    self.reference_cell.edge_pixels(BOTTOM),
-                    self.neigh_cell.edge_pixels(BOTTOM)
-                ])
-                rhs_maxima_1d, _ = find_peaks(rhs_pixels, prominence=self.ld.min_peak_prominence)
+                # Maxima in the continuous string of values at this side of the cell pair
+                rhs_maxima_1d = self.maxima_1d[RIGHTHANDSIDE]
                 row_indices = np.ones(rhs_maxima_1d.shape) * (self.height - 1)
                 rhs_maxima = np.vstack([row_indices, rhs_maxima_1d]).T.astype(int)
 
@@ -934,12 +1532,8 @@ class CellPair:
 
             # left-hand-side edges are TOP
             if self.top_aligned:
-                # Calculate maxima in the continuous string of values at this side of the cell pair
-                lhs_pixels = np.hstack([
-                    self.reference_cell.edge_pixels(TOP),
-                    self.neigh_cell.edge_pixels(TOP)
-                ])
-                lhs_maxima_1d, _ = find_peaks(lhs_pixels, prominence=self.ld.min_peak_prominence)
+                # Maxima in the continuous string of values at this side of the cell pair
+                lhs_maxima_1d = self.maxima_1d[LEFTHANDSIDE]
                 row_indices = np.zeros(lhs_maxima_1d.shape)
                 lhs_maxima = np.vstack([row_indices, lhs_maxima_1d]).T.astype(int)
 
@@ -954,12 +1548,8 @@ class CellPair:
         elif self.neigh_primary_location == TOP:
             # right-hand-side edges are RIGHT
             if self.right_aligned:
-                # Calculate maxima in the continuous string of values at this side of the cell pair
-                rhs_pixels = np.hstack([
-                    self.neigh_cell.edge_pixels(RIGHT),
-                    self.reference_cell.edge_pixels(RIGHT)
-                ])
-                rhs_maxima_1d, _ = find_peaks(rhs_pixels, prominence=self.ld.min_peak_prominence)
+                # Maxima in the continuous string of values at this side of the cell pair
+                rhs_maxima_1d = self.maxima_1d[RIGHTHANDSIDE]
                 col_indices = np.ones(rhs_maxima_1d.shape) * (self.width - 1)
                 rhs_maxima = np.vstack([rhs_maxima_1d, col_indices]).T.astype(int)
 
@@ -973,12 +1563,8 @@ class CellPair:
 
             # left-hand-side edges are LEFT
             if self.left_aligned:
-                # Calculate maxima in the continuous string of values at this side of the cell pair
-                lhs_pixels = np.hstack([
-                    self.neigh_cell.edge_pixels(LEFT),
-                    self.reference_cell.edge_pixels(LEFT),
-                ])
-                lhs_maxima_1d, _ = find_peaks(lhs_pixels, prominence=self.ld.min_peak_prominence)
+                # Maxima in the continuous string of values at this side of the cell pair
+                lhs_maxima_1d = self.maxima_1d[LEFTHANDSIDE]
                 col_indices = np.zeros(lhs_maxima_1d.shape)
                 lhs_maxima = np.vstack([lhs_maxima_1d, col_indices]).T.astype(int)
 
@@ -1122,10 +1708,13 @@ class CellPair:
             secondary_location = self.neigh_secondary_location
         return self.squash_indices(reference_indices, neigh_indices, side=side, secondary_location=secondary_location)
 
-    def find_obstacles(self):
+    def find_obstacles(self) -> List[Obstacle]:
         """
         Obstacles are identified and assigned to the appropriate Edge
+
+        Returns the obstacles that have been assigned to one or more edges
         """
+        result = []
         maxima = self.maxima()
         for from_pos in maxima[LEFTHANDSIDE]:
             for to_pos in maxima[RIGHTHANDSIDE]:
@@ -1202,6 +1791,9 @@ class CellPair:
                             self.ld.search_precision:
                         edge.obstacles.append(obstacle)
                         obstacle.edges.append(edge)
+                if obstacle.edges:
+                    result.append(obstacle)
+        return result
 
     def find_connecting_obstacles(self):
         """
@@ -1375,3 +1967,17 @@ def lowest(elements: List[Union[Obstacle, Edge]]):
             min_element_height = getattr(element, attr_name)
             lowest_element = element
     return lowest_element
+
+
+def _find_obstacles_in_cell_pairs(leak_detector: LeakDetector, cell_pair_ids: List[Tuple[int, int]]) -> List[List]:
+    """
+    Find the obstacles in the given cell pairs; runs in a worker process
+
+    The worker process imports this module, so it must not import anything from qgis (see utils.processes).
+
+    :returns: for each cell pair, the list of obstacle records (see Obstacle.as_record())
+    """
+    result = []
+    for cell_pair in leak_detector.cell_pairs(cell_pair_ids, find_maxima=True):
+        result.append([obstacle.as_record() for obstacle in cell_pair.find_obstacles()])
+    return result
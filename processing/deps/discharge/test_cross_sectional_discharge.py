@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from shapely.geometry import LineString, MultiLineString
+
+from threedi_results_analysis.processing.deps.discharge.cross_sectional_discharge import (
+    flowline_start_nodes_left_of_line,
+    left_to_right_discharge,
+    left_to_right_discharges,
+)
+
+
+def flowlines(*line_coords):
+    """Lines-like object of flowlines with coordinates (x1, y1, x2, y2)"""
+    return SimpleNamespace(
+        count=len(line_coords),
+        id=np.arange(1, len(line_coords) + 1),
+        line_coords=np.array(line_coords, dtype=float).reshape(-1, 4).T,
+    )
+
+
+GAUGE_LINE = LineString([(0, 0), (10, 0), (10, 10)])
+
+
+def test_flowline_start_nodes_left_of_line():
+    result = flowline_start_nodes_left_of_line(
+        flowlines(
+            (2, -1, 2, 1),  # from right to left
+            (3, 1, 3, -1),  # from left to right
+            (9, 5, 11, 5),  # from left to right of the second segment
+            (4, 0, 4, 2),  # start node on the gauge line
+            (6, 2, 6, 0),  # end node on the gauge line
+        ),
+        GAUGE_LINE,
+    )
+    assert result == [False, True, True, None, True]
+    assert flowline_start_nodes_left_of_line(flowlines(), GAUGE_LINE) == []
+
+
+def test_flowline_start_nodes_left_of_multilinestring():
+    gauge_line = MultiLineString([[(0, 0), (10, 0)], [(20, 0), (20, 10)]])
+    assert flowline_start_nodes_left_of_line(flowlines((2, 1, 2, -1), (21, 5, 19, 5)), gauge_line) == [True, False]
+
+
+def test_flowline_start_nodes_left_of_line_at_vertex():
+    # intersects both gauge line segments
+    with pytest.raises(ValueError, match="flowline 2"):
+        flowline_start_nodes_left_of_line(flowlines((2, -1, 2, 1), (9, 1, 11, -1)), GAUGE_LINE)
+
+
+def test_left_to_right_discharges(threedi_result):
+    gr = threedi_result.result_admin
+    x1, y1, _, _ = gr.lines.subset("2D_OPEN_WATER").line_coords
+    # offset, so that the gauge lines do not pass through nodes
+    x = np.median(x1) + 0.123
+    y = np.median(y1) + 0.123
+    gauge_lines = [
+        LineString([(x1.min(), y), (x1.max(), y)]),
+        LineString([(x1.min(), y), (x, y), (x, y1.max())]),  # overlaps the first gauge line
+        LineString([(x1.max(), y), (x1.min(), y)]),  # the first gauge line, reversed
+    ]
+    results = left_to_right_discharges(gr, gauge_lines, subset="2D_OPEN_WATER")
+    assert len(results) == len(gauge_lines)
+    for gauge_line, result in zip(gauge_lines, results):
+        flowline_ids, is_left_to_right, ts, q_net_sum, total = result
+        expected = left_to_right_discharge(gr, gauge_line, subset="2D_OPEN_WATER")
+        assert len(flowline_ids) > 0
+        assert flowline_ids.tolist() == expected[0].id.tolist()
+        assert is_left_to_right == expected[1]
+        np.testing.assert_allclose(ts, expected[2])
+        np.testing.assert_allclose(q_net_sum, expected[3])
+        assert total == pytest.approx(expected[4])
+    assert results[2][4] == pytest.approx(-results[0][4])
@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from osgeo import gdal
+from scipy.signal import find_peaks
+
+from threedi_results_analysis.processing.deps.discharge.discharge_reduction import count_below
+from threedi_results_analysis.processing.deps.discharge.discharge_reduction import discharge_reduction_factors
+from threedi_results_analysis.processing.deps.discharge.leak_detector import find_peaks_batched
+from threedi_results_analysis.processing.deps.discharge.leak_detector import LeakDetector
+from threedi_results_analysis.processing.deps.discharge.leak_detector import pixel_windows
+from threedi_results_analysis.processing.deps.discharge.leak_detector import PreparedGrid
+from threedi_results_analysis.processing.deps.discharge.leak_detector import read_as_array
+from threedi_results_analysis.processing.deps.discharge.leak_detector import read_as_arrays
+gdal.UseExceptions()
+
+NO_DATA_VALUE = -9999.0
+
+
+@pytest.fixture()
+def raster():
+    """10 x 8 pixels of 0.5 x 0.5, with its upper left corner at (100, 200)"""
+    dataset = gdal.GetDriverByName("MEM").Create("", 8, 10, 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((100.0, 0.5, 0.0, 200.0, 0.0, -0.5))
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(NO_DATA_VALUE)
+    band.WriteArray(np.arange(80, dtype=np.float32).reshape(10, 8))
+    return dataset
+
+
+# x0, y0, x1, y1
+BBOXES = np.array([
+    [100.0, 199.0, 101.0, 200.0],  # upper left corner
+    [101.0, 196.0, 102.5, 198.5],
+    [101.0, 196.0, 102.5, 198.5],  # the same as the previous one
+    [102.5, 195.0, 105.0, 197.0],  # partially right of the raster
+    [99.0, 194.0, 101.0, 196.0],  # partially left of and below the raster
+    [102.5, 199.0, 103.5, 201.0],  # partially above the raster
+])
+
+
+def test_pixel_windows(raster):
+    assert pixel_windows(raster, BBOXES[[0, 3, 4, 5]]).tolist() == [
+        [0, 2, 0, 2],
+        [6, 10, 5, 10],
+        [8, 12, -2, 2],
+        [-2, 2, 5, 7],
+    ]
+
+
+@pytest.mark.parametrize("max_block_size", [1, 100, 10 ** 6])
+def test_read_as_arrays(raster, max_block_size):
+    result = read_as_arrays(raster, BBOXES, max_block_size=max_block_size)
+    assert len(result) == len(BBOXES)
+    for bbox, array in zip(BBOXES, result):
+        np.testing.assert_equal(array, read_as_array(raster, bbox, pad=True))
+    assert (result[3][:, 3:] == NO_DATA_VALUE).all()
+    assert (result[3][:, :3] != NO_DATA_VALUE).all()
+    # overlapping bounding boxes do not share pixels
+    result[1][:] = 0
+    assert (result[2] != 0).any()
+
+
+def test_find_peaks_batched():
+    rng = np.random.default_rng(0)
+    profiles = [rng.random(size) for size in [10, 0, 1, 3, 0, 0, 50, 2]]
+    profiles.append(np.array([0.0, 2.0, 2.0, 0.0, 1.0, 0.0]))  # plateau
+    profiles.append(np.array([5.0, 0.0, 5.0]))  # edges are not peaks
+    for prominence in [0, 0.3]:
+        result = find_peaks_batched(profiles, prominence=prominence)
+        assert len(result) == len(profiles)
+        for profile, peaks in zip(profiles, result):
+            expected, _ = find_peaks(profile, prominence=prominence)
+            assert peaks.tolist() == expected.tolist()
+    assert find_peaks_batched([], prominence=0) == []
+    assert [peaks.tolist() for peaks in find_peaks_batched([np.array([])] * 2, prominence=0)] == [[], []]
+
+
+def test_count_below():
+    rng = np.random.default_rng(0)
+    sorted_values = np.sort(np.round(rng.random((20, 7)), 1), axis=1)
+    sorted_values[::3, 4:] = np.nan
+    queries = np.round(rng.random((20, 5)), 1)
+    queries[1, 2] = np.nan
+    result = count_below(sorted_values, queries)
+    expected = [[np.sum(values < query) for query in row_queries] for values, row_queries in zip(sorted_values, queries)]
+    assert result.tolist() == expected
+
+
+def discharge_reduction_factor(exchange_levels, old_crest_level, new_crest_level, water_level, pixel_size):
+    """The discharge reduction factor of a single cross-section and water level"""
+    hydraulic_radii = []
+    for crest_level in [old_crest_level, new_crest_level]:
+        bed_levels = np.maximum(exchange_levels, crest_level)
+        wet_bed_levels = bed_levels[bed_levels < water_level]
+        if len(wet_bed_levels) == 0:
+            return 0
+        area = np.sum(water_level - wet_bed_levels) * pixel_size
+        hydraulic_radii.append(area / (len(wet_bed_levels) * pixel_size))
+    old_hydraulic_radius, new_hydraulic_radius = hydraulic_radii
+    return np.sqrt(new_hydraulic_radius) / np.sqrt(old_hydraulic_radius)
+
+
+def test_discharge_reduction_factors():
+    rng = np.random.default_rng(0)
+    nr_exchange_levels = [1, 4, 7, 7, 3]
+    exchange_levels = np.full((5, 7), np.nan)
+    for i, n in enumerate(nr_exchange_levels):
+        exchange_levels[i, :n] = rng.random(n)
+    old_crest_levels = np.nanmin(exchange_levels, axis=1) + 0.1
+    new_crest_levels = old_crest_levels + 0.2
+    water_levels = rng.random((5, 6)) * 1.5
+    result = discharge_reduction_factors(
+        exchange_levels, old_crest_levels, new_crest_levels, water_levels, pixel_size=0.5
+    )
+    for i, n in enumerate(nr_exchange_levels):
+        for j, water_level in enumerate(water_levels[i]):
+            expected = discharge_reduction_factor(
+                exchange_levels[i, :n], old_crest_levels[i], new_crest_levels[i], water_level, pixel_size=0.5
+            )
+            assert result[i, j] == pytest.approx(expected)
+    assert (result == 0).any() and (result > 0).any()
+
+
+def test_spatial_partitions():
+    # reference cells in a 4 x 4 grid of 10 x 10 cells
+    cells = {}
+    for cell_id in range(16):
+        x, y = 10 * (cell_id % 4), 10 * (cell_id // 4)
+        cells[cell_id] = SimpleNamespace(coords=(x, y, x + 10, y + 10))
+    leak_detector = SimpleNamespace(cell=cells.get)
+    cell_pair_ids = [(cell_id, cell_id + 1) for cell_id in range(16)]
+    partitions = LeakDetector.spatial_partitions(leak_detector, cell_pair_ids, nr_partitions=4)
+    assert [len(partition) for partition in partitions] == [4, 4, 4, 4]
+    assert sorted(np.concatenate(partitions).tolist()) == list(range(16))
+    # the first tile contains the 2 x 2 cells in the lower left corner
+    assert sorted(partitions[0].tolist()) == [0, 1, 4, 5]
+    assert LeakDetector.spatial_partitions(leak_detector, [], nr_partitions=4) == []
+    assert len(LeakDetector.spatial_partitions(leak_detector, cell_pair_ids[:2], nr_partitions=4)) == 2
+
+
+def test_prepared_grid(raster, tmp_path):
+    gridadmin_path = tmp_path / "gridadmin.h5"
+    gridadmin_path.write_bytes(b"")
+    dem = gdal.GetDriverByName("GTiff").CreateCopy(str(tmp_path / "dem.tif"), raster)
+    gridadmin = SimpleNamespace(grid_file=str(gridadmin_path))
+
+    # in-memory datasets are not cached
+    assert PreparedGrid.key(gridadmin, raster, obstacles=None, tile_size=None) is None
+    key = PreparedGrid.key(gridadmin, dem, obstacles=None, tile_size=None)
+    assert key is not None
+    assert key != PreparedGrid.key(gridadmin, dem, obstacles=None, tile_size=100)
+
+    PreparedGrid.clear()
+    prepared_grid = PreparedGrid.take(key)
+    assert prepared_grid.key == key and not prepared_grid.cells
+    PreparedGrid.put(prepared_grid)
+    # taken out of the cache, so a second LeakDetector with the same key gets an empty one
+    assert PreparedGrid.take(key) is prepared_grid
+    assert PreparedGrid.take(key) is not prepared_grid
+    PreparedGrid.put(PreparedGrid(key=None))
+    assert PreparedGrid.take(None).key is None
+    PreparedGrid.clear()
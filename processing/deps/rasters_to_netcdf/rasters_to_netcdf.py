@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Iterator, Optional, Tuple
+import os
 
 from cftime import date2num
 import numpy as np
@@ -13,6 +15,15 @@ from pyproj import CRS
 gdal.UseExceptions()
 osr.UseExceptions()
 
+# Chunk sizes of the values variable. A chunk holds a series of time steps of a
+# spatial block, so that the time series of a pixel is stored in a single chunk per
+# TIME_CHUNK_SIZE time steps.
+TIME_CHUNK_SIZE = 24
+SPATIAL_CHUNK_SIZE = 64
+
+# Maximum number of values that are read from the input rasters before they are written
+MAX_BLOCK_SIZE = 2 ** 23
+
 
 def get_datasets(filepaths: List[Union[str, Path]]) -> List[gdal.Dataset]:
     result = list()
@@ -89,6 +100,38 @@ def setncatts(variable: h5netcdf_Variable, attributes: Dict):
         variable.setncattr(key, value)
 
 
+def blocks(
+        shape: Tuple[int, int, int],
+        chunksizes: Tuple[int, int, int],
+        max_block_size: int = MAX_BLOCK_SIZE
+) -> Iterator[Tuple[slice, slice, slice]]:
+    """
+    Yield the (time, y, x) slices of blocks that consist of whole chunks of a (time, y, x) variable
+
+    A block spans one chunk in the time and y direction and as many chunks in the x direction as fit in
+    `max_block_size` values (but at least one).
+    """
+    nr_times, height, width = shape
+    time_chunk_size, y_chunk_size, x_chunk_size = chunksizes
+    x_chunks_per_block = max(1, max_block_size // (time_chunk_size * y_chunk_size * x_chunk_size))
+    block_width = x_chunks_per_block * x_chunk_size
+    for time_start in range(0, nr_times, time_chunk_size):
+        time_slice = slice(time_start, min(time_start + time_chunk_size, nr_times))
+        for y_start in range(0, height, y_chunk_size):
+            y_slice = slice(y_start, min(y_start + y_chunk_size, height))
+            for x_start in range(0, width, block_width):
+                yield time_slice, y_slice, slice(x_start, min(x_start + block_width, width))
+
+
+def read_block(dataset: gdal.Dataset, y_slice: slice, x_slice: slice) -> np.ndarray:
+    return dataset.GetRasterBand(1).ReadAsArray(
+        xoff=x_slice.start,
+        yoff=y_slice.start,
+        win_xsize=x_slice.stop - x_slice.start,
+        win_ysize=y_slice.stop - y_slice.start,
+    )
+
+
 def rasters_to_netcdf(
         rasters: List[Union[str, Path]],
         start_time: datetime,
@@ -97,13 +140,21 @@ def rasters_to_netcdf(
         output_path: Union[str, Path],
         time_units: str = 'seconds since 1970-01-01 00:00:00.0 +0000',
         calendar: str = 'standard',
-        offset: int = 0
+        offset: int = 0,
+        time_chunk_size: int = TIME_CHUNK_SIZE,
+        spatial_chunk_size: int = SPATIAL_CHUNK_SIZE,
+        threads: Optional[int] = None
 ) -> None:
     """
+    The values are written to a compressed variable that is chunked in time and space. They are read from the
+    input rasters in blocks of whole chunks, so that the memory use does not depend on the number of rasters. The
+    rasters of a block are decoded in parallel threads, while the previous block is compressed and written.
+
     :param interval: interval in seconds
     :param units: one of 'mm', 'm/s', 'mm/h', 'mm/hr'. Note: in case of `mm` the rate is determined by looking at the
        next `time` value.
     :param offset: offset in seconds
+    :param threads: number of threads that read the input rasters, defaults to the number of CPUs
     """
     datasets = get_datasets(rasters)
     assert rasters_have_same_srs(datasets), "Not all input rasters have the same Spatial Reference System"
@@ -174,7 +225,17 @@ def rasters_to_netcdf(
     time_var[:] = date2num(time_steps_datetime, units=time_units, calendar=calendar)
 
     # rain data
-    rain_var = output_dataset.createVariable(varname='values', datatype='float', dimensions=('time', 'lat', 'lon'))
+    shape = (len(rasters), datasets[0].RasterYSize, datasets[0].RasterXSize)
+    chunksizes = tuple(max(1, min(chunk_size, size)) for chunk_size, size in zip(
+        (time_chunk_size, spatial_chunk_size, spatial_chunk_size), shape
+    ))
+    rain_var = output_dataset.createVariable(
+        varname='values',
+        datatype='float',
+        dimensions=('time', 'lat', 'lon'),
+        zlib=True,
+        chunksizes=chunksizes,
+    )
     rain_attrs = {
         'long_name': 'rain',
         'grid_mapping': 'crs',
@@ -183,8 +244,23 @@ def rasters_to_netcdf(
         'units': units
     }
     setncatts(rain_var, rain_attrs)
-    for i, dataset in enumerate(datasets):
-        rain_var[i] = dataset.GetRasterBand(1).ReadAsArray()
-        output_dataset.sync()
+
+    # A dataset is read by a single thread at a time, because the reads of the next block are only submitted after
+    # those of the current block are done.
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as executor:
+        def submit(block):
+            time_slice, y_slice, x_slice = block
+            return [executor.submit(read_block, dataset, y_slice, x_slice) for dataset in datasets[time_slice]]
+
+        block_iterator = blocks(shape, chunksizes)
+        block = next(block_iterator, None)
+        futures = submit(block) if block else []
+        while block:
+            values = np.stack([future.result() for future in futures])
+            next_block = next(block_iterator, None)
+            if next_block:
+                futures = submit(next_block)
+            rain_var[block] = values
+            block = next_block
     output_dataset.close()
 
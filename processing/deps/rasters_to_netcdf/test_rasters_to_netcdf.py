@@ -2,10 +2,12 @@ from datetime import datetime
 from pathlib import Path
 import tempfile
 
+import numpy as np
 import pytest
 
 from threedi_results_analysis.processing.deps.rasters_to_netcdf.rasters_to_netcdf import rasters_to_netcdf
 from osgeo import gdal
+import h5netcdf  # after osgeo, see rasters_to_netcdf.py
 gdal.UseExceptions()
 
 DATA_DIR = Path(__file__).parent
@@ -28,3 +30,26 @@ def test_rasters_to_netcdf():
         )
         result_nc = gdal.Open(str(output_path))
         assert result_nc.RasterCount == 3
+
+
+def test_rasters_to_netcdf_chunked():
+    filepaths = [DATA_DIR / "rain.tif"] * 5
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_path = Path(tmpdir) / "output_chunked.nc"
+        rasters_to_netcdf(
+            rasters=filepaths,
+            start_time=datetime.strptime('2020-01-01T12:00:00', "%Y-%m-%dT%H:%M:%S"),
+            interval=3600,
+            units="mm",
+            output_path=output_path,
+            time_chunk_size=2,
+            spatial_chunk_size=3,
+            threads=2,
+        )
+        expected = gdal.Open(str(DATA_DIR / "rain.tif")).GetRasterBand(1).ReadAsArray()
+        with h5netcdf.File(output_path, "r") as dataset:
+            values = dataset["values"]
+            assert values.chunks == (2,) + tuple(min(3, size) for size in expected.shape)
+            assert values.compression == "gzip"
+            for i in range(5):
+                np.testing.assert_equal(values[i], expected)
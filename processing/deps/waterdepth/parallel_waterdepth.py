@@ -0,0 +1,258 @@
+"""Water depth/level rasters of many timesteps, calculated in worker processes
+
+threedidepth calculates the rasters one timestep and one DEM block at a time, in a
+single process. Here, the DEM blocks of all requested timesteps are divided into tasks
+that are calculated in worker processes by threedidepth's own calculators. The results
+are written in the same order and with the same converters as
+threedidepth.calculate.calculate_waterdepth() does.
+
+This module is imported by the worker processes, so it must not import anything
+from qgis (see utils.processes).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from osgeo import gdal
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import Delaunay
+from threedigrid.admin.constants import NO_DATA_VALUE
+from threedidepth.calculate import calculate_waterdepth as calculate_waterdepth_serial
+from threedidepth.calculate import calculator_classes
+from threedidepth.calculate import GeoTIFFConverter
+from threedidepth.calculate import LinearLevelCalculator
+from threedidepth.calculate import LizardLevelCalculator
+from threedidepth.calculate import MODE_LIZARD
+from threedidepth.calculate import NetcdfConverter
+from threedidepth.calculate import ResultAdmin
+from threedidepth.fixes import fix_gridadmin
+from threedi_results_analysis.utils.processes import bounded_map
+from threedi_results_analysis.utils.processes import default_workers
+from threedi_results_analysis.utils.processes import spawn_context
+
+# Maximum number of DEM pixels that are calculated in a single task
+TASK_PIXELS = 2 ** 22
+
+# (xoff, xsize), (yoff, ysize) of a DEM block, as yielded by GeoTIFFConverter.partition()
+Window = Tuple[Tuple[int, int], Tuple[int, int]]
+
+# Set in each worker process by _init_worker()
+_worker_context = {}
+
+
+def parse_calculation_steps(text: str, nr_calculation_steps: int) -> List[int]:
+    """Return the sorted calculation steps in a selection like "0, 6, 12-48:12"
+
+    The selection consists of comma separated calculation steps and ranges
+    ``first-last`` (including the last) with an optional interval (``:interval``).
+
+    :raises ValueError: if the selection is invalid or outside
+        [0, nr_calculation_steps - 1]
+    """
+    calculation_steps = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, _, last = part.partition("-")
+                last, _, interval = last.partition(":")
+                first, last, interval = int(first), int(last), int(interval or 1)
+                if last < first or interval < 1:
+                    raise ValueError
+                calculation_steps.update(range(first, last + 1, interval))
+            else:
+                calculation_steps.add(int(part))
+        except ValueError:
+            raise ValueError(f"Invalid timestep selection: '{part}'")
+    if not calculation_steps:
+        raise ValueError("No timesteps selected")
+    if min(calculation_steps) < 0 or max(calculation_steps) >= nr_calculation_steps:
+        raise ValueError(f"Timesteps should be between 0 and {nr_calculation_steps - 1}")
+    return sorted(calculation_steps)
+
+
+def split_windows(windows: Sequence[Window], nr_parts: int, max_pixels: int = TASK_PIXELS) -> List[List[Window]]:
+    """Split the windows in consecutive parts of about equal size
+
+    There are at least ``nr_parts`` parts (if there are that many windows), and no
+    part has more than ``max_pixels`` pixels, unless it consists of a single window.
+    """
+    sizes = [xsize * ysize for (_, xsize), (_, ysize) in windows]
+    part_pixels = min(max_pixels, -(-sum(sizes) // max(nr_parts, 1)))
+    parts = []
+    part = []
+    pixels = 0
+    for window, size in zip(windows, sizes):
+        if part and pixels + size > part_pixels:
+            parts.append(part)
+            part = []
+            pixels = 0
+        part.append(window)
+        pixels += size
+    if part:
+        parts.append(part)
+    return parts
+
+
+def _init_worker(gridadmin_path, results_3di_path, dem_path, mode, dem_shape, dem_geo_transform, no_data_value):
+    _worker_context.update(
+        result_admin=ResultAdmin(gridadmin_path=gridadmin_path, results_3di_path=results_3di_path),
+        dem=gdal.Open(dem_path, gdal.GA_ReadOnly),
+        calculator_class=calculator_classes[mode],
+        dem_shape=dem_shape,
+        dem_geo_transform=dem_geo_transform,
+        no_data_value=no_data_value,
+        calculator=None,
+        triangulation=None,
+    )
+
+
+def _share_triangulation(calculator):
+    """Let the calculator use the triangulation of the nodes of an earlier calculation step
+
+    threedidepth triangulates the nodes again for every calculation step, while the
+    triangulation only depends on the node coordinates.
+    """
+    if isinstance(calculator, LizardLevelCalculator):
+        if _worker_context["triangulation"] is None:
+            _worker_context["triangulation"] = calculator.delaunay
+        calculator.cache[calculator.DELAUNAY] = _worker_context["triangulation"]
+    elif isinstance(calculator, LinearLevelCalculator):
+        if _worker_context["triangulation"] is None:
+            points, ids = calculator.coordinates
+            _worker_context["triangulation"] = Delaunay(points), ids
+        triangulation, ids = _worker_context["triangulation"]
+        calculator.cache[calculator.INTERPOLATOR] = LinearNDInterpolator(
+            triangulation, calculator.lookup_s1[ids], fill_value=NO_DATA_VALUE
+        )
+
+
+def _calculator(calculation_step: int):
+    """Return the calculator for the calculation step, reusing the previous one if possible"""
+    calculator = _worker_context["calculator"]
+    if calculator is not None and calculator.calculation_step == calculation_step:
+        return calculator
+    if calculator is not None:
+        calculator.__exit__()
+    calculator = _worker_context["calculator_class"](
+        result_admin=_worker_context["result_admin"],
+        dem_shape=_worker_context["dem_shape"],
+        dem_geo_transform=_worker_context["dem_geo_transform"],
+        calculation_step=calculation_step,
+    ).__enter__()
+    _share_triangulation(calculator)
+    _worker_context["calculator"] = calculator
+    return calculator
+
+
+def _calculate(calculation_step: int, windows: List[Window]) -> List[np.ndarray]:
+    """Return the result of each window for the calculation step"""
+    calculator = _calculator(calculation_step)
+    dem = _worker_context["dem"]
+    results = []
+    for (xoff, xsize), (yoff, ysize) in windows:
+        values = dem.ReadAsArray(xoff=xoff, yoff=yoff, xsize=xsize, ysize=ysize)
+        indices = (yoff, xoff), (yoff + ysize, xoff + xsize)
+        results.append(calculator(indices=indices, values=values, no_data_value=_worker_context["no_data_value"]))
+    return results
+
+
+def _write(converter, band: int, window: Window, result: np.ndarray):
+    """Write the result of a window like converter.convert_using() does"""
+    (xoff, xsize), (yoff, ysize) = window
+    if isinstance(converter, NetcdfConverter):
+        converter.target["water_depth"][band, yoff:yoff + ysize, xoff:xoff + xsize] = result
+    else:
+        # note GDAL counts bands starting at 1
+        converter.target.GetRasterBand(band + 1).WriteArray(array=result, xoff=xoff, yoff=yoff)
+
+
+def calculate_waterdepth(
+    gridadmin_path: str,
+    results_3di_path: str,
+    dem_path: str,
+    waterdepth_path: str,
+    calculation_steps: Sequence[int],
+    mode: str = MODE_LIZARD,
+    progress_func: Optional[Callable[[float], None]] = None,
+    netcdf: bool = False,
+    workers: Optional[int] = None,
+) -> None:
+    """Calculate the water depth/level rasters of the calculation steps
+
+    Takes the same arguments as threedidepth.calculate.calculate_waterdepth(), with
+    the exception of calculate_maximum_waterlevel, and writes the same file.
+
+    :param calculation_steps: any selection of calculation steps, e.g. every 12th
+    :param progress_func: called with the finished fraction. It may raise an
+        exception to cancel the calculation, leaving the partially written file.
+    :param workers: number of worker processes. Defaults to the number of CPUs
+        minus one. With 1 worker, the rasters are calculated by threedidepth in
+        this process. With more workers, the timesteps are divided over the workers,
+        and so are the DEM blocks if there are less timesteps than workers.
+    """
+    if workers is None:
+        workers = default_workers()
+    if workers == 1:
+        calculate_waterdepth_serial(
+            gridadmin_path=gridadmin_path,
+            results_3di_path=results_3di_path,
+            dem_path=dem_path,
+            waterdepth_path=waterdepth_path,
+            calculation_steps=list(calculation_steps),
+            mode=mode,
+            progress_func=progress_func,
+            netcdf=netcdf,
+        )
+        return
+
+    if mode not in calculator_classes:
+        raise ValueError(f"Unknown mode: '{mode}'")
+    result_admin = ResultAdmin(gridadmin_path=gridadmin_path, results_3di_path=results_3di_path)
+    calculation_steps = list(calculation_steps)
+    max_calculation_step = result_admin.calculation_steps - 1
+    if not calculation_steps or min(calculation_steps) < 0 or max(calculation_steps) > max_calculation_step:
+        raise ValueError(f"Calculation steps should be between 0 and {max_calculation_step}")
+
+    fix_gridadmin(gridadmin_path)
+
+    converter_kwargs = {"source_path": dem_path, "target_path": waterdepth_path}
+    if netcdf:
+        converter = NetcdfConverter(
+            result_admin=result_admin, calculation_steps=calculation_steps, **converter_kwargs
+        )
+    else:
+        converter = GeoTIFFConverter(band_count=len(calculation_steps), **converter_kwargs)
+
+    with converter:
+        windows = list(converter.partition())
+        nr_parts = -(-workers // len(calculation_steps))
+        tasks = [
+            (band, calculation_step, part)
+            for band, calculation_step in enumerate(calculation_steps)
+            for part in split_windows(windows, nr_parts)
+        ]
+        initargs = (
+            gridadmin_path,
+            results_3di_path,
+            dem_path,
+            mode,
+            (converter.raster_y_size, converter.raster_x_size),
+            converter.geo_transform,
+            converter.no_data_value,
+        )
+        nr_written = 0
+        nr_windows = len(calculation_steps) * len(windows)
+        calls = ((_calculate, calculation_step, part) for _, calculation_step, part in tasks)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=spawn_context(), initializer=_init_worker, initargs=initargs
+        ) as executor, closing(bounded_map(executor, calls, max_pending=2 * workers)) as results:
+            for (band, _, part), part_results in zip(tasks, results):
+                for window, result in zip(part, part_results):
+                    _write(converter, band, window, result)
+                    nr_written += 1
+                    if progress_func:
+                        progress_func(nr_written / nr_windows)
@@ -0,0 +1,23 @@
+import pytest
+
+from threedi_results_analysis.processing.deps.waterdepth.parallel_waterdepth import parse_calculation_steps
+from threedi_results_analysis.processing.deps.waterdepth.parallel_waterdepth import split_windows
+
+
+def test_parse_calculation_steps():
+    assert parse_calculation_steps("12-48:12, 0,6, 3-4,", 50) == [0, 3, 4, 6, 12, 24, 36, 48]
+    assert parse_calculation_steps("7", 8) == [7]
+
+
+@pytest.mark.parametrize("text", ["a", "5-2", "1-4:0", "-1", " ", "8"])
+def test_parse_calculation_steps_invalid(text):
+    with pytest.raises(ValueError):
+        parse_calculation_steps(text, 8)
+
+
+def test_split_windows():
+    windows = [((x, 10), (0, 10)) for x in range(0, 70, 10)]
+    assert split_windows(windows, 3) == [windows[0:2], windows[2:4], windows[4:6], windows[6:]]
+    assert split_windows(windows, 1) == [windows]
+    assert [len(part) for part in split_windows(windows, 1, max_pixels=250)] == [2, 2, 2, 1]
+    assert split_windows(windows[:2], 5) == [windows[:1], windows[1:2]]
@@ -28,6 +28,7 @@ from qgis.core import (
     QgsProcessingAlgorithm,
     QgsProcessingContext,
     QgsProcessingException,
+    QgsProcessingParameterBoolean,
     QgsProcessingParameterFeatureSink,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterFile,
@@ -65,10 +66,16 @@ class DetectLeakingObstaclesBase(QgsProcessingAlgorithm):
     INPUT_FLOWLINES = "INPUT_FLOWLINES"
     INPUT_OBSTACLES = "INPUT_OBSTACLES"
     INPUT_MIN_OBSTACLE_HEIGHT = "INPUT_MIN_OBSTACLE_HEIGHT"
+    INPUT_WORKERS = "INPUT_WORKERS"
+    INPUT_TILE_SIZE = "INPUT_TILE_SIZE"
+    INPUT_KEEP_PREPARED_GRID = "INPUT_KEEP_PREPARED_GRID"
 
     OUTPUT_EDGES = "OUTPUT_EDGES"
     OUTPUT_OBSTACLES = "OUTPUT_OBSTACLES"
 
+    # whether the results of the tiles can be written while the remaining tiles are processed
+    stream_results = True
+
     def initAlgorithm(self, config):
 
         self.addParameter(
@@ -109,6 +116,34 @@ class DetectLeakingObstaclesBase(QgsProcessingAlgorithm):
         min_obstacle_height_param.setMetadata({"widget_wrapper": {"decimals": 3}})
         self.addParameter(min_obstacle_height_param)
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_WORKERS,
+                "Number of worker processes",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_TILE_SIZE,
+                "Tile size (pixels)",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.INPUT_KEEP_PREPARED_GRID,
+                "Keep cells and edges in memory for the next run",
+                defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT_EDGES,
@@ -179,6 +214,11 @@ class DetectLeakingObstaclesBase(QgsProcessingAlgorithm):
         flowlines_source = self.parameterAsSource(parameters, self.INPUT_FLOWLINES, context)
         obstacles_source = self.parameterAsSource(parameters, self.INPUT_OBSTACLES, context)
         self.min_obstacle_height = self.parameterAsDouble(parameters, self.INPUT_MIN_OBSTACLE_HEIGHT, context)
+        # 0 means the number of CPUs minus one
+        self.workers = self.parameterAsInt(parameters, self.INPUT_WORKERS, context) or None
+        # 0 means no tiling
+        self.tile_size = self.parameterAsInt(parameters, self.INPUT_TILE_SIZE, context) or None
+        self.keep_prepared_grid = self.parameterAsBool(parameters, self.INPUT_KEEP_PREPARED_GRID, context)
 
         crs = QgsCoordinateReferenceSystem(f"EPSG:{self.gridadmin.epsg_code}")
 
@@ -233,7 +273,9 @@ class DetectLeakingObstaclesBase(QgsProcessingAlgorithm):
             flowline_ids=self.flowline_ids,
             min_obstacle_height=self.min_obstacle_height,
             obstacles=self.input_obstacles,
-            feedback=feedback
+            feedback=feedback,
+            tile_size=self.tile_size,
+            cache_prepared_grid=self.keep_prepared_grid
         )
         return leak_detector
 
@@ -244,7 +286,27 @@ class DetectLeakingObstaclesBase(QgsProcessingAlgorithm):
         if feedback.isCanceled():
             return {}
         feedback.setProgressText("Find obstacles...")
-        leak_detector.run(feedback=feedback)
+        if self.tile_size and self.stream_results:
+            # write the results of each tile as soon as they are final, instead of keeping all of them until the end
+            for edges in leak_detector.run_tiled(feedback=feedback):
+                edges = [edge for edge in edges if edge.obstacles]
+                self.add_features_to_sink(
+                    feedback=feedback,
+                    sink=self.edges_sink,
+                    features_data=(edge.as_dict(geometry='EDGE') for edge in edges)
+                )
+                self.add_features_to_sink(
+                    feedback=feedback,
+                    sink=self.obstacles_sink,
+                    features_data=(edge.as_dict(geometry='OBSTACLE') for edge in edges)
+                )
+            if not feedback.isCanceled():
+                leak_detector.release_prepared_grid()
+            return {
+                self.OUTPUT_EDGES: self.edges_sink_dest_id,
+                self.OUTPUT_OBSTACLES: self.obstacles_sink_dest_id
+            }
+        leak_detector.run(feedback=feedback, workers=self.workers)
         feedback.setProgressText("Create 'Obstacle on cell edge' features...")
         self.add_features_to_sink(
             feedback=feedback,
@@ -257,6 +319,8 @@ class DetectLeakingObstaclesBase(QgsProcessingAlgorithm):
             sink=self.obstacles_sink,
             features_data=leak_detector.results(geometry='OBSTACLE')
         )
+        if not feedback.isCanceled():
+            leak_detector.release_prepared_grid()
 
         return {
             self.OUTPUT_EDGES: self.edges_sink_dest_id,
@@ -316,6 +380,12 @@ class DetectLeakingObstaclesAlgorithm(DetectLeakingObstaclesBase):
                 <p>Can be used to limit the analysis to a specific part of the computational grid. For example, select flowlines that have a total discharge of > 10 m<sup>3</sup></p>
                 <h4>Minimum obstacle height (m)</h4>
                 <p>Only obstacles with a crest level that is significantly higher than the exchange level will be identified. 'Significantly higher' is defined as <em>crest level &gt; exchange level + minimum obstacle height</em>.</p>
+                <h4>Number of worker processes</h4>
+                <p>Number of processes that search for obstacles in parallel. Use 0 for the number of processors minus one.</p>
+                <h4>Tile size (pixels)</h4>
+                <p>To limit the memory use for large DEMs, the grid can be processed in square tiles of this many DEM pixels. Only the DEM pixels of one tile are kept in memory and the results are written per tile. The number of worker processes is not used in this case. Use 0 to process the whole grid at once.</p>
+                <h4>Keep cells and edges in memory for the next run</h4>
+                <p>Keep the cells (including their DEM pixels) and edges of this run in memory, so that a next run with the same gridadmin file, DEM, linear obstacles and tiling, but other thresholds or flowlines, is faster. Only the cells and edges of the last run are kept. Leave this unchecked to free the memory when the algorithm finishes.</p>
                 <h4>Vertical search precision (m)</h4>
                 <p>The crest level of the identified obstacle will always be within <em>vertical search precision</em> of the actual crest level. A smaller value will yield more precise results; a higher value will make the algorithm faster to execute.</p>
                 <h3>Outputs</h3>
@@ -340,6 +410,9 @@ class DetectLeakingObstaclesWithDischargeThresholdAlgorithm(DetectLeakingObstacl
     INPUT_RESULTS_THREEDI = "INPUT_RESULTS_THREEDI"
     INPUT_MIN_DISCHARGE = "INPUT_MIN_DISCHARGE"
 
+    # the discharge reduction is calculated after all obstacles have been found
+    stream_results = False
+
     def initAlgorithm(self, config):
         super().initAlgorithm(config)
         self.addParameter(
@@ -377,7 +450,9 @@ class DetectLeakingObstaclesWithDischargeThresholdAlgorithm(DetectLeakingObstacl
             min_obstacle_height=self.min_obstacle_height,
             min_discharge=self.min_discharge,
             obstacles=self.input_obstacles,
-            feedback=feedback
+            feedback=feedback,
+            tile_size=self.tile_size,
+            cache_prepared_grid=self.keep_prepared_grid
         )
         return leak_detector
 
@@ -1,6 +1,7 @@
 # See https://docs.qgis.org/3.10/en/docs/pyqgis_developer_cookbook/processing.html
 from qgis.core import QgsProcessingProvider
 from qgis.PyQt.QtGui import QIcon
+from threedi_results_analysis.processing.animation_export_algorithm import ExportAnimationFramesAlgorithm
 from threedi_results_analysis.processing.dwf_calculation_algorithm import DWFCalculatorAlgorithm
 from threedi_results_analysis.processing.gpkg_conversion_algorithm import ThreeDiConvertToGpkgAlgorithm
 from threedi_results_analysis.processing.grid_creation_algorithm import ThreeDiGenerateCompGridAlgorithm
@@ -41,6 +42,7 @@ class ThreediProvider(QgsProcessingProvider):
         self.addAlgorithm(DetectLeakingObstaclesAlgorithm())
         self.addAlgorithm(DetectLeakingObstaclesWithDischargeThresholdAlgorithm())
         self.addAlgorithm(RastersToNetCDFAlgorithm())
+        self.addAlgorithm(ExportAnimationFramesAlgorithm())
 
     def id(self, *args, **kwargs):
         """The ID of your plugin, used for identifying the provider.
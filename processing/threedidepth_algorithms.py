@@ -35,6 +35,7 @@ from threedidepth.calculate import MODE_CONSTANT_S1
 from threedidepth.calculate import MODE_LINEAR
 from threedidepth.calculate import MODE_LIZARD
 from threedidepth.calculate import MODE_LIZARD_S1
+from threedi_results_analysis.processing.deps.waterdepth import parallel_waterdepth
 from threedi_results_analysis.utils.user_messages import pop_up_info
 
 import h5py
@@ -210,6 +211,9 @@ class ThreediDepthAlgorithm(QgsProcessingAlgorithm):
     CALCULATION_STEP_INPUT = "CALCULATION_STEP_INPUT"
     AS_NETCDF_INPUT = "AS_NETCDF_INPUT"
     CALCULATION_STEP_END_INPUT = "CALCULATION_STEP_END_INPUT"
+    CALCULATION_STEP_INTERVAL_INPUT = "CALCULATION_STEP_INTERVAL_INPUT"
+    CALCULATION_STEPS_INPUT = "CALCULATION_STEPS_INPUT"
+    WORKERS_INPUT = "WORKERS_INPUT"
     WATER_DEPTH_LEVEL_NAME = "WATER_DEPTH_LEVEL_NAME"
     OUTPUT_DIRECTORY = "OUTPUT_DIRECTORY"
     WATER_DEPTH_OUTPUT = "WATER_DEPTH_OUTPUT"
@@ -244,7 +248,20 @@ class ThreediDepthAlgorithm(QgsProcessingAlgorithm):
 
     def shortHelpString(self):
         """Returns a localised short helper string for the algorithm"""
-        return self.tr("Calculate water depth/level raster for specified timestep")
+        return self.tr(
+            """
+            <p>Calculate water depth/level raster for specified timestep</p>
+            <h3>Parameters</h3>
+            <h4>Last timestep</h4>
+            <p>Export the timesteps from the first timestep up to (but not including) the last timestep, each as a band of the raster.</p>
+            <h4>Timestep interval</h4>
+            <p>Only export every n-th timestep between the first and last timestep, e.g. 12 for hourly rasters of a result with a 5-minute output interval.</p>
+            <h4>Timesteps</h4>
+            <p>Export any selection of timesteps instead of those between the first and last timestep. Use comma separated timestep numbers and ranges, with an optional interval, e.g. <i>0, 6, 12-48:12</i>. The first timestep of the result is 0.</p>
+            <h4>Number of worker processes</h4>
+            <p>Number of processes that calculate the raster at the same time. They divide the timesteps or, if there are fewer timesteps than processes, the DEM blocks. With 1 (the default), the raster is calculated without worker processes. Use 0 to use all but one CPU cores.</p>
+            """
+        )
 
     def initAlgorithm(self, config=None):
         """Here we define the inputs and output of the algorithm"""
@@ -281,6 +298,31 @@ class ThreediDepthAlgorithm(QgsProcessingAlgorithm):
                 optional=True,
             )
         )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.CALCULATION_STEP_INTERVAL_INPUT,
+                description=self.tr("Timestep interval (for multiple timesteps export)"),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=1,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                name=self.CALCULATION_STEPS_INPUT,
+                description=self.tr("Timesteps, e.g. 0, 6, 12-48:12 (overrides the first and last timestep)"),
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.WORKERS_INPUT,
+                description=self.tr("Number of worker processes"),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=1,
+            )
+        )
         self.addParameter(
             QgsProcessingParameterString(
                 self.WATER_DEPTH_LEVEL_NAME,
@@ -312,14 +354,25 @@ class ThreediDepthAlgorithm(QgsProcessingAlgorithm):
         mode_index = self.parameterAsEnum(parameters, self.MODE_INPUT, context)
         step = parameters[self.CALCULATION_STEP_INPUT]
         endstep = parameters[self.CALCULATION_STEP_END_INPUT]
-        if endstep:
+        interval = self.parameterAsInt(parameters, self.CALCULATION_STEP_INTERVAL_INPUT, context)
+        timesteps_text = self.parameterAsString(parameters, self.CALCULATION_STEPS_INPUT, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS_INPUT, context) or None
+        if timesteps_text.strip():
+            with h5py.File(results_3di_path, "r") as results:
+                nr_timesteps = len(results["time"])
+            try:
+                timesteps = parallel_waterdepth.parse_calculation_steps(timesteps_text, nr_timesteps)
+            except ValueError as e:
+                feedback.reportError(str(e), fatalError=True)
+                return {}
+        elif endstep:
             if endstep <= step:
                 feedback.reportError(
                     "The last timestep should be larger than the first timestep.",
                     fatalError=True,
                 )
                 return {}
-            timesteps = list(range(step, endstep))
+            timesteps = list(range(step, endstep, interval))
         else:
             timesteps = [step]
 
@@ -339,7 +392,7 @@ class ThreediDepthAlgorithm(QgsProcessingAlgorithm):
             os.remove(waterdepth_output_file)
 
         try:
-            calculate_waterdepth(
+            parallel_waterdepth.calculate_waterdepth(
                 gridadmin_path=gridadmin_path,
                 results_3di_path=results_3di_path,
                 dem_path=dem_filename,
@@ -348,6 +401,7 @@ class ThreediDepthAlgorithm(QgsProcessingAlgorithm):
                 mode=self.MODES[mode_index].name,
                 progress_func=Progress(feedback),
                 netcdf=as_netcdf,
+                workers=workers,
             )
         except CancelError:
             # When the process is cancelled, we just show the intermediate product
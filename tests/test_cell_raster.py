@@ -0,0 +1,41 @@
+"""
+Test cell rasterization.
+"""
+from threedi_results_analysis.utils.cell_raster import cell_label_image
+from threedi_results_analysis.utils.cell_raster import cell_pixel_bounds
+from threedi_results_analysis.utils.cell_raster import NO_CELL
+
+import numpy as np
+
+
+# xmin, ymin, xmax, ymax of a 20x10 cell, a 10x10 cell and two 10x20 cells
+CELL_COORDS = np.array(
+    [
+        [0, 20, 0, 20],
+        [0, 0, 10, 10],
+        [20, 30, 10, 30],
+        [10, 10, 30, 30],
+    ],
+    dtype=float,
+)
+
+
+def test_cell_pixel_bounds():
+    (row_start, row_end, col_start, col_end), shape, geotransform = cell_pixel_bounds(CELL_COORDS, pixel_size=10)
+    assert shape == (3, 3)
+    assert geotransform == (0.0, 10.0, 0.0, 30.0, 0.0, -10.0)
+    assert row_start.tolist() == [2, 2, 0, 0]
+    assert row_end.tolist() == [3, 3, 2, 2]
+    assert col_start.tolist() == [0, 2, 0, 2]
+    assert col_end.tolist() == [2, 3, 1, 3]
+
+
+def test_cell_label_image():
+    labels, geotransform = cell_label_image(CELL_COORDS, pixel_size=5)
+    assert labels.shape == (6, 6)
+    assert geotransform == (0.0, 5.0, 0.0, 30.0, 0.0, -5.0)
+    assert (labels[4:, :4] == 0).all()
+    assert (labels[4:, 4:] == 1).all()
+    assert (labels[:4, :2] == 2).all()
+    assert (labels[:4, 4:] == 3).all()
+    assert (labels[:4, 2:4] == NO_CELL).all()
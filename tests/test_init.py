@@ -64,3 +64,17 @@ def test_classFactory(qtbot):
     with mock.patch("threedi_results_analysis.threedi_plugin.ThreeDiPlugin.__init__", mock_init):
         iface = mock.Mock()
         assert threedi_results_analysis.classFactory(iface)
+
+
+def test_init_in_worker_process():
+    # worker processes import the package, but should not run the dependency mechanism
+    with mock.patch("multiprocessing.parent_process", return_value=mock.Mock()):
+        with mock.patch.object(dependencies, "ensure_everything_installed") as ensure_everything_installed:
+            importlib.reload(threedi_results_analysis)
+    assert threedi_results_analysis.IN_WORKER_PROCESS
+    ensure_everything_installed.assert_not_called()
+
+    with mock.patch.object(dependencies, "ensure_everything_installed") as ensure_everything_installed:
+        importlib.reload(threedi_results_analysis)
+    assert not threedi_results_analysis.IN_WORKER_PROCESS
+    ensure_everything_installed.assert_called_once()
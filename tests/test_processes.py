@@ -0,0 +1,44 @@
+"""
+Test the worker process helpers.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from threedi_results_analysis.utils.processes import bounded_map
+
+import threading
+
+
+def test_bounded_map_order_and_bound():
+    submitted = []
+    consumed = []
+
+    def calls():
+        for i in range(20):
+            submitted.append(i)
+            # no more than max_pending calls are submitted ahead of the consumer
+            assert len(submitted) - len(consumed) <= 3
+            yield pow, i, 2
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for result in bounded_map(executor, calls(), max_pending=3):
+            consumed.append(result)
+    assert consumed == [i ** 2 for i in range(20)]
+
+
+def test_bounded_map_cancels_on_close():
+    release = threading.Event()
+    started = []
+
+    def wait(i):
+        started.append(i)
+        if i > 0:
+            release.wait(5)
+        return i
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with closing(bounded_map(executor, ((wait, i) for i in range(10)), max_pending=4)) as results:
+            assert next(results) == 0
+        release.set()
+    # only call 1 may have been running when the iteration was stopped; the pending
+    # calls have been cancelled and the other calls were never submitted
+    assert started in ([0], [0, 1])
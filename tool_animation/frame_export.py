@@ -0,0 +1,167 @@
+"""Headless export of animation frames
+
+Frames are rendered directly from the result arrays instead of through the map
+canvas. A label image that maps every pixel to a 2D cell is computed once, after
+which rendering a frame is an array lookup of the cell values in that label image,
+followed by a lookup of the class colors. Rendering and PNG encoding run in worker
+processes.
+
+This module is imported by the worker processes, so it must not import anything
+from qgis. The package ``__init__`` skips its qgis imports and the dependency
+mechanism in these processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import shutil
+import subprocess
+
+from osgeo import gdal
+from threedi_results_analysis.utils.processes import bounded_map
+from threedi_results_analysis.utils.processes import default_workers
+from threedi_results_analysis.utils.processes import spawn_context
+
+gdal.UseExceptions()
+
+TRANSPARENT = (0, 0, 0, 0)
+
+# Set in each worker process by _init_worker(), so that the (large) label image
+# is sent to a worker only once instead of once per frame
+_frame_context = {}
+
+
+def color_table(colors: Sequence[str], nr_classes: int) -> np.ndarray:
+    """Return a (nr_classes, 4) uint8 RGBA table, linearly interpolated between the hex ``colors``"""
+    rgb = np.array(
+        [[int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)] for color in colors],
+        dtype=float,
+    )
+    stops = np.linspace(0, 1, len(colors))
+    positions = np.linspace(0, 1, nr_classes)
+    table = np.empty((nr_classes, 4), dtype=np.uint8)
+    for channel in range(3):
+        table[:, channel] = np.round(np.interp(positions, stops, rgb[:, channel]))
+    table[:, 3] = 255
+    return table
+
+
+def render_frame(
+    labels: np.ndarray, values: np.ndarray, class_bounds: Sequence[float], table: np.ndarray
+) -> np.ndarray:
+    """Return an RGBA image (height, width, 4) of ``values`` per cell, classified by ``class_bounds``
+
+    Values below the first class bound get the first color, values above the last
+    class bound the last color. Pixels outside cells and cells with NaN values are
+    transparent.
+    """
+    classes = np.clip(np.digitize(values, class_bounds[1:-1]), 0, len(table) - 1)
+    cell_colors = table[classes]
+    cell_colors[np.isnan(values)] = TRANSPARENT
+    # append a transparent "cell" so that NO_CELL (-1) pixels pick it up
+    cell_colors = np.vstack([cell_colors, np.array([TRANSPARENT], dtype=np.uint8)])
+    return cell_colors[labels]
+
+
+def write_png(path: Union[str, Path], image: np.ndarray, geotransform=None) -> None:
+    """Write an RGBA image to a PNG file, with a world file if ``geotransform`` is given"""
+    height, width, nr_bands = image.shape
+    mem_dataset = gdal.GetDriverByName("MEM").Create("", width, height, nr_bands, gdal.GDT_Byte)
+    if geotransform is not None:
+        mem_dataset.SetGeoTransform(geotransform)
+    for band in range(nr_bands):
+        mem_dataset.GetRasterBand(band + 1).WriteArray(image[:, :, band])
+    options = ["WORLDFILE=YES"] if geotransform is not None else []
+    gdal.GetDriverByName("PNG").CreateCopy(str(path), mem_dataset, options=options)
+    mem_dataset = None
+
+
+def _init_worker(labels, class_bounds, table, geotransform):
+    _frame_context.update(
+        labels=labels, class_bounds=class_bounds, table=table, geotransform=geotransform
+    )
+
+
+def _render_and_write(path, values):
+    image = render_frame(
+        _frame_context["labels"], values, _frame_context["class_bounds"], _frame_context["table"]
+    )
+    write_png(path, image, _frame_context["geotransform"])
+    return path
+
+
+def export_frames(
+    frames: Iterable[Tuple[Union[str, Path], np.ndarray]],
+    labels: np.ndarray,
+    class_bounds: Sequence[float],
+    table: np.ndarray,
+    geotransform=None,
+    workers: Optional[int] = None,
+    progress_func: Optional[Callable[[int], None]] = None,
+) -> List[str]:
+    """Render and write frames as PNG files
+
+    :param frames: iterable of (output path, cell values) tuples. The values are
+        indexed in the same way as the cells in ``labels``. The iterable is consumed
+        lazily, so it can read the result file in chunks.
+    :param workers: number of worker processes. Defaults to the number of CPUs
+        minus one. With 1 worker, the frames are rendered in this process.
+    :param progress_func: called with the number of finished frames. It may raise
+        an exception to cancel the export.
+    :return: the paths of the written frames, in the order of ``frames``
+    """
+    if workers is None:
+        workers = default_workers()
+    initargs = (labels, class_bounds, table, geotransform)
+
+    if workers == 1:
+        _init_worker(*initargs)
+        paths = []
+        for path, values in frames:
+            paths.append(str(_render_and_write(path, values)))
+            if progress_func:
+                progress_func(len(paths))
+        return paths
+
+    paths = []
+    calls = ((_render_and_write, str(path), values) for path, values in frames)
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=spawn_context(), initializer=_init_worker, initargs=initargs
+    ) as executor, closing(bounded_map(executor, calls, max_pending=2 * workers)) as results:
+        for path in results:
+            paths.append(path)
+            if progress_func:
+                progress_func(len(paths))
+    return paths
+
+
+def frames_to_video(
+    frame_pattern: Union[str, Path], output_path: Union[str, Path], frame_rate: int = 10
+) -> None:
+    """Encode a numbered PNG frame sequence (e.g. ``frame_%04d.png``) to a video with ffmpeg
+
+    Raises a FileNotFoundError if ffmpeg is not available.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise FileNotFoundError("ffmpeg not found, unable to create a video from the frames")
+    subprocess.run(
+        [
+            ffmpeg,
+            "-y",
+            "-framerate",
+            str(frame_rate),
+            "-i",
+            str(frame_pattern),
+            # h264 requires even dimensions and a pixel format that players support
+            "-vf",
+            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-pix_fmt",
+            "yuv420p",
+            str(output_path),
+        ],
+        check=True,
+        capture_output=True,
+    )
@@ -0,0 +1,53 @@
+from osgeo import gdal
+from threedi_results_analysis.tool_animation.frame_export import color_table
+from threedi_results_analysis.tool_animation.frame_export import export_frames
+from threedi_results_analysis.tool_animation.frame_export import render_frame
+from threedi_results_analysis.utils.cell_raster import cell_label_image
+
+import numpy as np
+
+
+# xmin, ymin, xmax, ymax of a 20x10 cell, a 10x10 cell and two 10x20 cells
+CELL_COORDS = np.array(
+    [
+        [0, 20, 0, 20],
+        [0, 0, 10, 10],
+        [20, 30, 10, 30],
+        [10, 10, 30, 30],
+    ],
+    dtype=float,
+)
+
+
+def test_color_table():
+    table = color_table(["#000000", "#ffffff"], 3)
+    assert table.tolist() == [[0, 0, 0, 255], [128, 128, 128, 255], [255, 255, 255, 255]]
+
+
+def test_render_frame():
+    labels, _ = cell_label_image(CELL_COORDS, pixel_size=5)
+    table = color_table(["#000000", "#ffffff"], 3)
+    values = np.array([-1.0, 1.0, np.nan, 20.0])
+    image = render_frame(labels, values, [0, 0.5, 2, 10], table)
+    assert image.shape == (6, 6, 4)
+    assert image[5, 0].tolist() == [0, 0, 0, 255]  # below first class bound
+    assert image[5, 5].tolist() == [128, 128, 128, 255]
+    assert image[0, 0].tolist() == [0, 0, 0, 0]  # nan
+    assert image[0, 2].tolist() == [0, 0, 0, 0]  # no cell
+    assert image[0, 5].tolist() == [255, 255, 255, 255]  # above last class bound
+
+
+def test_export_frames(tmp_path):
+    labels, geotransform = cell_label_image(CELL_COORDS, pixel_size=5)
+    table = color_table(["#000000", "#ffffff"], 3)
+    frames = [(tmp_path / f"frame_{i}.png", np.full(4, float(i))) for i in range(3)]
+    progress = []
+    paths = export_frames(
+        frames, labels, [0, 0.5, 2, 10], table, geotransform, workers=1, progress_func=progress.append
+    )
+    assert paths == [str(path) for path, _ in frames]
+    assert progress == [1, 2, 3]
+    dataset = gdal.Open(paths[1])
+    assert dataset.RasterCount == 4
+    assert dataset.GetRasterBand(1).ReadAsArray()[5, 5] == 128
+    assert (tmp_path / "frame_2.wld").exists()
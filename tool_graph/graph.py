@@ -1,4 +1,5 @@
 from qgis.PyQt.QtCore import Qt
+from threedi_results_analysis.tool_graph.graph_model import plot_cache
 from threedi_results_analysis.tool_graph.graph_view import GraphDockWidget
 from threedi_results_analysis.threedi_plugin_model import ThreeDiResultItem, ThreeDiGridItem
 from threedi_results_analysis.threedi_plugin_tool import ThreeDiPluginTool
@@ -27,6 +28,7 @@ class ThreeDiGraph(ThreeDiPluginTool):
         """
         for widget in self.dock_widgets:
             widget.close()  # TODO: delete as well?
+        plot_cache.clear()
 
     def on_close_child_widget(self, widget_nr):
         """Cleanup necessary items here when plugin dockwidget is closed"""
@@ -61,6 +63,8 @@ class ThreeDiGraph(ThreeDiPluginTool):
         self.action_icon.setEnabled(self.model.number_of_results() > 0)
         for dock_widget in self.dock_widgets:
             dock_widget.result_removed(result_item)
+        # the plots of this result are no longer shown in any of the graphs
+        plot_cache.invalidate(result_item.id)
 
     @pyqtSlot(ThreeDiResultItem)
     def result_changed(self, result_item: ThreeDiResultItem):
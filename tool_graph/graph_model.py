@@ -1,3 +1,4 @@
+from collections import defaultdict
 from collections import OrderedDict
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtGui import QColor
@@ -8,6 +9,7 @@ from threedi_results_analysis.models.base_fields import CheckboxField
 from threedi_results_analysis.models.base_fields import ValueField
 from threedi_results_analysis.utils.color import COLOR_LIST
 
+import itertools
 import logging
 import numpy as np
 import pyqtgraph as pg
@@ -17,6 +19,102 @@ logger = logging.getLogger(__name__)
 
 EMPTY_TIMESERIES = np.array([], dtype=float)
 
+# Upper bound of the data in the plot cache, in bytes
+DEFAULT_PLOT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class PlotCache(object):
+    """
+    Least recently used cache of plots, bounded by the size of their data.
+
+    Plots that are currently shown in a graph are never evicted, as the graph
+    widgets remove them again by looking them up in this cache. Neither is the
+    plot that is put, as it is about to be shown.
+
+    Keys are tuples that start with the id of the result the plot belongs to,
+    so that all plots of a result can be invalidated when it is removed.
+    """
+
+    def __init__(self, max_size=DEFAULT_PLOT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._plots = OrderedDict()
+        self._sizes = {}
+
+    def __contains__(self, key):
+        return key in self._plots
+
+    def __len__(self):
+        return len(self._plots)
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that were served from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key):
+        """Return the cached plot or None, a miss is counted when the plot is put"""
+        plot = self._plots.get(key)
+        if plot is not None:
+            self.hits += 1
+            self._plots.move_to_end(key)
+        return plot
+
+    def put(self, key, plot):
+        self.misses += 1
+        self._remove(key)
+        self._plots[key] = plot
+        self._sizes[key] = self._plot_size(plot)
+        self.size += self._sizes[key]
+        self._evict(keep=key)
+
+    def invalidate(self, result_id):
+        """Remove all plots of a result"""
+        for key in [key for key in self._plots if key[0] == result_id]:
+            self._remove(key)
+        logger.debug(
+            f"Plot cache: {len(self)} plots, {self.size / 1e6:.1f} MB, hit rate {self.hit_rate:.2f}"
+        )
+
+    def clear(self):
+        self._plots.clear()
+        self._sizes.clear()
+        self.size = 0
+
+    def _remove(self, key):
+        if key in self._plots:
+            del self._plots[key]
+            self.size -= self._sizes.pop(key)
+
+    def _evict(self, keep):
+        if self.size <= self.max_size:
+            return
+        for key in list(self._plots):
+            if key == keep or self._in_use(self._plots[key]):
+                continue
+            self._remove(key)
+            self.evictions += 1
+            if self.size <= self.max_size:
+                break
+
+    @staticmethod
+    def _in_use(plot):
+        return plot.scene() is not None
+
+    @staticmethod
+    def _plot_size(plot):
+        return sum(data.nbytes for data in plot.getOriginalDataset() if data is not None)
+
+
+plot_cache = PlotCache()
+
+# Used to distinguish the plots of rows that show the same object
+_row_plot_ids = itertools.count()
+
 
 def select_default_color(item_field):
     """
@@ -39,6 +137,68 @@ def select_default_color(item_field):
     return (randint(0, 256), randint(0, 256), randint(0, 256))
 
 
+def timeseries_available(threedi_result, parameters, object_type):
+    """
+    return whether the result has timeseries of the parameter for this object type
+    :param threedi_result: ThreediResult
+    :param object_type: e.g. flowline, pump_linestring
+    """
+    if (parameters not in threedi_result.available_subgrid_map_vars and
+            parameters not in threedi_result.available_aggregation_vars and
+            parameters not in [v["parameters"] for v in threedi_result.available_water_quality_vars]):
+        return False
+
+    ga = threedi_result.get_gridadmin(parameters)
+    if ga.has_pumpstations:
+        # In some gridadmin types pumps do not have a Meta attribute... In
+        # such cases (e.g. water quality) the attribute does not have a meaning and
+        # the timeserie should be empty.
+        try:
+            pump_fields = set(list(ga.pumps.Meta.composite_fields.keys()))
+        except AttributeError:
+            pump_fields = {}
+    else:
+        pump_fields = {}
+    if object_type == "pump_linestring" and parameters not in pump_fields:
+        return False
+    if object_type == "flowline" and parameters in pump_fields:
+        return False
+    return True
+
+
+def timeseries_tables(result, object_type, object_ids, parameters, absolute, time_units):
+    """
+    get the timestamp values of multiple objects of the same type and result
+
+    The values of all objects are read from the result file at once.
+    :param result: ThreeDiResultItem
+    :param object_type: e.g. flowline, pump_linestring
+    :param object_ids: list of object ids
+    :return: list with a numpy array with timestamp, values per object id
+    """
+    threedi_result = result.threedi_result
+
+    if not timeseries_available(threedi_result, parameters, object_type):
+        logger.warning(f"Parameter {parameters} not available in result {result.text()} for {object_type}")
+        return [EMPTY_TIMESERIES] * len(object_ids)
+
+    timeseries = threedi_result.get_timeseries_by_ids(
+        parameters, node_ids=object_ids, fill_value=np.NaN
+    )
+    if absolute:
+        timeseries = np.abs(timeseries)
+    if time_units == "hrs":
+        timeseries[:, 0] /= 3600
+    elif time_units == "mins":
+        timeseries[:, 0] /= 60
+    # split the columns into a (timestamp, value) table per object. Objects that are
+    # not in the result only have NaN values, these get an empty serie
+    return [
+        EMPTY_TIMESERIES if np.isnan(timeseries[:, i]).all() else timeseries[:, [0, i]]
+        for i in range(1, timeseries.shape[1])
+    ]
+
+
 class LocationTimeseriesModel(BaseModel):
     """Model implementation for (selected objects) for display in graph"""
 
@@ -57,6 +217,28 @@ class LocationTimeseriesModel(BaseModel):
 
         return COLOR_LIST[self.feature_color_map[key]]
 
+    def prefetch_plots(self, rows, parameters, absolute, time_units):
+        """
+        Create the plots of the rows that are not cached yet. The timeseries are
+        read per result and object type, instead of per row.
+        """
+        groups = defaultdict(list)
+        for item in rows:
+            if not item.has_plot(parameters, absolute, time_units):
+                groups[(item.result.value.id, item.object_type.value)].append(item)
+
+        for items in groups.values():
+            ts_tables = timeseries_tables(
+                items[0].result.value,
+                items[0].object_type.value,
+                [item.object_id.value for item in items],
+                parameters=parameters,
+                absolute=absolute,
+                time_units=time_units,
+            )
+            for item, ts_table in zip(items, ts_tables):
+                item.create_plot(parameters, absolute, time_units, ts_table)
+
     def flags(self, index):
 
         flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
@@ -105,7 +287,32 @@ class LocationTimeseriesModel(BaseModel):
         object_type = ValueField(show=False)  # e.g. flowline
         hover = ValueField(show=False, default_value=False)
 
-        _plots = {}
+        def _result_key(self, parameters, absolute, time_units):
+            # Key is result uuid, row, feature id, layer name (pump, flowlines), parameters, time-unit, absolute
+            if not hasattr(self, "_plot_id"):
+                self._plot_id = next(_row_plot_ids)
+            return (
+                self.result.value.id,
+                self._plot_id,
+                str(self.object_id.value),
+                self.object_type.value,
+                str(parameters),
+                time_units,
+                absolute,
+            )
+
+        def has_plot(self, parameters, absolute, time_units):
+            return self._result_key(parameters, absolute, time_units) in plot_cache
+
+        def create_plot(self, parameters, absolute, time_units, ts_table):
+            """Create and cache the pyqtgraph plot of an already retrieved timeseries"""
+            result_key = self._result_key(parameters, absolute, time_units)
+            pen = pg.mkPen(color=self.color.value, width=2, style=self.result.value._pattern)
+
+            logger.info(f"Creating plot item for {result_key}")
+            plot = pg.PlotDataItem(ts_table, pen=pen)
+            plot_cache.put(result_key, plot)
+            return plot
 
         def plots(self, parameters, absolute, time_units):
             """
@@ -116,22 +323,14 @@ class LocationTimeseriesModel(BaseModel):
             :param result_ds_nr: nr of result ts_datasources in model
             :return: pyqtgraph PlotDataItem
             """
-            # Key is result uuid, feature id, layer name (pump, flowlines), time-unit, absolute
-            result_key = (self.result.value.id, str(self.object_id.value), self.object_type.value, time_units, absolute)
-            if not str(parameters) in self._plots:
-                self._plots[str(parameters)] = {}
-            if result_key not in self._plots[str(parameters)]:
+            plot = plot_cache.get(self._result_key(parameters, absolute, time_units))
+            if plot is None:
                 ts_table = self.timeseries_table(
                     parameters=parameters, absolute=absolute, time_units=time_units,
                 )
+                plot = self.create_plot(parameters, absolute, time_units, ts_table)
 
-                pen = pg.mkPen(color=self.color.value, width=2, style=self.result.value._pattern)
-
-                logger.info(f"Creating plot item for {result_key}: {parameters}")
-                self._plots[str(parameters)][result_key] = pg.PlotDataItem(ts_table, pen=pen)
-
-            # logger.info(f"Retrieving plot for {result_key}: {parameters}")
-            return self._plots[str(parameters)][result_key]
+            return plot
 
         def timeseries_table(self, parameters, absolute, time_units):
             """
@@ -141,42 +340,11 @@ class LocationTimeseriesModel(BaseModel):
             :param result_ds_nr:
             :return: numpy array with timestamp, values
             """
-            threedi_result = self.result.value.threedi_result
-
-            if (parameters not in threedi_result.available_subgrid_map_vars and
-                    parameters not in threedi_result.available_aggregation_vars and
-                    parameters not in [v["parameters"] for v in threedi_result.available_water_quality_vars]):
-                logger.warning(f"Parameter {parameters} not available in result {self.result.value.text()}")
-                return EMPTY_TIMESERIES
-
-            ga = threedi_result.get_gridadmin(parameters)
-            if ga.has_pumpstations:
-                # In some gridadmin types pumps do not have a Meta attribute... In
-                # such cases (e.g. water quality) the attribute does not have a meaning and
-                # the timeserie should be empty.
-                try:
-                    pump_fields = set(list(ga.pumps.Meta.composite_fields.keys()))
-                except AttributeError:
-                    pump_fields = {}
-            else:
-                pump_fields = {}
-            if self.object_type.value == "pump_linestring" and parameters not in pump_fields:
-                return EMPTY_TIMESERIES
-            if self.object_type.value == "flowline" and parameters in pump_fields:
-                return EMPTY_TIMESERIES
-
-            timeseries = threedi_result.get_timeseries(
-                parameters, node_id=self.object_id.value, fill_value=np.NaN
-            )
-            if timeseries.shape[1] == 1:
-                logger.info("1-element timeserie, plotting empty serie")
-                return EMPTY_TIMESERIES
-            if absolute:
-                timeseries = np.abs(timeseries)
-            if time_units == "hrs":
-                vector = np.array([3600, 1])
-            elif time_units == "mins":
-                vector = np.array([60, 1])
-            else:
-                vector = np.array([1, 1])
-            return timeseries / vector
+            return timeseries_tables(
+                self.result.value,
+                self.object_type.value,
+                [self.object_id.value],
+                parameters=parameters,
+                absolute=absolute,
+                time_units=time_units,
+            )[0]
@@ -14,6 +14,8 @@ from qgis.PyQt.QtCore import QSize
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtWidgets import QCheckBox
 from qgis.PyQt.QtWidgets import QComboBox
+from qgis.PyQt.QtWidgets import QFileDialog
+from qgis.PyQt.QtWidgets import QPushButton
 from qgis.PyQt.QtWidgets import QSplitter
 from qgis.PyQt.QtWidgets import QDockWidget
 from qgis.PyQt.QtWidgets import QHBoxLayout
@@ -31,8 +33,13 @@ from qgis.PyQt.QtWidgets import QWidget
 from qgis.PyQt.QtWidgets import QColorDialog
 from qgis.PyQt.QtGui import QColor
 from threedi_results_analysis.tool_graph.graph_model import LocationTimeseriesModel
+from threedi_results_analysis.tool_graph.graph_model import timeseries_available
+from threedi_results_analysis.tool_graph.timeseries_export import export_timeseries_csv
+from threedi_results_analysis.tool_graph.timeseries_export import export_timeseries_netcdf
+from threedi_results_analysis.tool_graph.timeseries_export import TimeseriesSelection
 from threedi_results_analysis.utils.user_messages import messagebar_message
 from threedi_results_analysis.utils.user_messages import statusbar_message
+from threedi_results_analysis.utils.user_messages import StatusProgressBar
 from threedi_results_analysis.utils.utils import generate_parameter_config
 from threedi_results_analysis.utils.widgets import PenStyleWidget
 from threedi_results_analysis.utils.constants import TOOLBOX_MESSAGE_TITLE
@@ -95,6 +102,12 @@ class GraphPlot(pg.PlotWidget):
         self.setLabel("bottom", "Time", self.current_time_units)
         # Auto SI prefix scaling doesn't work properly with m3, m2 etc.
         self.getAxis("left").enableAutoSIPrefix(False)
+        # Only draw the samples within the visible time range, reduced to a min/max
+        # pair per pixel column. Both are recomputed when panning and zooming, so that
+        # long timeseries keep their shape and drawing cost is bounded by the width.
+        # Note that the plot item applies these to every plot that is added to it.
+        self.getPlotItem().setDownsampling(auto=True, mode="peak")
+        self.getPlotItem().setClipToView(True)
 
     def on_close(self):
         """
@@ -128,6 +141,12 @@ class GraphPlot(pg.PlotWidget):
 
     def set_absolute(self, absolute: bool):
         # Remove and re-add to set correct absoluteness
+        self.location_model.prefetch_plots(
+            [item for item in self.location_model.rows if item.active.value],
+            self.current_parameter["parameters"],
+            time_units=self.current_time_units,
+            absolute=absolute,
+        )
         for item in self.location_model.rows:
             self.removeItem(
                 item.plots(self.current_parameter["parameters"], time_units=self.current_time_units, absolute=self.absolute)
@@ -148,6 +167,12 @@ class GraphPlot(pg.PlotWidget):
         :param start: first row nr
         :param end: last row nr
         """
+        self.location_model.prefetch_plots(
+            self.location_model.rows[start:end + 1],
+            self.current_parameter["parameters"],
+            absolute=self.absolute,
+            time_units=self.current_time_units,
+        )
         for i in range(start, end + 1):
             item = self.location_model.rows[i]
             self.addItem(
@@ -235,6 +260,12 @@ class GraphPlot(pg.PlotWidget):
         self.current_parameter = parameter
         self.current_time_units = time_units
 
+        self.location_model.prefetch_plots(
+            [item for item in self.location_model.rows if item.active.value],
+            self.current_parameter["parameters"],
+            absolute=self.absolute,
+            time_units=self.current_time_units,
+        )
         for item in self.location_model.rows:
             if not item.active.value:
                 continue
@@ -410,6 +441,7 @@ class GraphWidget(QWidget):
         self.parameter_combo_box.currentIndexChanged.connect(self.parameter_change)
         self.ts_units_combo_box.currentIndexChanged.connect(self.time_units_change)
         self.showFullLegendCheckbox.stateChanged.connect(self._updateHiddenColumns)
+        self.exportButton.clicked.connect(self.export_timeseries)
         self.location_timeseries_table.deleteRequested.connect(self._removeRows)
 
         # init parameter selection
@@ -480,12 +512,75 @@ class GraphWidget(QWidget):
 
         self.parameter_combo_box.setCurrentIndex(active_idx)
 
+    def timeseries_selections(self) -> List[TimeseriesSelection]:
+        """
+        Group the objects in the table per result and variable, for all variables
+        that can be selected in the parameter combobox.
+        """
+        rows_per_result = {}
+        for item in self.location_model.rows:
+            result = item.result.value
+            rows_per_result.setdefault(result.id, (result, []))[1].append(item)
+
+        selections = []
+        for result, items in rows_per_result.values():
+            for parameter in self.parameters.values():
+                variable = parameter["parameters"]
+                object_types = set()
+                object_ids = set()
+                for item in items:
+                    if timeseries_available(result.threedi_result, variable, item.object_type.value):
+                        object_types.add(item.object_type.value)
+                        object_ids.add(item.object_id.value)
+                if object_ids:
+                    selections.append(
+                        TimeseriesSelection(
+                            name=result.text(),
+                            threedi_result=result.threedi_result,
+                            variable=variable,
+                            object_type=", ".join(sorted(object_types)),
+                            object_ids=sorted(object_ids),
+                            result_id=result.id,
+                        )
+                    )
+        return selections
+
+    def export_timeseries(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export time series", "", "CSV (*.csv);;NetCDF (*.nc)"
+        )
+        if not path:
+            return
+
+        selections = self.timeseries_selections()
+        if not selections:
+            messagebar_message(TOOLBOX_MESSAGE_TITLE, "No time series to export", Qgis.Warning, 5)
+            return
+
+        progress_bar = StatusProgressBar(
+            sum(len(selection.object_ids) for selection in selections), "Exporting time series"
+        )
+        try:
+            if path.lower().endswith(".nc"):
+                export_timeseries_netcdf(path, selections, progress_func=progress_bar.set_value)
+            else:
+                export_timeseries_csv(path, selections, progress_func=progress_bar.set_value)
+        except (OSError, ValueError) as e:
+            logger.exception(e)
+            messagebar_message(TOOLBOX_MESSAGE_TITLE, f"Unable to export time series: {e}", Qgis.Critical, 5)
+            return
+        finally:
+            del progress_bar
+
+        messagebar_message(TOOLBOX_MESSAGE_TITLE, f"Exported time series to {path}", Qgis.Success, 5)
+
     def on_close(self):
         """
         unloading widget and remove all required stuff
         :return:
         """
         self.parameter_combo_box.currentIndexChanged.disconnect(self.parameter_change)
+        self.exportButton.clicked.disconnect(self.export_timeseries)
 
     def closeEvent(self, event):
         """
@@ -561,6 +656,10 @@ class GraphWidget(QWidget):
         self.showFullLegendCheckbox.setCheckState(Qt.Unchecked)
         hLayoutButtons.addWidget(self.showFullLegendCheckbox)
 
+        self.exportButton = QPushButton("Export...", self)
+        self.exportButton.setToolTip("Export the time series of all variables of the objects in the table")
+        hLayoutButtons.addWidget(self.exportButton)
+
         vLayoutTable.addLayout(hLayoutButtons)
 
         splitterWidget.addWidget(legendWidget)
@@ -1,6 +1,10 @@
 from PyQt5.QtCore import Qt
 from threedi_results_analysis.tool_graph.graph_model import LocationTimeseriesModel
+from threedi_results_analysis.tool_graph.graph_model import PlotCache
+from threedi_results_analysis.tool_graph.graph_model import timeseries_tables
 
+import mock
+import numpy as np
 import unittest
 
 
@@ -203,3 +207,67 @@ class TestLocationTimeseriesModel(unittest.TestCase):
     def tearDown(self):
         """Runs after each test."""
         pass
+
+
+def _mock_plot(nr_values, in_use=False):
+    plot = mock.Mock()
+    plot.getOriginalDataset.return_value = (np.zeros(nr_values), np.zeros(nr_values))
+    plot.scene.return_value = mock.Mock() if in_use else None
+    return plot
+
+
+def test_plot_cache_evicts_least_recently_used():
+    cache = PlotCache(max_size=3 * 160)  # 3 plots of 10 x and 10 y values
+    for i in range(3):
+        cache.put(("result", i), _mock_plot(10))
+    cache.get(("result", 0))
+    cache.put(("result", 3), _mock_plot(10))
+
+    assert ("result", 0) in cache
+    assert ("result", 1) not in cache
+    assert len(cache) == 3
+    assert cache.size == 3 * 160
+    assert cache.evictions == 1
+
+
+def test_plot_cache_keeps_plots_in_use():
+    cache = PlotCache(max_size=160)
+    cache.put(("result", 0), _mock_plot(10, in_use=True))
+    cache.put(("result", 1), _mock_plot(10))
+
+    # the cache may exceed its bound rather than evict the plot that is about to be shown
+    assert ("result", 0) in cache
+    assert ("result", 1) in cache
+
+    cache.put(("result", 2), _mock_plot(10))
+    assert ("result", 1) not in cache
+    assert ("result", 2) in cache
+
+
+def test_plot_cache_invalidate_and_hit_rate():
+    cache = PlotCache()
+    cache.put(("a", 0), _mock_plot(10))
+    cache.put(("b", 0), _mock_plot(10))
+    assert cache.get(("a", 0)) is not None
+    assert cache.get(("b", 0)) is not None
+    assert cache.hit_rate == 0.5
+
+    cache.invalidate("a")
+    assert ("a", 0) not in cache
+    assert ("b", 0) in cache
+    assert cache.size == 160
+
+
+@mock.patch("threedi_results_analysis.tool_graph.graph_model.timeseries_available", return_value=True)
+def test_timeseries_tables(timeseries_available):
+    result = mock.Mock()
+    # object 2 is not in the result
+    result.threedi_result.get_timeseries_by_ids.return_value = np.array(
+        [[0.0, 1.0, np.nan, -3.0], [120.0, 4.0, np.nan, np.nan]]
+    )
+    tables = timeseries_tables(result, "flowline", [1, 2, 3], "q", absolute=True, time_units="mins")
+
+    assert len(tables) == 3
+    np.testing.assert_equal(tables[0], [[0.0, 1.0], [2.0, 4.0]])
+    assert tables[1].size == 0
+    np.testing.assert_equal(tables[2], [[0.0, 3.0], [2.0, np.nan]])
@@ -0,0 +1,88 @@
+from threedi_results_analysis.tool_graph.timeseries_export import export_timeseries_csv
+from threedi_results_analysis.tool_graph.timeseries_export import export_timeseries_netcdf
+from threedi_results_analysis.tool_graph.timeseries_export import TimeseriesSelection
+
+import h5netcdf
+import numpy as np
+import pytest
+
+
+TIMESTAMPS = np.array([0.0, 30.0, 60.0])
+
+
+class FakeThreediResult:
+    """Returns value id + timestamp / 100 for every id"""
+
+    def __init__(self):
+        self.requested_ids = []
+
+    def get_timeseries_by_ids(self, nc_variable, node_ids, fill_value=None):
+        self.requested_ids.append(list(node_ids))
+        values = np.asarray(node_ids, dtype=float)[np.newaxis, :] + TIMESTAMPS[:, np.newaxis] / 100
+        return np.hstack([TIMESTAMPS.reshape(-1, 1), values])
+
+
+def test_export_timeseries_csv(tmp_path):
+    threedi_result = FakeThreediResult()
+    selections = [
+        TimeseriesSelection("result, 1", threedi_result, "s1", "node", [3, 1, 2]),
+        TimeseriesSelection("result 2", threedi_result, "q", "flowline", [5]),
+    ]
+    progress = []
+    path = tmp_path / "timeseries.csv"
+    export_timeseries_csv(path, selections, chunk_size=2, progress_func=progress.append)
+
+    assert threedi_result.requested_ids == [[3, 1], [2], [5]]
+    assert progress == [2, 3, 4]
+    lines = path.read_text().splitlines()
+    assert lines[0] == "result,variable,object_type,id,time,value"
+    assert len(lines) == 1 + 4 * len(TIMESTAMPS)
+    assert lines[1] == '"result, 1",s1,node,3,0,3'
+    assert lines[2] == '"result, 1",s1,node,3,30,3.3'
+    assert lines[-1] == "result 2,q,flowline,5,60,5.6"
+
+
+def test_export_timeseries_netcdf(tmp_path):
+    threedi_result = FakeThreediResult()
+    selections = [
+        TimeseriesSelection("result", threedi_result, "s1", "node", [3, 1, 2]),
+        TimeseriesSelection("result", threedi_result, "q", "flowline", [5]),
+    ]
+    path = tmp_path / "timeseries.nc"
+    export_timeseries_netcdf(path, selections, chunk_size=2)
+
+    with h5netcdf.File(path, "r") as dataset:
+        group = dataset["result"]["s1"]
+        assert group.attrs["object_type"] == "node"
+        np.testing.assert_equal(group["id"][:], [3, 1, 2])
+        np.testing.assert_equal(group["time"][:], TIMESTAMPS)
+        np.testing.assert_almost_equal(group["values"][:, 2], [2.0, 2.3, 2.6])
+        assert dataset["result"]["q"]["values"].shape == (3, 1)
+
+
+def test_export_timeseries_netcdf_same_result_names(tmp_path):
+    selections = [
+        TimeseriesSelection("result", FakeThreediResult(), "s1", "node", [3], result_id="a"),
+        TimeseriesSelection("result", FakeThreediResult(), "s1", "node", [4], result_id="b"),
+    ]
+    path = tmp_path / "timeseries.nc"
+    export_timeseries_netcdf(path, selections)
+
+    with h5netcdf.File(path, "r") as dataset:
+        assert set(dataset.groups) == {"result (a)", "result (b)"}
+        np.testing.assert_equal(dataset["result (b)"]["s1"]["id"][:], [4])
+
+
+class MissingIdThreediResult(FakeThreediResult):
+    """Returns no timeseries for the last id"""
+
+    def get_timeseries_by_ids(self, nc_variable, node_ids, fill_value=None):
+        return super().get_timeseries_by_ids(nc_variable, node_ids, fill_value)[:, :-1]
+
+
+def test_export_timeseries_missing_values(tmp_path):
+    selections = [TimeseriesSelection("result", MissingIdThreediResult(), "s1", "node", [3, 1])]
+    with pytest.raises(ValueError):
+        export_timeseries_csv(tmp_path / "timeseries.csv", selections)
+    with pytest.raises(ValueError):
+        export_timeseries_netcdf(tmp_path / "timeseries.nc", selections)
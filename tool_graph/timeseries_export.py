@@ -0,0 +1,160 @@
+"""Bulk export of the timeseries of many objects
+
+The values are read in chunks of objects with ThreediResult.get_timeseries_by_ids()
+and each chunk is written before the next one is read, so that the memory use does
+not depend on the number of exported objects.
+"""
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import h5netcdf.legacyapi as netCDF4
+import numpy as np
+
+
+# Number of objects that are read from the result file at once
+EXPORT_CHUNK_SIZE = 500
+
+CSV_HEADER = "result,variable,object_type,id,time,value"
+CSV_VALUE_FORMAT = "%.8g"
+
+
+class TimeseriesSelection(NamedTuple):
+    """Objects of which the timeseries of a single variable are exported"""
+    name: str  # e.g. the name of the result
+    threedi_result: object  # ThreediResult
+    variable: str
+    object_type: str  # e.g. node, flowline, pump_linestring
+    object_ids: Sequence[int]
+    result_id: str = ""  # distinguishes results with the same name
+
+
+def _result_names(selections: List[TimeseriesSelection]) -> Dict[Tuple[str, str], str]:
+    """Return a unique name per (name, result id) of the selections
+
+    The result id is appended to names that are used by more than one result.
+    """
+    result_ids = {}
+    for selection in selections:
+        result_ids.setdefault(selection.name, set()).add(selection.result_id)
+    return {
+        (name, result_id): f"{name} ({result_id})" if len(ids) > 1 else name
+        for name, ids in result_ids.items()
+        for result_id in ids
+    }
+
+
+def _read_chunks(
+    selection: TimeseriesSelection, chunk_size: int
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (start index, ids, timestamps, values (time x id)) per chunk of objects"""
+    object_ids = np.asarray(selection.object_ids, dtype=int)
+    for start in range(0, len(object_ids), chunk_size):
+        chunk_ids = object_ids[start:start + chunk_size]
+        timeseries = selection.threedi_result.get_timeseries_by_ids(
+            selection.variable, chunk_ids, fill_value=np.nan
+        )
+        if timeseries.shape[1] != len(chunk_ids) + 1:
+            raise ValueError(
+                f"Got {timeseries.shape[1] - 1} {selection.variable} timeseries of {selection.name} "
+                f"for {len(chunk_ids)} objects"
+            )
+        yield start, chunk_ids, timeseries[:, 0], timeseries[:, 1:]
+
+
+def _csv_field(value: str) -> str:
+    value = str(value)
+    if any(c in value for c in ',"\n'):
+        value = '"' + value.replace('"', '""') + '"'
+    # the field ends up in a numpy format string
+    return value.replace("%", "%%")
+
+
+def export_timeseries_csv(
+    path,
+    selections: List[TimeseriesSelection],
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    progress_func: Optional[Callable[[int], None]] = None,
+) -> None:
+    """Write the timeseries of the selections to a CSV file, one row per object and timestamp
+
+    The CSV has the columns result, variable, object_type, id, time and value. This
+    "long" layout allows streaming the objects in chunks and mixing variables with
+    different timestamps (e.g. aggregation variables) in one file.
+
+    :param progress_func: called with the number of exported objects after each chunk
+    """
+    result_names = _result_names(selections)
+    nr_done = 0
+    with open(path, "w", newline="") as csv_file:
+        csv_file.write(CSV_HEADER + "\n")
+        for selection in selections:
+            result_name = result_names[selection.name, selection.result_id]
+            prefix = ",".join(
+                _csv_field(v) for v in (result_name, selection.variable, selection.object_type)
+            )
+            fmt = f"{prefix},%d,{CSV_VALUE_FORMAT},{CSV_VALUE_FORMAT}"
+            for _, chunk_ids, timestamps, values in _read_chunks(selection, chunk_size):
+                rows = np.empty((values.size, 3), dtype=float)
+                rows[:, 0] = np.repeat(chunk_ids, len(timestamps))
+                rows[:, 1] = np.tile(timestamps, len(chunk_ids))
+                rows[:, 2] = values.T.ravel()
+                np.savetxt(csv_file, rows, fmt=fmt)
+                nr_done += len(chunk_ids)
+                if progress_func:
+                    progress_func(nr_done)
+
+
+def export_timeseries_netcdf(
+    path,
+    selections: List[TimeseriesSelection],
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    progress_func: Optional[Callable[[int], None]] = None,
+) -> None:
+    """Write the timeseries of the selections to a NetCDF file
+
+    Every selection is written to a group "<name>/<variable>", with the dimensions
+    time and id and a (time, id) variable "values". If several results have the same
+    name, their result id is appended to it. The values are written in chunks
+    of objects, which also is the chunk layout of that variable in the file.
+
+    :param progress_func: called with the number of exported objects after each chunk
+    """
+    result_names = _result_names(selections)
+    nr_done = 0
+    with netCDF4.Dataset(str(path), mode="w") as dataset:
+        for selection in selections:
+            name = result_names[selection.name, selection.result_id].replace("/", "_")
+            if name in dataset.groups:
+                result_group = dataset.groups[name]
+            else:
+                result_group = dataset.createGroup(name)
+            if selection.variable in result_group.groups:
+                raise ValueError(f"Variable {selection.variable} of {selection.name} is selected twice")
+            group = result_group.createGroup(selection.variable)
+            group.setncattr("object_type", selection.object_type)
+
+            nr_objects = len(selection.object_ids)
+            group.createDimension("id", size=nr_objects)
+            id_var = group.createVariable(varname="id", datatype="int32", dimensions=("id",))
+            id_var[:] = np.asarray(selection.object_ids, dtype=np.int32)
+
+            values_var = None
+            for start, chunk_ids, timestamps, values in _read_chunks(selection, chunk_size):
+                if values_var is None:
+                    group.createDimension("time", size=len(timestamps))
+                    time_var = group.createVariable(varname="time", datatype="float64", dimensions=("time",))
+                    time_var[:] = timestamps
+                    time_var.setncattr("units", "s")
+                    time_var.setncattr("long_name", "Time since start of simulation")
+                    values_var = group.createVariable(
+                        varname="values",
+                        datatype="float64",
+                        dimensions=("time", "id"),
+                        zlib=True,
+                        chunksizes=(max(len(timestamps), 1), min(chunk_size, nr_objects)),
+                        fill_value=np.nan,
+                    )
+                    values_var.setncattr("long_name", selection.variable)
+                values_var[:, start:start + len(chunk_ids)] = values
+                nr_done += len(chunk_ids)
+                if progress_func:
+                    progress_func(nr_done)
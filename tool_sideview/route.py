@@ -1,41 +1,61 @@
-from qgis.analysis import QgsGraphAnalyzer
-from qgis.analysis import QgsGraphBuilder
-from qgis.analysis import QgsNetworkDistanceStrategy
-from qgis.analysis import QgsNetworkStrategy
-from qgis.analysis import QgsVectorLayerDirector
 from qgis.core import QgsFeature
 from qgis.core import QgsFeatureRequest
 from qgis.core import QgsField
 from qgis.core import QgsMapLayer
 from qgis.core import QgsGeometry
 from qgis.core import QgsCoordinateTransform
+from qgis.core import QgsPointXY
 from qgis.gui import QgsMapTool
-from qgis.core import QgsPoint
 from qgis.PyQt.QtCore import Qt
 from qgis.core import QgsVectorLayer
 from qgis.PyQt.QtGui import QCursor
 from qgis.PyQt.QtCore import QVariant
 from qgis.core import QgsProject
 from qgis.core import QgsRectangle
+from scipy.sparse import coo_matrix
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from typing import Dict, Tuple
 
 import logging
+import numpy as np
 logger = logging.getLogger(__name__)
 
+# scipy's csgraph does not distinguish between a zero-weight edge and no edge
+MIN_EDGE_WEIGHT = 1e-9
 
-class AttributeStrategy(QgsNetworkStrategy):
-    """Strategy that allows setting a specific attribute for cost"""
 
-    def __init__(self, attribute, attribute_index):
-        QgsNetworkStrategy.__init__(self)
-        self.attribute = attribute
-        self.attribute_index = attribute_index
+def build_sparse_graph(
+    start_vertices: np.ndarray, end_vertices: np.ndarray, weights: np.ndarray, nr_vertices: int
+) -> Tuple[csr_matrix, Dict[Tuple[int, int], int]]:
+    """Build an undirected graph from the edges between start_vertices and end_vertices
 
-    def cost(self, distance, feature):
-        return feature[self.attribute]
+    Of parallel edges, only the one with the lowest weight is kept. Loops are dropped.
 
-    def requiredAttributes(self):
-        # Must be a list of the attribute indexes (int), not strings:
-        return [self.attribute_index]
+    :return: tuple of the (upper triangular) sparse adjacency matrix, to be used with
+        directed=False, and a dict that maps (vertex, vertex) pairs in both directions
+        to the index of the edge that connects them
+    """
+    start_vertices = np.asarray(start_vertices, dtype=int)
+    end_vertices = np.asarray(end_vertices, dtype=int)
+    weights = np.maximum(np.asarray(weights, dtype=float), MIN_EDGE_WEIGHT)
+
+    low = np.minimum(start_vertices, end_vertices)
+    high = np.maximum(start_vertices, end_vertices)
+    order = np.argsort(weights, kind="stable")
+    order = order[low[order] != high[order]]
+    # np.unique returns the first occurrence, which is the lowest weight edge
+    _, first = np.unique(low[order] * nr_vertices + high[order], return_index=True)
+    edges = order[first]
+
+    graph = coo_matrix(
+        (weights[edges], (low[edges], high[edges])), shape=(nr_vertices, nr_vertices)
+    ).tocsr()
+    edge_index = {}
+    for edge, a, b in zip(edges.tolist(), low[edges].tolist(), high[edges].tolist()):
+        edge_index[(a, b)] = edge
+        edge_index[(b, a)] = edge
+    return graph, edge_index
 
 
 class Route(object):
@@ -43,35 +63,51 @@ class Route(object):
         self,
         line_layer,
     ):
-
-        # Make a copy of the line layer containing only 1D lines, and use that to create the graph
-        features_1d = [f for f in line_layer.getFeatures() if f["line_type"] in (0, 1, 2, 3, 4, 5)]
-        self.graph_layer = QgsVectorLayer(f"linestring?crs={line_layer.crs().authid()}", "graph_lines", "memory")
-        self.graph_layer.startEditing()
-        self.graph_layer.dataProvider().addAttributes(line_layer.dataProvider().fields().toList())
-        self.graph_layer.updateFields()
-        self.graph_layer.dataProvider().addFeatures(features_1d)
-        self.graph_layer.commitChanges()
-
-        # A search graph is constructed using a so-called Director.
-        # Don't use information about road direction from attributes, all edges are treated as two-ways
-        self.director = QgsVectorLayerDirector(self.graph_layer, -1, "", "", "", QgsVectorLayerDirector.DirectionBoth)
+        # Index the 1D lines by id and collect the graph edges (node id to node id) from their attributes
+        self.graph_layer = line_layer
         self.id_field = "id"
-        self.id_field_index = self.graph_layer.fields().lookupField(self.id_field)
+        self.features = {}
+        self.polylines = {}
+        line_ids = []
+        start_node_ids = []
+        end_node_ids = []
+        lengths = []
+        node_points = {}
+        for feature in line_layer.getFeatures():
+            if feature["line_type"] not in (0, 1, 2, 3, 4, 5):
+                continue
+            line_id = feature[self.id_field]
+            polyline = feature.geometry().asPolyline()
+            self.features[line_id] = feature
+            self.polylines[line_id] = polyline
+            line_ids.append(line_id)
+            start_node_ids.append(feature["calculation_node_id_start"])
+            end_node_ids.append(feature["calculation_node_id_end"])
+            lengths.append(feature.geometry().length())
+            node_points.setdefault(start_node_ids[-1], QgsPointXY(polyline[0]))
+            node_points.setdefault(end_node_ids[-1], QgsPointXY(polyline[-1]))
+
+        # Graph vertices are the indices into the sorted node ids
+        nr_lines = len(line_ids)
+        self.node_ids, vertices = np.unique(np.array(start_node_ids + end_node_ids, dtype=int), return_inverse=True)
+        self.edge_line_ids = np.array(line_ids, dtype=int)
+        self.edge_start_vertices = vertices[:nr_lines]
+        self.edge_end_vertices = vertices[nr_lines:]
+        self.edge_lengths = np.array(lengths, dtype=float)
+        self.graph, self.edge_index = build_sparse_graph(
+            self.edge_start_vertices, self.edge_end_vertices, self.edge_lengths, len(self.node_ids)
+        )
 
-        # It is necessary to create a strategy for calculating edge properties.
-        self.director.addStrategy(QgsNetworkDistanceStrategy())
-        # This second strategy is used to quickly retrieve the id
-        self.director.addStrategy(AttributeStrategy(self.id_field, self.id_field_index))
-        self.builder = QgsGraphBuilder(line_layer.crs())
-        self.director.makeGraph(self.builder, [])
-        self.graph = self.builder.graph()
+        self.vertex_points = [node_points[node_id] for node_id in self.node_ids.tolist()]
+        self.point_index = {}
+        for vertex, point in enumerate(self.vertex_points):
+            self.point_index.setdefault((point.x(), point.y()), vertex)
 
         # init class attributes
         self.start_point_tree = None
         self.id_start_tree = None
         self.has_path = False
-        self.tree = []  # Result from Dijkstra
+        self.tree = np.empty(0, dtype=int)  # Predecessors from Dijkstra
         self.path = []
         self.path_vertexes = []
         self.point_path = []
@@ -90,7 +126,7 @@ class Route(object):
                         string: message)
         """
         # retrieve vertex index from qgs point
-        id_point = self.graph.findVertex(qgs_point)
+        id_point = self.get_id_of_point(qgs_point)
         if id_point == -1:
             return False, "Please click on a 1D node"
         else:
@@ -121,7 +157,7 @@ class Route(object):
 
     def get_id_of_point(self, qgs_point):
 
-        return self.graph.findVertex(qgs_point)
+        return self.point_index.get((qgs_point.x(), qgs_point.y()), -1)
 
     def set_tree_startpoint(self, id_start_point):
         """
@@ -136,10 +172,10 @@ class Route(object):
 
         # else create tree from this tree startpoint
         self.id_start_tree = id_start_point
-        self.start_point_tree = self.graph.vertex(id_start_point).point()
+        self.start_point_tree = self.vertex_points[id_start_point]
 
-        (self.tree, cost) = QgsGraphAnalyzer.dijkstra(
-            self.graph, self.id_start_tree, 0
+        _, self.tree = dijkstra(
+            self.graph, directed=False, indices=id_start_point, return_predecessors=True
         )
         self.tree_layer_up_to_date = False
         if self._virtual_tree_layer:
@@ -185,52 +221,36 @@ class Route(object):
         """
 
         # check if end_point is connected to start point
-        if self.tree[id_end_point] == -1:
+        if self.tree[id_end_point] < 0:
             logger.error("Path not found")
             return False, "Path not found", None
 
         # else continue finding path
-        p = []
         path_props = []
         cum_dist = begin_distance
         cur_pos = id_end_point
         while cur_pos != id_start_point:
-            point = self.graph.vertex(
-                self.graph.edge(self.tree[cur_pos]).toVertex()
-            ).point()
-            p.append(point)
-
-            dist = self.graph.edge(self.tree[cur_pos]).cost(0)
-            id_line = self.graph.edge(self.tree[cur_pos]).cost(1)
-
-            filt = u'"%s" = %s' % (self.id_field, str(id_line))
-            request = QgsFeatureRequest().setFilterExpression(filt)
-            feature = next(self.graph_layer.getFeatures(request))
-
-            # In order to determine the direction of this segment in the path,
-            # compare the first point on the feature to the first vertex of
-            # the geometry. In case the previous segment belonged to the
-            # same feature, take that direction.
-            if len(path_props) > 0 and path_props[0][4]["id"] == feature["id"]:
-                route_direction_feature = path_props[0][3]
-            else:
-                if QgsPoint(point.x(), point.y()) == feature.geometry().vertexAt(0):
-                    route_direction_feature = -1
-                else:
-                    route_direction_feature = 1
-
-            path_props.insert(0, [None, None, dist, route_direction_feature, feature])
-
-            cur_pos = self.graph.edge(self.tree[cur_pos]).fromVertex()
-
+            previous_pos = self.tree[cur_pos]
+            edge = self.edge_index[(previous_pos, cur_pos)]
+            feature = self.features[self.edge_line_ids[edge]]
+            # The direction of this segment in the path is 1 if the path runs from
+            # the start node to the end node of the feature
+            route_direction_feature = 1 if self.edge_start_vertices[edge] == previous_pos else -1
+            path_props.insert(0, [None, None, self.edge_lengths[edge].item(), route_direction_feature, feature])
+            cur_pos = previous_pos
+
+        p = [self.start_point_tree]
         for path in path_props:
             path[0] = cum_dist
             cum_dist += path[2]
             path[1] = cum_dist
 
-        p.append(self.start_point_tree)
+            polyline = self.polylines[path[4][self.id_field]]
+            if path[3] == -1:
+                polyline = polyline[::-1]
+            p.extend(QgsPointXY(point) for point in polyline[1:])
 
-        return True, path_props, reversed(p)
+        return True, path_props, p
 
     def update_virtual_tree_layer(self):
         """
@@ -249,22 +269,22 @@ class Route(object):
         self._virtual_tree_layer.dataProvider().deleteFeatures(ids)
 
         features = []
-        for branch in self.tree:
-            # make int, compare with long doesn't work (?!)
-            if int(branch) >= 0:
-                # add a feature
-                feat = QgsFeature()
-                a = self.graph.vertex(self.graph.edge(branch).fromVertex()).point()
-                b = self.graph.vertex(self.graph.edge(branch).toVertex()).point()
-                feat.setGeometry(QgsGeometry.fromPolylineXY([a, b]))
-
-                feat.setAttributes(
-                    [
-                        float(self.graph.edge(branch).cost(0)),
-                        int(self.graph.edge(branch).cost(1)),
-                    ]
-                )
-                features.append(feat)
+        for vertex in np.nonzero(self.tree >= 0)[0].tolist():
+            # add a feature
+            predecessor = self.tree[vertex]
+            edge = self.edge_index[(predecessor, vertex)]
+            feat = QgsFeature()
+            a = self.vertex_points[predecessor]
+            b = self.vertex_points[vertex]
+            feat.setGeometry(QgsGeometry.fromPolylineXY([a, b]))
+
+            feat.setAttributes(
+                [
+                    self.edge_lengths[edge].item(),
+                    self.edge_line_ids[edge].item(),
+                ]
+            )
+            features.append(feat)
 
         self._virtual_tree_layer.dataProvider().addFeatures(features)
         self._virtual_tree_layer.commitChanges()
@@ -304,8 +324,7 @@ class Route(object):
 
         self.id_start_tree = None
         self.start_point_tree = None
-        self.cost = []
-        self.tree = []
+        self.tree = np.empty(0, dtype=int)
         self.has_path = False
         self.path_points = []
         self.path = []
@@ -14,98 +14,140 @@ class SideViewGraphGenerator():
         # Preload some big data structs
         self.ga = GridH5Admin(gridadmin_file.with_suffix('.h5'))
         self.lines_1d2d_data = self.ga.lines.subset("1D2D").only("dpumax", "line").data
-        self.lines_1d2d_data = {k: v.tolist() for (k, v) in self.lines_1d2d_data.items()}
+        self.cross_section_tables = None
 
     def retrieve_profile_info_from_flowline(self, flowline_id: int) -> tuple[float, float, float, float, float, int]:
+        return self.retrieve_profile_info_from_flowlines([flowline_id])[flowline_id]
 
-        line = self.ga.lines.filter(id=flowline_id)
-
-        start_level = None
-        end_level = None
-        start_height = None
-        end_height = None
-        crest_level = None
-
-        line_type = SideViewGraphGenerator.content_type_to_line_type(line.content_type[0].decode())
-        node_id_1 = line.line[0][0]
-        node_id_2 = line.line[1][0]
-
-        if line_type == LineType.PIPE or line_type == LineType.CULVERT or line_type == LineType.ORIFICE or line_type == LineType.WEIR:
-            cross1_id = line.cross1[0]
-            cross2_id = line.cross2[0]
-            assert cross1_id == cross2_id  # pipes and culverts have only one cross section definition
-            cross_section = self.ga.cross_sections.filter(id=cross1_id)
-
-            try:
-                height = SideViewGraphGenerator.cross_section_max_height(cross_section, self.ga.cross_sections.tables)
-            except AttributeError:
-                raise AttributeError(f"Unable to derive height of cross section: {cross_section.id[0]} {cross1_id} {cross1_id} with shape {cross_section.shape[0]} for line {flowline_id}")
-
-            if math.isnan(height):  # Not an error, simply not enough information
-                logger.warning(f"Unable to derive cross section height for cross section {cross1_id} with shape {cross_section.shape[0]} for line {flowline_id}, setting height to 0.")
-                height = 0.0
-            start_height = height
-            end_height = height
-
-            if line_type == LineType.PIPE or line_type == LineType.CULVERT:
-                start_level = line.invert_level_start_point[0].item()
-                end_level = line.invert_level_end_point[0].item()
-            elif line_type == LineType.ORIFICE or line_type == LineType.WEIR:
-                # for bottom level, take dmax of adjacent nodes
-                node_1 = self.ga.nodes.filter(id=node_id_1)
-                node_2 = self.ga.nodes.filter(id=node_id_2)
-                start_level = np.min([node_1.dmax[0], node_2.dmax[0]]).item()
-                end_level = start_level
-                # crest_level is input, can be corrected due to incorrect node bottom levels -> use dpumax
-                # crest_level = ga.lines.orifices.filter(id=lines_1d_data["id"][count]).crest_level[0].item()
-                crest_level = line.dpumax[0].item()
-
-        elif line_type == LineType.CHANNEL:
-
-            node_1 = self.ga.nodes.filter(id=node_id_1)
-            node_2 = self.ga.nodes.filter(id=node_id_2)
-            start_level = node_1.dmax[0].item()
-            end_level = node_2.dmax[0].item()
-
-            start_upper_level = SideViewGraphGenerator.retrieve_node_upper_level(node_id_1, self.lines_1d2d_data)
-            end_upper_level = SideViewGraphGenerator.retrieve_node_upper_level(node_id_2, self.lines_1d2d_data)
-            start_height = 0
-            end_height = 0
-            if not math.isnan(start_upper_level):
-                start_height = (start_upper_level - start_level)
-
-            if not math.isnan(end_upper_level):
-                end_height = (end_upper_level - end_level)
-
-        return (start_level, end_level, start_height, end_height, crest_level, line_type)
+    def retrieve_profile_info_from_flowlines(self, flowline_ids: list[int]) -> dict[int, tuple[float, float, float, float, float, int]]:
+        """Returns the profile info (see retrieve_profile_info_from_flowline) for each flowline id
 
-    def retrieve_profile_info_from_node(self, node_id: int) -> tuple[float, float]:
+        All line, node and cross section attributes are fetched with a single query each.
+        """
+        flowline_ids = np.unique(np.asarray(flowline_ids, dtype=int))
+        if flowline_ids.size == 0:
+            return {}
+
+        lines = self.ga.lines.filter(id__in=flowline_ids.tolist()).only(
+            "id", "content_type", "line", "cross1", "cross2", "dpumax",
+            "invert_level_start_point", "invert_level_end_point",
+        ).data
+        node_ids_1, node_ids_2 = lines["line"]
+        node_data = self._node_data(np.concatenate([node_ids_1, node_ids_2]))
+        node_index_1 = np.searchsorted(node_data["id"], node_ids_1)
+        node_index_2 = np.searchsorted(node_data["id"], node_ids_2)
+        dmax_1 = node_data["dmax"][node_index_1]
+        dmax_2 = node_data["dmax"][node_index_2]
+        upper_level_1 = node_data["upper_level"][node_index_1]
+        upper_level_2 = node_data["upper_level"][node_index_2]
+        line_types = [SideViewGraphGenerator.content_type_to_line_type(ct.decode()) for ct in lines["content_type"]]
+        structure_types = (LineType.PIPE, LineType.CULVERT, LineType.ORIFICE, LineType.WEIR)
+        cross_section_heights = self._cross_section_heights(
+            [cross1_id for cross1_id, line_type in zip(lines["cross1"], line_types) if line_type in structure_types]
+        )
+
+        result = {}
+        for i, (flowline_id, line_type) in enumerate(zip(lines["id"].tolist(), line_types)):
+            start_level = None
+            end_level = None
+            start_height = None
+            end_height = None
+            crest_level = None
+
+            if line_type in structure_types:
+                cross1_id = lines["cross1"][i]
+                cross2_id = lines["cross2"][i]
+                assert cross1_id == cross2_id  # pipes and culverts have only one cross section definition
+                height = cross_section_heights[cross1_id]
+                if math.isnan(height):  # Not an error, simply not enough information
+                    logger.warning(f"Unable to derive cross section height for cross section {cross1_id} for line {flowline_id}, setting height to 0.")
+                    height = 0.0
+                start_height = height
+                end_height = height
+
+                if line_type == LineType.PIPE or line_type == LineType.CULVERT:
+                    start_level = lines["invert_level_start_point"][i].item()
+                    end_level = lines["invert_level_end_point"][i].item()
+                elif line_type == LineType.ORIFICE or line_type == LineType.WEIR:
+                    # for bottom level, take dmax of adjacent nodes
+                    start_level = np.min([dmax_1[i], dmax_2[i]]).item()
+                    end_level = start_level
+                    # crest_level is input, can be corrected due to incorrect node bottom levels -> use dpumax
+                    crest_level = lines["dpumax"][i].item()
+
+            elif line_type == LineType.CHANNEL:
+                start_level = dmax_1[i].item()
+                end_level = dmax_2[i].item()
+
+                start_height = 0
+                end_height = 0
+                if not math.isnan(upper_level_1[i]):
+                    start_height = (upper_level_1[i] - start_level).item()
+
+                if not math.isnan(upper_level_2[i]):
+                    end_height = (upper_level_2[i] - end_level).item()
+
+            result[flowline_id] = (start_level, end_level, start_height, end_height, crest_level, line_type)
+
+        return result
 
-        node = self.ga.nodes.filter(id=node_id)
+    def retrieve_profile_info_from_node(self, node_id: int) -> tuple[float, float]:
+        return self.retrieve_profile_info_from_nodes([node_id])[node_id]
 
-        bottom_level = node.dmax[0]
+    def retrieve_profile_info_from_nodes(self, node_ids: list[int]) -> dict[int, tuple[float, float]]:
+        """Returns the (bottom level, height) for each node id, fetched with a single query"""
+        node_data = self._node_data(np.asarray(node_ids, dtype=int))
+        bottom_levels = node_data["dmax"].astype(float)
         if not self.ga.has_2d:
-            upper_level = node.drain_level[0].item()  # can be nan
-            height = (upper_level-bottom_level)
+            upper_levels = node_data["drain_level"].astype(float)  # can be nan
+            heights = upper_levels - bottom_levels
         else:
-            upper_level = SideViewGraphGenerator.retrieve_node_upper_level(node_id, self.lines_1d2d_data)
-
-            height = np.float64(0.0)
-            if math.isnan(upper_level):
-                height = np.float64(0.0)
-            else:
-                # TODO: This does not always seem to be the case for 2D nodes (node type = [1, 2, 5, 6])
-                if (node.node_type[0] not in [1, 2, 5, 6]):
-                    assert upper_level >= bottom_level
-
-                if upper_level < bottom_level:
-                    logger.warning(f"Derived upper level of node is below bottom level for node {node_id}")
-                    # Flip
-                    upper_level, bottom_level = bottom_level, upper_level
-
-                height = (upper_level-bottom_level)
-
-        return (bottom_level.item(), height.item())
+            upper_levels = node_data["upper_level"]
+            has_upper_level = ~np.isnan(upper_levels)
+            # TODO: This does not always seem to be the case for 2D nodes (node type = [1, 2, 5, 6])
+            assert (upper_levels >= bottom_levels)[has_upper_level & ~np.isin(node_data["node_type"], [1, 2, 5, 6])].all()
+
+            flip = has_upper_level & (upper_levels < bottom_levels)
+            for node_id in node_data["id"][flip]:
+                logger.warning(f"Derived upper level of node is below bottom level for node {node_id}")
+            # Flip
+            bottom_levels[flip], upper_levels[flip] = upper_levels[flip], bottom_levels[flip]
+
+            heights = np.where(has_upper_level, upper_levels - bottom_levels, 0.0)
+
+        return dict(zip(node_data["id"].tolist(), zip(bottom_levels.tolist(), heights.tolist())))
+
+    def _node_data(self, node_ids: np.ndarray) -> dict[str, np.ndarray]:
+        """Returns the node attributes required for the profile, sorted by node id"""
+        node_data = self.ga.nodes.filter(id__in=np.unique(node_ids).tolist()).only(
+            "id", "dmax", "drain_level", "node_type"
+        ).data
+        order = np.argsort(node_data["id"])
+        node_data = {k: v[order] for (k, v) in node_data.items()}
+        node_data["upper_level"] = SideViewGraphGenerator.retrieve_node_upper_levels(node_data["id"], self.lines_1d2d_data)
+        return node_data
+
+    def _cross_section_heights(self, cross_section_ids: list[int]) -> dict[int, float]:
+        """Returns the (estimated) height of each cross section, fetched with a single query"""
+        if len(cross_section_ids) == 0:
+            return {}
+        if self.cross_section_tables is None:
+            self.cross_section_tables = self.ga.cross_sections.tables
+        cross_sections = self.ga.cross_sections.filter(id__in=np.unique(cross_section_ids).tolist()).only(
+            "id", "count", "offset", "shape", "width_1d"
+        ).data
+        return {
+            cross_section_id: SideViewGraphGenerator.cross_section_max_height(
+                cross_section_id, shape, count, offset, width_1d, self.cross_section_tables
+            )
+            for cross_section_id, shape, count, offset, width_1d in zip(
+                cross_sections["id"].tolist(),
+                cross_sections["shape"].tolist(),
+                cross_sections["count"].tolist(),
+                cross_sections["offset"].tolist(),
+                cross_sections["width_1d"].tolist(),
+            )
+        }
 
     @staticmethod
     def content_type_to_line_type(content_type: str) -> int:
@@ -125,19 +167,14 @@ class SideViewGraphGenerator():
         raise AttributeError(f"Unknown content type: {content_type}")
 
     @staticmethod
-    def cross_section_max_height(cross_section, tables) -> float:
+    def cross_section_max_height(cross_section_id, shape, count, offset, width_1d, tables) -> float:
         """Retrieves (or estimates) the height for a cross section using various heuristics.
             Returns nan when estimation not possible. Raises exception when inconsistencies are
             encountered.
         """
-        count = cross_section.count[0]
-        offset = cross_section.offset[0]
-        shape = cross_section.shape[0]
-        width_1d = cross_section.width_1d[0]
-
         if shape == CrossSectionShape.CIRCLE.value:
             assert count == 0
-            return width_1d.item()  # for circle width = height
+            return float(width_1d)  # for circle width = height
         elif shape in (CrossSectionShape.TABULATED_RECTANGLE.value, CrossSectionShape.TABULATED_TRAPEZIUM.value):
             # Check whether shape is closed (check whether last width is 0.0), otherwise return nan
             if tables[:, offset:offset+count][:, -1][1] == 0.0:  # widths are second row
@@ -147,17 +184,24 @@ class SideViewGraphGenerator():
         elif shape == CrossSectionShape.OPEN_RECTANGLE.value:
             return math.nan
 
-        raise AttributeError(f"Unable to derive height of cross section: {cross_section.id[0]} with shape {shape}")
+        raise AttributeError(f"Unable to derive height of cross section: {cross_section_id} with shape {shape}")
 
     @staticmethod
-    def retrieve_node_upper_level(node_id, lines_1d2d) -> float:
-        # For 2D model, take minimum dpumax from adjacent 1D2D lines (if available)
-        dpumax_list = []
-        for count in range(len(lines_1d2d["line"][0])):
-            if node_id == lines_1d2d["line"][0][count] or node_id == lines_1d2d["line"][1][count]:
-                dpumax_list.append(lines_1d2d["dpumax"][count])
-
-        if dpumax_list:
-            return np.min(dpumax_list).item()
-        else:
-            return math.nan
+    def retrieve_node_upper_levels(node_ids: np.ndarray, lines_1d2d) -> np.ndarray:
+        """For 2D model, take minimum dpumax from adjacent 1D2D lines (if available, otherwise nan)"""
+        line_node_ids = np.concatenate(lines_1d2d["line"])
+        dpumax = np.tile(lines_1d2d["dpumax"], 2)
+        order = np.argsort(line_node_ids, kind="stable")
+        line_node_ids = line_node_ids[order]
+        dpumax = dpumax[order]
+
+        upper_levels = np.full(len(node_ids), np.nan)
+        if line_node_ids.size == 0:
+            return upper_levels
+        unique_node_ids, first = np.unique(line_node_ids, return_index=True)
+        min_dpumax = np.minimum.reduceat(dpumax, first)
+
+        index = np.clip(np.searchsorted(unique_node_ids, node_ids), 0, unique_node_ids.size - 1)
+        found = unique_node_ids[index] == node_ids
+        upper_levels[found] = min_dpumax[index[found]]
+        return upper_levels
@@ -19,7 +19,6 @@ from qgis.PyQt.QtWidgets import QVBoxLayout
 from qgis.PyQt.QtWidgets import QTableView
 from qgis.PyQt.QtWidgets import QWidget
 from threedigrid.admin.constants import NO_DATA_VALUE
-from shapely.geometry import LineString, Point
 from threedi_results_analysis.tool_sideview.route import Route, RouteMapTool
 from threedi_results_analysis.tool_sideview.sideview_visualisation import SideViewMapVisualisation
 from threedi_results_analysis.tool_sideview.utils import LineType
@@ -28,8 +27,8 @@ from threedi_results_analysis.utils.widgets import PenStyleWidget
 from threedi_results_analysis.tool_sideview.sideview_graph_generator import SideViewGraphGenerator
 from threedi_results_analysis.threedi_plugin_model import ThreeDiGridItem, ThreeDiResultItem
 
-from threedigrid.admin.gridresultadmin import GridH5ResultAdmin
 from bisect import bisect_left
+from typing import Tuple
 import logging
 import numpy as np
 import os
@@ -71,10 +70,16 @@ class SideViewPlotWidget(pg.PlotWidget):
         self.model = model  # global model from result manager
         self.sideview_result_model = sideview_result_model  # Sideview model containing patterns and selections
         self.sideview_nodes = []
+        self.sideview_node_ids = np.empty(0, dtype=int)
+        self.sideview_node_distances = np.empty(0, dtype=float)
+        self.water_level_cache = {}  # map from result id to water levels (time x sideview node)
+        self.water_level_envelopes = {}  # map from result id to (max, min) water level per sideview node
         self.waterlevel_plots = {}  # map from result id to (plot, fill)
+        self.envelope_plots = {}  # map from result id to (max plot, min plot)
         self.current_grid_id = None
 
         self.show_dots = True
+        self.show_envelope = False
 
         self.showGrid(True, True, 0.5)
         self.setLabel("bottom", "Distance", "m")
@@ -246,6 +251,9 @@ class SideViewPlotWidget(pg.PlotWidget):
         if include_waterlevels:
             for waterlevel_plot, _, _ in self.waterlevel_plots.values():
                 range_plots.append(waterlevel_plot)
+            if self.show_envelope:
+                for max_plot, _ in self.envelope_plots.values():
+                    range_plots.append(max_plot)
 
         self.autoRange(items=range_plots)
 
@@ -267,12 +275,22 @@ class SideViewPlotWidget(pg.PlotWidget):
 
         generator = SideViewGraphGenerator(current_grid.path) if current_grid else None
 
-        for route_part in route_path:
-            first_node = True
+        aggregated_route_path = [list(Route.aggregate_route_parts(route_part)) for route_part in route_path]
+        if aggregated_route_path:
             messagebar_message("Sideview", "Profile being generated, this might take a while...", 0, 0)
             QApplication.processEvents()
 
-            for (begin_dist, end_dist, direction, feature) in Route.aggregate_route_parts(route_part):
+            # Fetch the attributes of all flowlines and nodes on the route at once
+            route_features = [part[3] for route_part in aggregated_route_path for part in route_part]
+            flowline_profiles = generator.retrieve_profile_info_from_flowlines([f["id"] for f in route_features])
+            node_profiles = generator.retrieve_profile_info_from_nodes(
+                [f["calculation_node_id_start"] for f in route_features] + [f["calculation_node_id_end"] for f in route_features]
+            )
+
+        for route_part in aggregated_route_path:
+            first_node = True
+
+            for (begin_dist, end_dist, direction, feature) in route_part:
 
                 begin_dist = float(begin_dist)
                 end_dist = float(end_dist)
@@ -282,7 +300,7 @@ class SideViewPlotWidget(pg.PlotWidget):
                 if direction != 1:
                     begin_node_id, end_node_id = end_node_id, begin_node_id
 
-                begin_level, end_level, begin_height, end_height, crest_level, ltype = generator.retrieve_profile_info_from_flowline(feature["id"])
+                begin_level, end_level, begin_height, end_height, crest_level, ltype = flowline_profiles[feature["id"]]
                 if direction != 1:
                     begin_level, end_level = end_level, begin_level
                     begin_height, end_height = end_height, begin_height
@@ -322,8 +340,8 @@ class SideViewPlotWidget(pg.PlotWidget):
                     logger.error(f"Unknown line type: {ltype}")
                     return
 
-                node_level_1, node_height_1 = generator.retrieve_profile_info_from_node(begin_node_id)
-                node_level_2, node_height_2 = generator.retrieve_profile_info_from_node(end_node_id)
+                node_level_1, node_height_1 = node_profiles[begin_node_id]
+                node_level_2, node_height_2 = node_profiles[end_node_id]
 
                 # Only draw exchange when nodes have heights
                 if (node_height_1 > 0.0 and node_height_2 > 0.0):
@@ -341,6 +359,12 @@ class SideViewPlotWidget(pg.PlotWidget):
                     {"distance": end_dist, "id": end_node_id, "height": node_height_2, "level":  node_level_2}
                 )
 
+        # The route changed, so the water levels need to be read again
+        self.sideview_node_ids = np.array([node["id"] for node in self.sideview_nodes], dtype=int)
+        self.sideview_node_distances = np.array([node["distance"] for node in self.sideview_nodes], dtype=float)
+        self.water_level_cache = {}
+        self.water_level_envelopes = {}
+
         if len(route_path) > 0:
             # Draw data into graph, split lines into seperate parts for the different line types
 
@@ -388,30 +412,21 @@ class SideViewPlotWidget(pg.PlotWidget):
 
             # pyqtgraph has difficulties with filling between lines consisting of different
             # number of segments, therefore we need to draw a dedicated sewer-exchange line
+            exchange_levels = {
+                (ts_exchange_table[i][0], ts_exchange_table[i+1][0]): (ts_exchange_table[i][1], ts_exchange_table[i+1][1])
+                for i in range(len(ts_exchange_table) - 2, -1, -2)  # reversed, so the first match wins
+            }
             sewer_top_table = []
             sewer_exchange_table = []
             for point_index in range(0, len(tables[LineType.PIPE]), 2):
                 point_1 = tables[LineType.PIPE][point_index]
                 point_2 = tables[LineType.PIPE][point_index+1]
-                # find the corresponding exchange height at this distance
-                exchange_point_found = False
-                for exchange_point_index in range(0, len(ts_exchange_table), 2):
-                    exchange_point_1 = ts_exchange_table[exchange_point_index]
-                    exchange_point_2 = ts_exchange_table[exchange_point_index+1]
-                    if exchange_point_1[0] == point_1[0] and exchange_point_2[0] == point_2[0]:
-                        sewer_top_table.append((point_1[0], point_1[1]))
-                        sewer_top_table.append((point_2[0], point_2[1]))
-                        sewer_exchange_table.append((point_1[0], exchange_point_1[1]))
-                        sewer_exchange_table.append((point_2[0], exchange_point_2[1]))
-                        exchange_point_found = True
-                        break
-
-                # In case no exchange level, fill to top
-                if not exchange_point_found:
-                    sewer_top_table.append((point_1[0], point_1[1]))
-                    sewer_top_table.append((point_2[0], point_2[1]))
-                    sewer_exchange_table.append((point_1[0], UPPER_LIMIT))
-                    sewer_exchange_table.append((point_2[0], UPPER_LIMIT))
+                sewer_top_table.append((point_1[0], point_1[1]))
+                sewer_top_table.append((point_2[0], point_2[1]))
+                # find the corresponding exchange height at this distance, in case no exchange level, fill to top
+                exchange_level_1, exchange_level_2 = exchange_levels.get((point_1[0], point_2[0]), (UPPER_LIMIT, UPPER_LIMIT))
+                sewer_exchange_table.append((point_1[0], exchange_level_1))
+                sewer_exchange_table.append((point_2[0], exchange_level_2))
 
             self.sewer_top_plot.setData(np.array(sewer_top_table, dtype=float), connect="pairs")
             self.sewer_exchange_plot.setData(np.array(sewer_exchange_table, dtype=float), connect="pairs")
@@ -460,33 +475,18 @@ class SideViewPlotWidget(pg.PlotWidget):
                 tables[point[2]].append((point[0], point[1]))
             self.culvert_lowest_plot.setData(np.array(tables[LineType.CULVERT], dtype=float), connect="pairs")
 
-            # draw nodes
-            node_indicator_table = []
-            for node in self.sideview_nodes:
-                node_indicator_table.append((node["distance"], LOWER_LIMIT))
-                node_indicator_table.append((node["distance"], UPPER_LIMIT))
-
             # Determine intersections between vertical node lines and horizontal lines
             if self.show_dots:
-                horizontal_lines = [exchange_line, upper_line, ts_table]
-
-                intersections = []
-                for i in range(0, len(node_indicator_table), 2):
-                    vert_line = LineString([(node_indicator_table[i][0], node_indicator_table[i])[1], (node_indicator_table[i+1][0], node_indicator_table[i+1][1])])
-
-                    for line in horizontal_lines:
-                        # Some lines may contain gaps and therefore we do not represent them as a single LineString
-                        # but treat each segment as a LineString
-                        for idx in range(0, len(line), 2):
-                            segment = LineString([(line[idx][0], line[idx][1]), (line[idx+1][0], line[idx+1][1])])
-                            intersection = vert_line.intersection(segment)
-                            if isinstance(intersection, Point):
-                                intersections.append(intersection.coords[0])
-                                intersections.append((0.0, np.nan))  # add a line break
+                intersections = [
+                    SideViewPlotWidget.vertical_intersections(self.sideview_node_distances, np.array(line, dtype=float).reshape(-1, 2, line_width)[:, :, :2])
+                    for line, line_width in ((exchange_line, 2), (upper_line, 3), (ts_table, 2))
+                    if len(line) > 0
+                ]
+                intersections = np.concatenate(intersections) if intersections else np.empty((0, 2))
 
                 logger.info(f"{len(intersections)} intersections")
 
-                self.node_indicator_intersection_plot.setData(np.array(intersections, dtype=float), symbol='h', size=2, connect='finite')
+                self.node_indicator_intersection_plot.setData(intersections, symbol='h', size=2, connect='finite')
             else:
                 self.node_indicator_intersection_plot.setData(np.array([(0.0, np.nan)], dtype=float), symbol='h', size=2, connect='finite')
 
@@ -495,6 +495,9 @@ class SideViewPlotWidget(pg.PlotWidget):
             for plot, fill, dots in self.waterlevel_plots.values():
                 plot.setData(ts_table)
                 dots.setData(ts_table)
+            for max_plot, min_plot in self.envelope_plots.values():
+                max_plot.setData(ts_table)
+                min_plot.setData(ts_table)
 
             self.auto_scale(include_waterlevels=False)
 
@@ -526,11 +529,70 @@ class SideViewPlotWidget(pg.PlotWidget):
                 self.removeItem(fill)
                 self.removeItem(dots)
             self.waterlevel_plots = {}
+            self.remove_envelope_plots()
 
             # Clear node list used to draw results
             self.sideview_nodes = []
+            self.sideview_node_ids = np.empty(0, dtype=int)
+            self.sideview_node_distances = np.empty(0, dtype=float)
             messagebar_pop_message()
 
+    @staticmethod
+    def vertical_intersections(distances: np.ndarray, segments: np.ndarray) -> np.ndarray:
+        """Returns the intersections of vertical lines at the given distances with line segments
+
+        :param segments: array of shape (n, 2, 2), the (distance, level) of the begin and end point of each segment
+        :return: array of (distance, level) points, each followed by a (0.0, nan) line break
+        """
+        x1, y1, x2, y2 = segments[:, 0, 0], segments[:, 0, 1], segments[:, 1, 0], segments[:, 1, 1]
+        # vertical segments (x1 == x2) do not intersect in a single point
+        valid = (x1 != x2) & np.isfinite(y1) & np.isfinite(y2)
+        sorted_distances = np.sort(distances)
+        start = np.searchsorted(sorted_distances, np.minimum(x1, x2), side="left")
+        stop = np.searchsorted(sorted_distances, np.maximum(x1, x2), side="right")
+        counts = np.where(valid, stop - start, 0)
+
+        # for each segment, all distances within its range
+        s = np.repeat(np.arange(len(segments)), counts)
+        x = sorted_distances[start[s] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+        y = y1[s] + (x - x1[s]) * (y2[s] - y1[s]) / (x2[s] - x1[s])
+        intersections = np.full((2 * len(x), 2), np.nan)
+        intersections[0::2, 0] = x
+        intersections[0::2, 1] = y
+        intersections[1::2, 0] = 0.0
+        return intersections
+
+    @staticmethod
+    def route_water_levels(result_admin, node_ids: np.ndarray) -> np.ndarray:
+        """Returns the water levels (time x route node) of the nodes on the route, nan when dry"""
+        if len(node_ids) == 0:
+            return np.empty((result_admin.nodes.timestamps.size, 0))
+        data = result_admin.nodes.filter(id__in=np.unique(node_ids).tolist()).only("s1", "id").timeseries(indexes=slice(None)).data
+        order = np.argsort(data["id"])
+        columns = order[np.searchsorted(data["id"], node_ids, sorter=order)]
+        levels = data["s1"][:, columns].astype(float)
+        levels[levels == NO_DATA_VALUE] = np.nan
+        return levels
+
+    @staticmethod
+    def water_level_envelope(levels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the maximum and minimum over time of a (time x node) water level matrix
+
+        Both are computed from the cached matrix, with one reduction each, instead of
+        per timestep. NaN (dry) values are ignored; nodes that are dry during the whole
+        simulation are NaN.
+        """
+        if levels.shape[0] == 0:
+            empty = np.full(levels.shape[1], np.nan)
+            return empty, empty.copy()
+        return np.fmax.reduce(levels, axis=0), np.fmin.reduce(levels, axis=0)
+
+    def remove_envelope_plots(self):
+        for max_plot, min_plot in self.envelope_plots.values():
+            self.removeItem(max_plot)
+            self.removeItem(min_plot)
+        self.envelope_plots = {}
+
     def update_water_level_cache(self, update_range=True):
 
         for plot, fill, dots in self.waterlevel_plots.values():
@@ -538,6 +600,7 @@ class SideViewPlotWidget(pg.PlotWidget):
             self.removeItem(fill)
             self.removeItem(dots)
         self.waterlevel_plots = {}
+        self.remove_envelope_plots()
 
         # Iterate through the selection model
         for row_number in range(self.sideview_result_model.rowCount()):
@@ -565,25 +628,32 @@ class SideViewPlotWidget(pg.PlotWidget):
 
             self.waterlevel_plots[result_id] = (water_level_plot, water_fill, water_level_nodes)
 
-            result = self.model.get_result(result_id)
-
-            gra = GridH5ResultAdmin(str(result.parent().path.with_suffix('.h5')), result.path)
-            node_ids = [int(node["id"]) for node in self.sideview_nodes]
-            data = gra.nodes.filter(id__in=node_ids).only("s1", "id").timeseries(indexes=slice(None)).data
-            node_levels = data["s1"]
-            node_id_table = data["id"].tolist()
-
-            for node in self.sideview_nodes:
-                if "timeseries" not in node:
-                    node["timeseries"] = {}
-
-                # find index in node table
-                column = node_id_table.index(node["id"])
-                levels = node_levels[:, column]
-                levels[levels == NO_DATA_VALUE] = np.NaN
+            # Create the min/max water level plots
+            pen = pg.mkPen(color=plot_color, width=1, style=Qt.DotLine)
+            max_plot = pg.PlotDataItem(np.array([(0.0, np.nan)]), pen=pen)
+            max_plot.setZValue(100)
+            min_plot = pg.PlotDataItem(np.array([(0.0, np.nan)]), pen=pen)
+            min_plot.setZValue(100)
+            self.addItem(max_plot)
+            self.addItem(min_plot)
+
+            self.envelope_plots[result_id] = (max_plot, min_plot)
+
+            if result_id not in self.water_level_cache:
+                result = self.model.get_result(result_id)
+                self.water_level_cache[result_id] = SideViewPlotWidget.route_water_levels(
+                    result.threedi_result.result_admin, self.sideview_node_ids
+                )
+                self.water_level_envelopes[result_id] = SideViewPlotWidget.water_level_envelope(
+                    self.water_level_cache[result_id]
+                )
 
-                node["timeseries"][result.id] = levels
+        # Discard water levels of removed results
+        result_ids = {self.sideview_result_model.item(row_number, 0).data() for row_number in range(self.sideview_result_model.rowCount())}
+        self.water_level_cache = {k: v for (k, v) in self.water_level_cache.items() if k in result_ids}
+        self.water_level_envelopes = {k: v for (k, v) in self.water_level_envelopes.items() if k in result_ids}
 
+        self.draw_envelopes()
         self.update_waterlevel(update_range)
         messagebar_pop_message()
 
@@ -608,28 +678,37 @@ class SideViewPlotWidget(pg.PlotWidget):
 
             logger.info(f"Drawing for result {result.id} for nr {timestamp_nr}")
 
-            water_level_line = []
-            water_nodes = []
-            for node in self.sideview_nodes:
-                water_level = node["timeseries"][result.id][timestamp_nr]
-                point = (node["distance"], water_level)
-                water_level_line.append(point)
-                water_nodes += [(point), (0.0, np.nan)]
-                # logger.error(f"Node shape {node['timeseries'].shape}, distance {node['distance']} and level {water_level}")
+            water_level_line = np.column_stack([self.sideview_node_distances, self.water_level_cache[result.id][timestamp_nr]])
+            # every node is followed by a line break
+            water_nodes = np.full((2 * len(water_level_line), 2), np.nan)
+            water_nodes[0::2] = water_level_line
+            water_nodes[1::2, 0] = 0.0
 
-            self.waterlevel_plots[result.id][0].setData(np.array(water_level_line, dtype=float))
+            self.waterlevel_plots[result.id][0].setData(water_level_line)
 
             # logger.error(water_level_line)
             # Draw dots at intersections between this water line and vertical node lines:
             # This is actually at the beginning of each segment of the water level line
             if self.show_dots:
-                self.waterlevel_plots[result.id][2].setData(np.array(water_nodes, dtype=float), symbol='h', size=2, connect='finite')
+                self.waterlevel_plots[result.id][2].setData(water_nodes, symbol='h', size=2, connect='finite')
             else:
                 self.waterlevel_plots[result.id][2].setData(np.array([(0.0, np.nan)], dtype=float), symbol='h', size=2, connect='finite')
 
         if update_range:
             self.auto_scale(include_waterlevels=True)
 
+    def draw_envelopes(self):
+        """Draw the maximum and minimum water level of each result, these do not depend on the current time"""
+        empty = np.array([(0.0, np.nan)], dtype=float)
+        for result_id, (max_plot, min_plot) in self.envelope_plots.items():
+            if not self.show_envelope or result_id not in self.water_level_envelopes:
+                max_plot.setData(empty)
+                min_plot.setData(empty)
+                continue
+            max_levels, min_levels = self.water_level_envelopes[result_id]
+            max_plot.setData(np.column_stack([self.sideview_node_distances, max_levels]), connect='finite')
+            min_plot.setData(np.column_stack([self.sideview_node_distances, min_levels]), connect='finite')
+
     def on_close(self):
         self.profile_route_updated.disconnect(self.update_water_level_cache)
 
@@ -928,6 +1007,10 @@ class SideViewDockWidget(QDockWidget):
         self.side_view_plot_widget.show_dots = (state == Qt.Checked)
         self.side_view_plot_widget.set_sideprofile(self.route.path, self.model.get_grid(self.current_grid_id))
 
+    def update_envelope(self, state):
+        self.side_view_plot_widget.show_envelope = (state == Qt.Checked)
+        self.side_view_plot_widget.draw_envelopes()
+
     def on_close(self):
         """
         unloading widget
@@ -971,6 +1054,10 @@ class SideViewDockWidget(QDockWidget):
         self.show_nodes_checkbox.setChecked(True)
         self.show_nodes_checkbox.stateChanged.connect(self.update_dots)
         self.button_bar_hlayout.addWidget(self.show_nodes_checkbox)
+        self.show_envelope_checkbox = QCheckBox("Show min/max water level", self.dock_widget_content)
+        self.show_envelope_checkbox.setChecked(False)
+        self.show_envelope_checkbox.stateChanged.connect(self.update_envelope)
+        self.button_bar_hlayout.addWidget(self.show_envelope_checkbox)
         spacer_item = QSpacerItem(0, 0, QSizePolicy.Expanding, QSizePolicy.Minimum)
         self.button_bar_hlayout.addItem(spacer_item)
         self.button_bar_hlayout.addWidget(QLabel("Computational grid: ", self.dock_widget_content))
@@ -1,6 +1,11 @@
+from scipy.sparse.csgraph import dijkstra
+from threedi_results_analysis.tool_sideview.route import build_sparse_graph
 from threedi_results_analysis.tool_sideview.sideview import ThreeDiSideView
+from threedi_results_analysis.tool_sideview.sideview_view import SideViewPlotWidget
 
 import mock
+import numpy as np
+import pytest
 import unittest
 
 
@@ -14,3 +19,31 @@ class TestThreeDiSideView(unittest.TestCase):
         self.assertEqual(
             self.sideview.icon_path, "/root/.local/share/QGIS/QGIS3/profiles/default/python/plugins/threedi_results_analysis/icons/icon_route.png"
         )
+
+
+def test_build_sparse_graph():
+    # edges: 0-1 twice (keep the shortest), 1-2, a loop at 2 and 2-3 with zero length
+    graph, edge_index = build_sparse_graph(
+        start_vertices=[0, 1, 1, 2, 3],
+        end_vertices=[1, 0, 2, 2, 2],
+        weights=[5.0, 3.0, 2.0, 1.0, 0.0],
+        nr_vertices=5,
+    )
+    assert edge_index == {(0, 1): 1, (1, 0): 1, (1, 2): 2, (2, 1): 2, (2, 3): 4, (3, 2): 4}
+    distances, predecessors = dijkstra(graph, directed=False, indices=3, return_predecessors=True)
+    assert distances[:4] == pytest.approx([5.0, 2.0, 0.0, 0.0], abs=1e-6)
+    assert predecessors.tolist()[:4] == [1, 2, 3, -9999]
+    assert np.isinf(distances[4])
+
+
+def test_water_level_envelope():
+    levels = np.array(
+        [
+            [1.0, np.nan, np.nan],
+            [3.0, 2.0, np.nan],
+            [2.0, 0.5, np.nan],
+        ]
+    )
+    max_levels, min_levels = SideViewPlotWidget.water_level_envelope(levels)
+    np.testing.assert_array_equal(max_levels, [3.0, 2.0, np.nan])
+    np.testing.assert_array_equal(min_levels, [1.0, 0.5, np.nan])
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Dissolve computational cells into catchment polygons
+
+3Di cells are axis aligned rectangles whose corners lie on a grid with the size of the
+smallest cell. Instead of a geometric union (which is slow and memory hungry for many
+cells), the cells are burned into a raster with that pixel size, from which GDAL traces
+the outlines. Because the corners coincide with pixel corners, the result is exact.
+
+To bound the memory use, the raster is processed in blocks. Only the polygons that
+touch a block boundary are merged with a geometric union afterwards. The blocks are
+traced in pixel coordinates, so that the outlines of neighbouring blocks coincide
+exactly.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+from osgeo import gdal
+from osgeo import ogr
+from threedi_results_analysis.utils.cell_raster import cell_pixel_bounds
+from threedi_results_analysis.utils.cell_raster import GeoTransform
+
+
+gdal.UseExceptions()
+ogr.UseExceptions()
+
+# Maximum width and height in pixels of a block that is traced at once
+BLOCK_SIZE = 4096
+
+
+def _polygonize(mask: np.ndarray, geotransform: GeoTransform) -> List[ogr.Geometry]:
+    """Return the polygons of the nonzero pixels of the mask"""
+    raster = gdal.GetDriverByName("MEM").Create("", mask.shape[1], mask.shape[0], 1, gdal.GDT_Byte)
+    raster.SetGeoTransform(geotransform)
+    band = raster.GetRasterBand(1)
+    band.WriteArray(mask)
+    band.SetNoDataValue(0)
+
+    vector = ogr.GetDriverByName("MEMORY").CreateDataSource("")
+    layer = vector.CreateLayer("polygons", geom_type=ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("value", ogr.OFTInteger))
+    gdal.Polygonize(band, band.GetMaskBand(), layer, 0)
+    return [feature.GetGeometryRef().Clone() for feature in layer]
+
+
+def _single_parts(geometry: ogr.Geometry) -> List[ogr.Geometry]:
+    if ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbPolygon:
+        return [geometry]
+    return [geometry.GetGeometryRef(i).Clone() for i in range(geometry.GetGeometryCount())]
+
+
+def _to_world(polygon: ogr.Geometry, geotransform: GeoTransform) -> ogr.Geometry:
+    """Return the polygon in pixel coordinates (column, row) in world coordinates"""
+    origin_x, pixel_size, _, origin_y, _, _ = geotransform
+    result = ogr.Geometry(ogr.wkbPolygon)
+    for i in range(polygon.GetGeometryCount()):
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        # the y axis is flipped, so reverse the points to keep the orientation
+        for point in reversed(polygon.GetGeometryRef(i).GetPoints()):
+            ring.AddPoint_2D(origin_x + point[0] * pixel_size, origin_y - point[1] * pixel_size)
+        result.AddGeometry(ring)
+    return result
+
+
+def _blocks(shape: Tuple[int, int], block_size: int):
+    """Yield the row_start, row_end, col_start, col_end of the blocks of a raster"""
+    height, width = shape
+    for r0 in range(0, height, block_size):
+        for c0 in range(0, width, block_size):
+            yield r0, min(r0 + block_size, height), c0, min(c0 + block_size, width)
+
+
+def cells_to_polygons(
+    cell_coords: np.ndarray, pixel_size: Optional[float] = None, block_size: int = BLOCK_SIZE
+) -> List[ogr.Geometry]:
+    """Return the (single part) polygons that cover the cells
+
+    Cells that share an edge end up in the same polygon, cells that only touch at a
+    corner do not. Holes are kept.
+
+    :param cell_coords: array of shape (4, n) with the xmin, ymin, xmax, ymax of each cell
+    :param pixel_size: defaults to the width of the smallest cell
+    :param block_size: maximum width and height in pixels of a block that is traced at once
+    """
+    if cell_coords.shape[1] == 0:
+        return []
+    if pixel_size is None:
+        pixel_size = float(np.min(cell_coords[2] - cell_coords[0]))
+    (row_start, row_end, col_start, col_end), shape, geotransform = cell_pixel_bounds(cell_coords, pixel_size)
+    height, width = shape
+
+    polygons = []
+    seam_polygons = []
+    for r0, r1, c0, c1 in _blocks(shape, block_size):
+        in_block = (row_start < r1) & (row_end > r0) & (col_start < c1) & (col_end > c0)
+        if not in_block.any():
+            continue
+        mask = np.zeros((r1 - r0, c1 - c0), dtype=np.uint8)
+        for a, b, c, d in zip(row_start[in_block], row_end[in_block], col_start[in_block], col_end[in_block]):
+            mask[max(a - r0, 0):b - r0, max(c - c0, 0):d - c0] = 1
+        for polygon in _polygonize(mask, (float(c0), 1.0, 0.0, float(r0), 0.0, 1.0)):
+            xmin, xmax, ymin, ymax = polygon.GetEnvelope()
+            on_seam = (
+                (c0 > 0 and xmin == c0)
+                or (c1 < width and xmax == c1)
+                or (r0 > 0 and ymin == r0)
+                or (r1 < height and ymax == r1)
+            )
+            (seam_polygons if on_seam else polygons).append(polygon)
+
+    if seam_polygons:
+        union = ogr.Geometry(ogr.wkbMultiPolygon)
+        for polygon in seam_polygons:
+            union.AddGeometry(polygon)
+        polygons.extend(_single_parts(union.UnionCascaded()))
+
+    # polygonize adds a vertex at every pixel corner along the outline
+    return [_to_world(polygon.Simplify(0), geotransform) for polygon in polygons]
+
+
+def cells_as_multipolygon(cell_coords: np.ndarray) -> ogr.Geometry:
+    """Return the multipolygon that covers the cells"""
+    result = ogr.Geometry(ogr.wkbMultiPolygon)
+    for polygon in cells_to_polygons(cell_coords):
+        result.AddGeometry(polygon)
+    return result
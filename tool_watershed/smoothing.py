@@ -1,5 +1,9 @@
+from typing import List, Sequence, Tuple
+
 import numpy as np
+import shapely
 from osgeo import ogr
+from scipy.ndimage import correlate1d
 from scipy.ndimage import gaussian_filter1d
 
 ogr.UseExceptions()
@@ -105,3 +109,125 @@ def layer_gaussian_smooth(datasource: ogr.DataSource, layer_name: str, sigma=1.0
                 feature.SetGeometry(smooth_geom)
                 layer.SetFeature(feature)
     return
+
+
+def _segmentize(coords: np.ndarray, ring_index: np.ndarray, max_length: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Densify all rings at once, inserting vertices the same way as ogr.Geometry.Segmentize()"""
+    is_segment_start = np.append(ring_index[1:] == ring_index[:-1], False)
+    delta = np.zeros_like(coords)
+    delta[:-1] = coords[1:] - coords[:-1]
+    delta[~is_segment_start] = 0
+    square_length = np.sum(delta**2, axis=1)
+    square_max_length = max_length**2
+    nr_intermediate = np.where(
+        square_length - square_max_length > 1e-5 * square_max_length,
+        np.floor(np.sqrt(square_length / square_max_length) - 1e-2),
+        0,
+    ).astype(int)
+
+    counts = nr_intermediate + 1
+    source = np.repeat(np.arange(len(coords)), counts)
+    # position of each output vertex within the segment, as a fraction of its length
+    step = np.arange(source.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    fraction = step / np.repeat(counts, counts)
+    return coords[source] + fraction[:, np.newaxis] * delta[source], ring_index[source]
+
+
+def _ragged_wrap_gaussian_filter(values: np.ndarray, starts: np.ndarray, sizes: np.ndarray, sigma: float):
+    """gaussian_filter1d(mode="wrap") applied to each series values[start:start + size]"""
+    radius = int(4.0 * sigma + 0.5)  # same truncation as scipy
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 / sigma**2 * x**2)
+    weights /= weights.sum()
+
+    # pad each series with its wrapped-around values and filter them all in one go
+    padded_sizes = sizes + 2 * radius
+    padded_series = np.repeat(np.arange(sizes.size), padded_sizes)
+    local = np.arange(padded_series.size) - np.repeat(np.cumsum(padded_sizes) - padded_sizes, padded_sizes)
+    source = starts[padded_series] + (local - radius) % sizes[padded_series]
+    filtered = correlate1d(values[source], weights, axis=0, mode="nearest")
+    keep = (local >= radius) & (local < radius + sizes[padded_series])
+    return filtered[keep]
+
+
+def rings_gaussian_smooth(
+    coords: np.ndarray, ring_index: np.ndarray, sigma: float = 1.0, sample_dist: float = 1.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Apply gaussian smoothing to many rings at once
+
+    Gives the same result as linestring_gaussian_smooth() on each ring, but the rings
+    are resampled and filtered as one ragged coordinate array. Rings that are too
+    short to be resampled are returned unchanged.
+
+    :param coords: (n, 2) array with the vertices of all (closed) rings
+    :param ring_index: (n,) sorted array with the ring of each vertex
+    :param sigma: higher sigma for smoother result
+    :param sample_dist: lower sample_dist for smoother result
+    :return: coords and ring_index of the smoothed rings
+    """
+    if coords.size == 0:
+        return coords, ring_index
+    dense, dense_index = _segmentize(coords, ring_index, sample_dist)
+    rings, starts, nr_vertices = np.unique(dense_index, return_index=True, return_counts=True)
+    ring_nr = np.repeat(np.arange(rings.size), nr_vertices)
+
+    segment_lengths = np.hypot(*(dense[1:] - dense[:-1]).T)
+    segment_lengths[dense_index[1:] != dense_index[:-1]] = 0
+    lengths = np.bincount(ring_nr[:-1], weights=segment_lengths, minlength=rings.size)
+    nr_samples = (lengths / sample_dist).astype(int)
+    smoothable = (nr_samples >= 2) & (nr_vertices >= 2)
+
+    # smooth only the rings that are long enough
+    selected = smoothable[ring_nr]
+    nr_vertices = nr_vertices[smoothable]
+    nr_samples = nr_samples[smoothable]
+    vertex_ring = np.repeat(np.arange(nr_vertices.size), nr_vertices)
+    sample_ring = np.repeat(np.arange(nr_samples.size), nr_samples)
+    vertex_step = np.arange(vertex_ring.size) - np.repeat(np.cumsum(nr_vertices) - nr_vertices, nr_vertices)
+    sample_step = np.arange(sample_ring.size) - np.repeat(np.cumsum(nr_samples) - nr_samples, nr_samples)
+    # position along each ring in [0, 1], offset by 2 * ring number so one np.interp handles all rings
+    t = 2 * vertex_ring + vertex_step / (nr_vertices - 1)[vertex_ring]
+    t2 = 2 * sample_ring + sample_step / (nr_samples - 1)[sample_ring]
+
+    resampled = np.column_stack([np.interp(t2, t, dense[selected, i]) for i in range(2)])
+    sample_starts = np.cumsum(nr_samples) - nr_samples
+    filtered = _ragged_wrap_gaussian_filter(resampled, sample_starts, nr_samples, sigma)
+    smoothed = np.column_stack([np.interp(t, t2, filtered[:, i]) for i in range(2)])
+
+    # close the smoothed rings again
+    vertex_starts = np.cumsum(nr_vertices) - nr_vertices
+    insert_at = vertex_starts + nr_vertices
+    smoothed = np.insert(smoothed, insert_at, smoothed[vertex_starts], axis=0)
+    smoothed_index = np.repeat(rings[smoothable], nr_vertices + 1)
+
+    # merge with the unchanged rings, keeping the order of the rings
+    unchanged = ~smoothable[np.searchsorted(rings, ring_index)]
+    out_coords = np.concatenate([smoothed, coords[unchanged]])
+    out_index = np.concatenate([smoothed_index, ring_index[unchanged]])
+    order = np.argsort(out_index, kind="stable")
+    return out_coords[order], out_index[order]
+
+
+def polygons_gaussian_smooth(wkbs: Sequence[bytes], sigma=1.0, sample_dist=1.0) -> List[bytes]:
+    """Apply gaussian smoothing to the exterior rings of many polygons at once
+
+    Equivalent to polygon_gaussian_smooth() for each polygon: interior rings are
+    dropped and geometries that are not a Polygon are returned unchanged.
+
+    :param wkbs: WKB of the input geometries
+    :param sigma: higher sigma for smoother result
+    :param sample_dist: lower sample_dist for smoother result
+    :return: WKB of the smoothed geometries
+    """
+    geometries = shapely.from_wkb(list(wkbs))
+    is_polygon = (shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(geometries)
+    exterior_rings = shapely.get_exterior_ring(geometries[is_polygon])
+    coords, ring_index = shapely.get_coordinates(exterior_rings, return_index=True)
+    coords, ring_index = rings_gaussian_smooth(coords, ring_index, sigma=sigma, sample_dist=sample_dist)
+    # every ring has vertices, so the indices are consecutive
+    smoothed = shapely.polygons(shapely.linearrings(coords, indices=ring_index))
+
+    result = list(wkbs)
+    for i, wkb in zip(np.flatnonzero(is_polygon), shapely.to_wkb(smoothed)):
+        result[i] = wkb
+    return result
@@ -0,0 +1,27 @@
+from threedi_results_analysis.tool_watershed.dissolve import cells_to_polygons
+
+import numpy as np
+import pytest
+
+
+# xmin, ymin, xmax, ymax of a 20x20 cell with a 10x10 cell to its right, and a ring of
+# 10x10 cells around a hole
+CELL_COORDS = np.array(
+    [
+        [0, 20, 30, 40, 50, 30, 50, 30, 40, 50],
+        [0, 0, 20, 20, 20, 30, 30, 40, 40, 40],
+        [20, 30, 40, 50, 60, 40, 60, 40, 50, 60],
+        [20, 10, 30, 30, 30, 40, 40, 50, 50, 50],
+    ],
+    dtype=float,
+)
+
+
+@pytest.mark.parametrize("block_size", [1000, 3, 1])
+def test_cells_to_polygons(block_size):
+    polygons = sorted(cells_to_polygons(CELL_COORDS, block_size=block_size), key=lambda p: p.GetArea())
+    assert [polygon.GetArea() for polygon in polygons] == [500, 800]
+    assert polygons[0].GetEnvelope() == (0, 30, 0, 20)
+    assert polygons[0].GetGeometryRef(0).GetPointCount() == 7  # simplified, closed ring
+    assert polygons[1].GetEnvelope() == (30, 60, 20, 50)
+    assert polygons[1].GetGeometryCount() == 2  # the hole
@@ -0,0 +1,48 @@
+from threedi_results_analysis.tool_watershed.watershed_analysis_networkx import Graph3Di
+from threedi_results_analysis.tool_watershed.watershed_analysis_networkx import Reachability
+from scipy.sparse import csr_matrix
+
+import mock
+import numpy as np
+
+
+def graph_3di(threedi_result, precompute_reachability):
+    gr = threedi_result.result_admin
+    return Graph3Di(
+        gridadmin_gpkg=None,
+        gr=gr,
+        start_time=0,
+        end_time=int(gr.nodes.timestamps[-1]),
+        threshold=0.0,
+        precompute_reachability=precompute_reachability,
+    )
+
+
+def test_graph3di_precompute_reachability(threedi_result):
+    graph = graph_3di(threedi_result, precompute_reachability=True)
+    graph.update()
+    assert graph.isready
+    assert set(graph._reachability) == {False, True}
+
+    expected = graph_3di(threedi_result, precompute_reachability=False)
+    node_ids = [1, 100]
+    assert graph.upstream_nodes(node_ids) == expected.upstream_nodes(node_ids)
+    assert graph.downstream_nodes(node_ids) == expected.downstream_nodes(node_ids)
+
+    # a threshold change recalculates the precomputed reachability
+    graph.threshold = 1.0
+    graph.update()
+    assert set(graph._reachability) == {False, True}
+
+
+@mock.patch("threedi_results_analysis.tool_watershed.watershed_analysis_networkx.MAX_PRECOMPUTED_SIZE", 3)
+def test_reachability_stores_clicked_components_up_to_max_size():
+    # chain 0 -> 1 -> 2 -> 3 -> 4
+    graph = csr_matrix((np.ones(4, dtype=bool), (np.arange(4), np.arange(1, 5))), shape=(5, 5))
+    reachability = Reachability(graph)
+    assert reachability.reachable([2]).tolist() == [3, 4]
+    assert reachability.reachable([0]).tolist() == [1, 2, 3, 4]
+    # the stored results exceed the maximum size, so no more results are stored
+    assert reachability.reachable([1]).tolist() == [2, 3, 4]
+    assert len(reachability._reachable_components) == 2
+    assert reachability.reachable([1]).tolist() == [2, 3, 4]
@@ -9,7 +9,8 @@
 
 # TODO: auto-Enable/disable buttons in Target Nodes and Outputs sections
 
-from .smoothing import polygon_gaussian_smooth
+from .dissolve import cells_to_polygons
+from .smoothing import polygons_gaussian_smooth
 from .watershed_analysis_networkx import Graph3Di
 from osgeo import ogr
 from osgeo import osr
@@ -25,7 +26,6 @@ from qgis.core import QgsField
 from qgis.core import QgsGeometry
 from qgis.core import QgsMapLayerProxyModel
 from qgis.core import QgsMessageLog
-from qgis.core import QgsProcessingFeedback
 from qgis.core import QgsProject
 from qgis.core import QgsTask
 from qgis.core import QgsVectorLayer
@@ -55,7 +55,6 @@ import numpy as np
 # TODO: add flow direction styling to result flowlines
 import os
 import pathlib
-import processing
 
 
 logger = logging.getLogger(__name__)
@@ -574,33 +573,33 @@ class Graph3DiQgsConnector:
         subset_string = "catchment_id IN ({})".format(non_dissolved_ids_str)
         self.result_cell_layer.setSubsetString(subset_string)
 
-        feedback = QgsProcessingFeedback()
-        dslv_params = {
-            "INPUT": self.result_cell_layer,  # QgsVectorLayer
-            "FIELD": ["location", "catchment_id"],  # dissolve field (str)
-            "OUTPUT": "memory:",
-        }
-
-        multipolys = processing.run("qgis:dissolve", dslv_params, feedback=feedback)["OUTPUT"]
-        to_single_params = {"INPUT": multipolys, "OUTPUT": "memory:Result Catchments"}  # QgsVectorLayer
-        nw_result_catchments_layer = processing.run("qgis:multiparttosingleparts", to_single_params, feedback=feedback)[
-            "OUTPUT"
-        ]
-
-        self.result_catchment_layer.startEditing()
-        # Catchment table now has different number of attributes
-        # self.result_catchment_layer.dataProvider().addFeatures(nw_result_catchments_layer.getFeatures())
+        # group the cells by (location, catchment_id); the first cell provides the other attributes
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        groups = {}
+        for feature in self.result_cell_layer.getFeatures(request):
+            key = (feature["location"], feature["catchment_id"])
+            if key not in groups:
+                groups[key] = (feature.attributes(), [])
+            groups[key][1].append(feature["id"])
+
+        all_cell_ids = np.unique([cell_id for _, cell_ids in groups.values() for cell_id in cell_ids])
+        all_cell_coords = self.gr.cells.filter(id__in=all_cell_ids.tolist()).cell_coords
+
+        fields = self.result_cell_layer.fields()
         new_features = []
-        for orig_feature in nw_result_catchments_layer.getFeatures():
-            new_feature = QgsFeature(self.result_catchment_layer.fields())
-            new_feature["id"] = orig_feature["id"]
-            new_feature["node_type"] = orig_feature["node_type"]
-            new_feature["location"] = orig_feature["location"]
-            new_feature["catchment_id"] = orig_feature["catchment_id"]
-            new_feature["from_polygon"] = orig_feature["from_polygon"]
-            new_feature.setGeometry(orig_feature.geometry())
-            new_features.append(new_feature)
+        for attributes, cell_ids in groups.values():
+            cell_coords = all_cell_coords[:, np.searchsorted(all_cell_ids, cell_ids)]
+            for polygon in cells_to_polygons(cell_coords):
+                new_feature = QgsFeature(self.result_catchment_layer.fields())
+                for fieldname in self.result_cell_attr_types:
+                    new_feature[fieldname] = attributes[fields.indexOf(fieldname)]
+                geometry = QgsGeometry()
+                geometry.fromWkb(polygon.ExportToWkb())
+                new_feature.setGeometry(geometry)
+                new_features.append(new_feature)
 
+        self.result_catchment_layer.startEditing()
         success = self.result_catchment_layer.dataProvider().addFeatures(new_features)
         if not success:
             logger.error("Unable to add catchment features")
@@ -611,27 +610,31 @@ class Graph3DiQgsConnector:
         self.result_catchment_layer.featureAdded.emit(self.result_catchment_layer.featureCount())
 
     def smooth_catchment_layer(self, result_set):
-        saved_subsetstring = self.result_catchment_layer.subsetString()
-        self.result_catchment_layer.setSubsetString(f"catchment_id = {result_set}")
-        self.result_catchment_layer.setReadOnly(False)
-        self.result_catchment_layer.startEditing()
-        for feature in self.result_catchment_layer.getFeatures():
-            if feature.id() not in self.smooth_result_catchments:
-                avg_cell_size = self.average_cell_size(feature["catchment_id"])
-                avg_grid_space = np.sqrt(avg_cell_size)
-                sigma = np.max([10, 16 * np.log(avg_grid_space) - 30])  # formula fitted to trial and error results
-                sample_dist = np.max([2, 2 * np.log(avg_grid_space) - 3])
-                geom = feature.geometry()
-                ogr_geom = ogr.CreateGeometryFromWkb(geom.asWkb())
-                ogr_geom_smooth = polygon_gaussian_smooth(ogr_geom, sigma=sigma, sample_dist=sample_dist)
-                qgs_geom_smooth = QgsGeometry()
-                qgs_geom_smooth.fromWkb(ogr_geom_smooth.ExportToWkb())
-                self.result_catchment_layer.changeGeometry(feature.id(), qgs_geom_smooth)
-            self.smooth_result_catchments.append(feature.id())
-        if not self.result_catchment_layer.commitChanges():
+        avg_cell_size = self.average_cell_size(result_set)
+        avg_grid_space = np.sqrt(avg_cell_size)
+        sigma = np.max([10, 16 * np.log(avg_grid_space) - 30])  # formula fitted to trial and error results
+        sample_dist = np.max([2, 2 * np.log(avg_grid_space) - 3])
+
+        request = QgsFeatureRequest()
+        request.setFilterExpression(f"catchment_id = {result_set}")
+        features = [
+            feature
+            for feature in self.result_catchment_layer.getFeatures(request)
+            if feature.id() not in self.smooth_result_catchments
+        ]
+        # all catchments are smoothed in one go and written in a single provider call
+        smoothed_wkbs = polygons_gaussian_smooth(
+            [bytes(feature.geometry().asWkb()) for feature in features], sigma=sigma, sample_dist=sample_dist
+        )
+        geometries = {}
+        for feature, wkb in zip(features, smoothed_wkbs):
+            qgs_geom_smooth = QgsGeometry()
+            qgs_geom_smooth.fromWkb(wkb)
+            geometries[feature.id()] = qgs_geom_smooth
+        if not self.result_catchment_layer.dataProvider().changeGeometryValues(geometries):
             logger.error("Unable to commit changes after smoothing")
-        self.result_catchment_layer.setReadOnly(True)
-        self.result_catchment_layer.setSubsetString(saved_subsetstring)
+        self.smooth_result_catchments.extend(geometries)
+        self.result_catchment_layer.triggerRepaint()
 
     def create_impervious_surface_layer(self):
         # This layer is different from the other result layers, because it is a copy of an existing layer from the
@@ -1032,6 +1035,7 @@ class WatershedAnalystDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.gq = Graph3DiQgsConnector(result_item=result_item, model=self.model, parent_dock=self, preloaded_layers=preloaded_layers)
         self.gq.start_time = 0  # initial value of widget is 0, so valueChanged() signal will not be emitted when ...
         # ... a 3Di result is loaded for the first time
+        self.gq.graph_3di.precompute_reachability = self.checkBoxPrecompute.isChecked()
 
     def disconnect_gq(self):
         if not self.gq:
@@ -1075,6 +1079,10 @@ class WatershedAnalystDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     def threshold_changed(self):
         self.gq.threshold = self.doubleSpinBoxThreshold.value()
 
+    def checkbox_precompute_state_changed(self):
+        if self.gq:
+            self.gq.graph_3di.precompute_reachability = self.checkBoxPrecompute.isChecked()
+
     def start_time_changed(self):
         self.gq.start_time = self.doubleSpinBoxStartTime.value()
 
@@ -1214,6 +1222,7 @@ class WatershedAnalystDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.doubleSpinBoxThreshold.setSingleStep(1)
         self.doubleSpinBoxThreshold.setMinimum(0)
         self.doubleSpinBoxThreshold.setValue(DEFAULT_THRESHOLD)
+        self.checkBoxPrecompute.stateChanged.connect(self.checkbox_precompute_state_changed)
         self.doubleSpinBoxStartTime.valueChanged.connect(self.start_time_changed)
         self.doubleSpinBoxEndTime.valueChanged.connect(self.end_time_changed)
         self.checkBoxUpstream.stateChanged.connect(self.checkbox_upstream_state_changed)
@@ -1246,6 +1255,8 @@ class UpdateGridAdminTask(QgsTask):
     def run(self):
         try:
             self.parent.gq.gr = self.gr
+            # do the expensive aggregation here instead of on the main thread
+            self.parent.gq.graph_3di.update()
             return True
         except Exception as e:
             self.exception = e
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 import numpy as np
-import networkx as nx
-from typing import Union
+from typing import Dict, Iterable, Union
 from pathlib import Path
 from osgeo import ogr
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order
+from scipy.sparse.csgraph import connected_components
+from threedi_results_analysis.tool_watershed.dissolve import cells_as_multipolygon
 from threedi_results_analysis.utils.threedi_result_aggregation.base import time_aggregate
 from threedi_results_analysis.utils.threedi_result_aggregation.aggregation_classes import Aggregation
 from threedi_results_analysis.utils.threedi_result_aggregation.constants import AGGREGATION_VARIABLES, AGGREGATION_METHODS, AggregationSign
-from threedi_results_analysis.utils.threedi_result_aggregation.threedigrid_ogr import threedigrid_to_ogr
 from threedigrid.admin.gridresultadmin import GridH5ResultAdmin
 
 
@@ -20,6 +22,143 @@ Q_NET_SUM = Aggregation(
 ogr.UseExceptions()
 
 
+def reachable_nodes(graph: csr_matrix, source_node_ids: Iterable[int]) -> np.ndarray:
+    """Return the nodes that can be reached from any of the source nodes
+
+    All sources are traversed at once: a virtual node is added that connects to the
+    successors of all sources, after which a single breadth first traversal from that
+    virtual node is done. A source node is only included in the result if it can be
+    reached from a source node.
+
+    :param graph: (n x n) sparse adjacency matrix, with an edge from row to column
+    :returns: sorted array of node ids
+    """
+    nr_nodes = graph.shape[0]
+    sources = np.unique(np.fromiter(source_node_ids, dtype=int))
+    sources = sources[(sources >= 0) & (sources < nr_nodes)]
+    successors = np.unique(graph[sources].indices)
+    if successors.size == 0:
+        return np.empty(0, dtype=int)
+
+    virtual_node = nr_nodes
+    extended_graph = csr_matrix(
+        (
+            np.ones(graph.indices.size + successors.size, dtype=bool),
+            np.concatenate([graph.indices, successors]),
+            np.append(graph.indptr, graph.indptr[-1] + successors.size),
+        ),
+        shape=(nr_nodes + 1, nr_nodes + 1),
+    )
+    nodes = breadth_first_order(extended_graph, virtual_node, directed=True, return_predecessors=False)
+    return np.sort(nodes[nodes != virtual_node])
+
+
+# Maximum total number of component ids that Reachability.precompute() stores
+MAX_PRECOMPUTED_SIZE = 10_000_000
+
+
+class Reachability:
+    """Answers reachability queries on a graph using its condensation
+
+    Strongly connected components (e.g. nodes in a loop of flowlines) are condensed to
+    a single node, which turns the graph into a (usually much smaller) directed acyclic
+    graph. The components that can be reached from a component are calculated once
+    (on first use or for all components at once with precompute()), so that repeated
+    queries are answered by lookups instead of graph traversals.
+
+    The result of reachable() is identical to that of reachable_nodes().
+    """
+
+    def __init__(self, graph: csr_matrix):
+        nr_components, labels = connected_components(graph, directed=True, connection="strong")
+        self.labels = labels
+        self.nr_components = nr_components
+
+        coo = graph.tocoo()
+        start = labels[coo.row]
+        end = labels[coo.col]
+        internal = start == end
+        # a component can be reached from itself if it contains a cycle (incl. self loops)
+        self.cyclic = np.bincount(labels, minlength=nr_components) > 1
+        self.cyclic[start[internal]] = True
+        self.condensed = csr_matrix(
+            (np.ones(np.count_nonzero(~internal), dtype=bool), (start[~internal], end[~internal])),
+            shape=(nr_components, nr_components),
+        )
+        # component id: sorted ids of the components that can be reached from it
+        self._reachable_components: Dict[int, np.ndarray] = {}
+        self._size = 0
+
+    def _store(self, component: int, reachable_components: np.ndarray):
+        self._reachable_components[component] = reachable_components
+        self._size += reachable_components.size
+
+    def _topological_order(self) -> np.ndarray:
+        """Return the components such that every edge points to a later component"""
+        condensed = self.condensed
+        in_degree = np.bincount(condensed.indices, minlength=self.nr_components)
+        frontier = np.flatnonzero(in_degree == 0)
+        order = []
+        while frontier.size:
+            order.append(frontier)
+            starts = condensed.indptr[frontier]
+            lengths = condensed.indptr[frontier + 1] - starts
+            # indices of the out edges of all frontier components
+            offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            successors = condensed.indices[np.arange(lengths.sum()) + offsets]
+            np.subtract.at(in_degree, successors, 1)
+            successors = np.unique(successors)
+            frontier = successors[in_degree[successors] == 0]
+        return np.concatenate(order) if order else np.empty(0, dtype=int)
+
+    def precompute(self, max_size: int = MAX_PRECOMPUTED_SIZE) -> bool:
+        """Calculate the reachable components of all components
+
+        Components are processed downstream first, so that each component only has to
+        merge the results of its direct successors. Stops when the stored results
+        exceed max_size component ids; the remaining components are then calculated
+        on demand.
+
+        :returns: whether all components have been precomputed
+        """
+        condensed = self.condensed
+        empty = np.empty(0, dtype=np.int32)
+        for component in self._topological_order()[::-1]:
+            if component in self._reachable_components:
+                continue
+            if self._size > max_size:
+                return False
+            successors = condensed.indices[condensed.indptr[component]:condensed.indptr[component + 1]]
+            parts = [successors.astype(np.int32)]
+            parts.extend(self._reachable_components[s] for s in successors)
+            self._store(component, np.unique(np.concatenate(parts)) if successors.size else empty)
+        return True
+
+    def reachable(self, source_node_ids: Iterable[int]) -> np.ndarray:
+        """Return the sorted ids of the nodes that can be reached from any of the source nodes"""
+        nr_nodes = self.labels.size
+        sources = np.unique(np.fromiter(source_node_ids, dtype=int))
+        sources = sources[(sources >= 0) & (sources < nr_nodes)]
+        source_components = np.unique(self.labels[sources])
+
+        included = np.zeros(self.nr_components, dtype=bool)
+        included[source_components[self.cyclic[source_components]]] = True
+        known = np.array([c in self._reachable_components for c in source_components], dtype=bool)
+        for component in source_components[known]:
+            included[self._reachable_components[component]] = True
+        unknown = source_components[~known]
+        if unknown.size == 1:
+            # remember single (clicked) components, so that repeated clicks are lookups,
+            # as long as the stored results do not exceed MAX_PRECOMPUTED_SIZE
+            reachable_components = reachable_nodes(self.condensed, unknown).astype(np.int32)
+            if self._size <= MAX_PRECOMPUTED_SIZE:
+                self._store(int(unknown[0]), reachable_components)
+            included[reachable_components] = True
+        elif unknown.size > 1:
+            included[reachable_nodes(self.condensed, unknown)] = True
+        return np.flatnonzero(included[self.labels])
+
+
 class Graph3Di:
     def __init__(
         self,
@@ -30,6 +169,7 @@ class Graph3Di:
         end_time: int = None,
         aggregation: Aggregation = Q_NET_SUM,
         threshold: float = 0,
+        precompute_reachability: bool = False,
     ):
         self._gr = gr
         self._subset = subset
@@ -39,9 +179,48 @@ class Graph3Di:
         self._threshold = threshold
         self._aggregate = None
         self._graph = None
+        self._reversed_graph = None
+        self._edge_start_node_ids = None
+        self._edge_end_node_ids = None
+        self._edge_flowline_ids = None
+        # flowlines oriented in the direction of the aggregated flow, sorted by its magnitude
+        self._sorted_magnitudes = None
+        self._sorted_start_node_ids = None
+        self._sorted_end_node_ids = None
+        self._sorted_flowline_ids = None
+        self._nr_nodes = 0
+        # Reachability of the graph (key False) and the reversed graph (key True)
+        self._reachability = {}
+        self._precompute_reachability = precompute_reachability
         self.gridadmin_gpkg = str(gridadmin_gpkg) if gridadmin_gpkg else None
-        self.calculate_aggregate()
-        self.update_graph()
+        # The aggregate and graph are (re)calculated on demand, see update()
+        self._aggregate_dirty = True
+        self._graph_dirty = True
+
+    def _set_aggregate_dirty(self):
+        """Mark that a property on which the aggregate (and therefore the graph) depends has changed"""
+        self._aggregate_dirty = True
+        self._graph_dirty = True
+
+    def update(self):
+        """Recalculate the aggregate and/or the graph if properties they depend on have changed
+
+        Setting properties does not trigger a recalculation, so that changing several
+        properties in a row results in a single recalculation. This is called when the
+        aggregate or graph is requested, but may be called beforehand (e.g. in a
+        background task) to do the recalculation at a convenient moment.
+        """
+        if self._aggregate_dirty:
+            self._aggregate_dirty = False
+            self.calculate_aggregate()
+        if self._graph_dirty:
+            self._graph_dirty = False
+            self.update_graph()
+        if self._precompute_reachability and self._graph is not None:
+            for upstream in (False, True):
+                if upstream not in self._reachability:
+                    self._reachability[upstream] = Reachability(self._get_graph(upstream))
+                    self._reachability[upstream].precompute()
 
     @property
     def gr(self):
@@ -51,9 +230,9 @@ class Graph3Di:
     def gr(self, gr):
         if not isinstance(gr, GridH5ResultAdmin):
             raise TypeError
-        self._gr = gr
-        self.calculate_aggregate()
-        self.update_graph()
+        if gr is not self._gr:
+            self._gr = gr
+            self._set_aggregate_dirty()
 
     @property
     def subset(self):
@@ -63,9 +242,9 @@ class Graph3Di:
     def subset(self, subset):
         if not (isinstance(subset, str) or subset is None):
             raise TypeError
-        self._subset = subset
-        self.calculate_aggregate()
-        self.update_graph()
+        if subset is not self._subset:
+            self._subset = subset
+            self._set_aggregate_dirty()
 
     @property
     def start_time(self):
@@ -73,12 +252,11 @@ class Graph3Di:
 
     @start_time.setter
     def start_time(self, start_time):
-        if start_time is None:
-            self._start_time = None
-        else:
-            self._start_time = int(start_time)
-        self.calculate_aggregate()
-        self.update_graph()
+        if start_time is not None:
+            start_time = int(start_time)
+        if start_time != self._start_time:
+            self._start_time = start_time
+            self._set_aggregate_dirty()
 
     @property
     def end_time(self):
@@ -86,12 +264,11 @@ class Graph3Di:
 
     @end_time.setter
     def end_time(self, end_time):
-        if end_time is None:
-            self._end_time = None
-        else:
-            self._end_time = int(end_time)
-        self.calculate_aggregate()
-        self.update_graph()
+        if end_time is not None:
+            end_time = int(end_time)
+        if end_time != self._end_time:
+            self._end_time = end_time
+            self._set_aggregate_dirty()
 
     @property
     def aggregation(self):
@@ -99,9 +276,9 @@ class Graph3Di:
 
     @aggregation.setter
     def aggregation(self, aggregation):
-        self._aggregation = aggregation
-        self.calculate_aggregate()
-        self.update_graph()
+        if aggregation is not self._aggregation:
+            self._aggregation = aggregation
+            self._set_aggregate_dirty()
 
     @property
     def threshold(self):
@@ -111,7 +288,16 @@ class Graph3Di:
     def threshold(self, threshold):
         if isinstance(threshold, float) or threshold is None:
             self._threshold = threshold
-        self.update_graph()
+            self._graph_dirty = True
+
+    @property
+    def precompute_reachability(self):
+        """Calculate the upstream and downstream areas of all nodes when the graph is updated"""
+        return self._precompute_reachability
+
+    @precompute_reachability.setter
+    def precompute_reachability(self, precompute_reachability: bool):
+        self._precompute_reachability = bool(precompute_reachability)
 
     @property
     def lines_subset(self):
@@ -122,15 +308,30 @@ class Graph3Di:
 
     @property
     def aggregate(self):
+        self.update()
         return self._aggregate
 
     @property
     def graph(self):
+        """Sparse adjacency matrix with an edge from each node to the nodes it flows to"""
+        self.update()
         return self._graph
 
+    @property
+    def reversed_graph(self):
+        """Sparse adjacency matrix with an edge from each node to the nodes it receives flow from"""
+        self.update()
+        return self._get_reversed_graph()
+
+    def _get_reversed_graph(self) -> csr_matrix:
+        """Return the reversed graph of the current graph, without updating the graph"""
+        if self._reversed_graph is None and self._graph is not None:
+            self._reversed_graph = self._graph.T.tocsr()
+        return self._reversed_graph
+
     @property
     def isready(self):
-        return isinstance(self.graph, nx.MultiDiGraph)
+        return isinstance(self.graph, csr_matrix)
 
     def calculate_aggregate(self):
         """Calculate the aggregate with current attributes"""
@@ -148,54 +349,83 @@ class Graph3Di:
                 aggregation=self.aggregation,
             )
             self._graph = None  # to prevent a mismatch between aggregate and graph
+            self._reversed_graph = None
+            self._sorted_magnitudes = None
+            self._reachability = {}
+            self._graph_dirty = True
 
         else:
             print("calculate aggregate not performed")
             print(f"gr type: {type(self.gr)}")
             print(f"start time = {self.start_time} type: {type(self.start_time)}")
             print(f"end time = {self.end_time} type: {type(self.end_time)}")
-            print(f"aggregation type: {type(self.aggregate)}")
+            print(f"aggregation type: {type(self._aggregate)}")
+
+    def _sort_flowlines(self):
+        """Orient the flowlines in the direction of the aggregated flow and sort them by its magnitude
+
+        The flowlines that exceed any threshold then are the tail of these arrays.
+        """
+        aggregate = np.squeeze(self._aggregate)
+        lines = self.lines_subset.line.T
+        flowline_ids = self.lines_subset.id
+
+        # flowlines with negative flow are flipped, so that they become positive flows
+        negative = aggregate < 0
+        start_node_ids = np.where(negative, lines[:, 1], lines[:, 0]).astype(int)
+        end_node_ids = np.where(negative, lines[:, 0], lines[:, 1]).astype(int)
+        magnitudes = np.abs(aggregate)
+
+        # NaN flows never exceed the threshold
+        order = np.flatnonzero(~np.isnan(magnitudes))
+        order = order[np.argsort(magnitudes[order], kind="stable")]
+        self._sorted_magnitudes = magnitudes[order]
+        self._sorted_start_node_ids = start_node_ids[order]
+        self._sorted_end_node_ids = end_node_ids[order]
+        self._sorted_flowline_ids = flowline_ids[order]
+        # node ids are used as matrix indices
+        self._nr_nodes = int(lines.max()) + 1 if lines.size else 0
 
     def update_graph(self):
-        """Create NetworkX MultiDiGraph object if necessary properties have valid values"""
+        """Create the sparse flow direction graph if necessary properties have valid values
+
+        Only flowlines of which the absolute aggregated flow exceeds the threshold are
+        included. A negative threshold is treated as 0.
+        """
         if (
-            isinstance(self.aggregate, np.ndarray)
+            isinstance(self._aggregate, np.ndarray)
             and isinstance(self.threshold, float)
             and isinstance(self.gr, GridH5ResultAdmin)
         ):
-            # Get flowlines with positive flow
-            pos_mask = np.squeeze(self.aggregate > self.threshold)
-            pos_flows = self.lines_subset.line.T[pos_mask]
-            pos_flows_ids = list(self.lines_subset.id.T[pos_mask])
-
-            # Get flowlines with negative flow
-            neg_mask = np.squeeze(self.aggregate < -1 * self.threshold)
-            neg_flows = self.lines_subset.line.T[neg_mask]
-            neg_flows_flipped = np.fliplr(neg_flows)
-            # now negative flows have become positive flows, because node pairs are flipped
-            neg_flows_ids = list(self.lines_subset.id.T[neg_mask])
-
-            # read the threedi result into a directional MultiDiGraph based on the filtering above
-            self._graph = nx.MultiDiGraph()
-            edges = []
-            flows = list(map(tuple, pos_flows))
-            flows += list(map(tuple, neg_flows_flipped))
-            ids = pos_flows_ids + neg_flows_ids
-            for i, line in enumerate(flows):
-                edges.append((line[0], line[1], {"id": ids[i]}))
-
-            self._graph.add_edges_from(edges)
+            if self._sorted_magnitudes is None:
+                self._sort_flowlines()
+
+            # a threshold change only moves the start of the included part of the sorted flowlines
+            first = np.searchsorted(self._sorted_magnitudes, max(self.threshold, 0.0), side="right")
+            self._edge_start_node_ids = self._sorted_start_node_ids[first:]
+            self._edge_end_node_ids = self._sorted_end_node_ids[first:]
+            self._edge_flowline_ids = self._sorted_flowline_ids[first:]
+
+            # parallel flowlines become a single edge
+            self._graph = csr_matrix(
+                (
+                    np.ones(self._edge_start_node_ids.size, dtype=bool),
+                    (self._edge_start_node_ids, self._edge_end_node_ids),
+                ),
+                shape=(self._nr_nodes, self._nr_nodes),
+            )
+            self._reversed_graph = None
+            self._reachability = {}
+
+    def _get_graph(self, upstream: bool) -> csr_matrix:
+        """Return the (reversed) graph, without updating it; called by and after update()"""
+        return self._get_reversed_graph() if upstream else self._graph
 
     def _upstream_or_downstream_nodes(self, target_node_ids, upstream: bool):
-        result_node_ids = set()
-        for id_i in target_node_ids:
-            if id_i in self.graph.nodes:
-                if upstream:
-                    result_node_ids_i = nx.ancestors(self.graph, id_i)
-                else:
-                    result_node_ids_i = nx.descendants(self.graph, id_i)
-                result_node_ids.update(result_node_ids_i)
-        return result_node_ids
+        self.update()
+        if upstream not in self._reachability:
+            self._reachability[upstream] = Reachability(self._get_graph(upstream))
+        return set(self._reachability[upstream].reachable(target_node_ids).tolist())
 
     def upstream_nodes(self, target_node_ids):
         """
@@ -219,9 +449,10 @@ class Graph3Di:
 
     def flowlines_between_nodes(self, node_ids):
         """Return list of flowline ids that connect the input nodes"""
-        edges = self.graph.subgraph(nodes=node_ids).edges.data("id")
-        flowline_ids = [edge[2] for edge in edges]
-        return flowline_ids
+        self.update()
+        node_ids = np.fromiter(node_ids, dtype=int)
+        mask = np.isin(self._edge_start_node_ids, node_ids) & np.isin(self._edge_end_node_ids, node_ids)
+        return self._edge_flowline_ids[mask].tolist()
 
     def _upstream_or_downstream_flowlines(self, target_node_ids, upstream: bool):
         nodes = self._upstream_or_downstream_nodes(target_node_ids=target_node_ids, upstream=upstream)
@@ -235,26 +466,6 @@ class Graph3Di:
         return self._upstream_or_downstream_flowlines(target_node_ids=target_node_ids, upstream=False)
 
     def cells_as_multipolygon(self, cell_ids: set):
-        """Dissolve cells to multipolygon
-
-        WARNING! May result in memory error if somehwat large set of cells is given as input
-        """
-        upstream_cell_ids = list(cell_ids)
-        cell_drv = ogr.GetDriverByName("MEMORY")
-        cell_ds = cell_drv.CreateDataSource("")
-        threedigrid_to_ogr(
-            tgt_ds=cell_ds,
-            layer_name="cell",
-            gridadmin_gpkg=self.gridadmin_gpkg,
-            attributes={},
-            attr_data_types={},
-            ids=upstream_cell_ids,
-        )
-        cell_layer = cell_ds.GetLayerByName("cell")
-        cells_multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
-        for cell in cell_layer:
-            cells_multipolygon.AddGeometry(cell.GetGeometryRef())
-
-        result = cells_multipolygon.UnionCascaded()
-
-        return result
+        """Dissolve cells to multipolygon"""
+        cells = self.gr.cells.filter(node_type__in=[1, 2]).filter(id__in=list(cell_ids))
+        return cells_as_multipolygon(cells.cell_coords)
@@ -0,0 +1,58 @@
+"""Rasterization of 2D computational cells
+
+3Di cells are axis aligned rectangles whose corners lie on a grid with the size of
+the smallest cell, so they can be burned into a raster with that pixel size without
+loss of precision.
+
+This module is imported by worker processes, so it must not import anything from qgis.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+NO_CELL = -1
+
+GeoTransform = Tuple[float, float, float, float, float, float]
+
+
+def cell_pixel_bounds(
+    cell_coords: np.ndarray, pixel_size: float
+) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], Tuple[int, int], GeoTransform]:
+    """Return the pixel bounds of the cells in a raster that covers all cells
+
+    :param cell_coords: array of shape (4, n) with the xmin, ymin, xmax, ymax of each cell
+    :param pixel_size: pixel size of the raster, in the units of the cell coordinates
+    :return: the row_start, row_end, col_start and col_end (exclusive) arrays of the
+        cells; the (height, width) of the raster; and the gdal geotransform of the raster
+    """
+    xmin, ymin, xmax, ymax = cell_coords
+    origin_x = xmin.min()
+    origin_y = ymax.max()
+    width = int(np.ceil((xmax.max() - origin_x) / pixel_size))
+    height = int(np.ceil((origin_y - ymin.min()) / pixel_size))
+
+    col_start = np.round((xmin - origin_x) / pixel_size).astype(int)
+    col_end = np.maximum(np.round((xmax - origin_x) / pixel_size).astype(int), col_start + 1)
+    row_start = np.round((origin_y - ymax) / pixel_size).astype(int)
+    row_end = np.maximum(np.round((origin_y - ymin) / pixel_size).astype(int), row_start + 1)
+
+    pixel_size = float(pixel_size)
+    geotransform = (float(origin_x), pixel_size, 0.0, float(origin_y), 0.0, -pixel_size)
+    return (row_start, row_end, col_start, col_end), (height, width), geotransform
+
+
+def cell_label_image(cell_coords: np.ndarray, pixel_size: float) -> Tuple[np.ndarray, GeoTransform]:
+    """Return an image of cell indices and its geotransform
+
+    :param cell_coords: array of shape (4, n) with the xmin, ymin, xmax, ymax of each cell
+    :param pixel_size: pixel size of the output image, in the units of the cell coordinates
+    :return: 2D int32 array in which each pixel contains the index (into the second
+        axis of ``cell_coords``) of the cell it falls in, or NO_CELL; and the gdal
+        geotransform of that array
+    """
+    bounds, shape, geotransform = cell_pixel_bounds(cell_coords, pixel_size)
+    labels = np.full(shape, NO_CELL, dtype=np.int32)
+    for index, (r0, r1, c0, c1) in enumerate(zip(*bounds)):
+        labels[r0:r1, c0:c1] = index
+    return labels, geotransform
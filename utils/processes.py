@@ -0,0 +1,73 @@
+"""Helpers for running work in worker processes from within QGIS
+
+Modules that contain the functions that run in the worker processes are imported
+by these processes, so they should not import anything from qgis. Importing such a
+module also imports the package, whose ``__init__`` skips its qgis imports and the
+dependency mechanism in worker processes (see ``IN_WORKER_PROCESS``).
+"""
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Iterable, Iterator, Tuple
+
+import multiprocessing
+import multiprocessing.spawn
+import os
+import sys
+
+
+def python_executable() -> str:
+    """Return the python interpreter for the worker processes
+
+    Inside QGIS, sys.executable points to the QGIS binary, which can not be used
+    to spawn worker processes.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    for name in ("pythonw.exe", "python.exe", os.path.join("bin", "python3")):
+        candidate = os.path.join(sys.exec_prefix, name)
+        if os.path.isfile(candidate):
+            return candidate
+    return sys.executable
+
+
+def spawn_context():
+    """Return a multiprocessing context that starts fresh python interpreters
+
+    Note that the interpreter of the spawn context is a process-wide setting: it
+    also applies to the processes that other plugins spawn in the same QGIS
+    session. It is therefore only changed if it is not python_executable() yet.
+    """
+    context = multiprocessing.get_context("spawn")
+    executable = python_executable()
+    if os.fsdecode(multiprocessing.spawn.get_executable()) != executable:
+        context.set_executable(executable)
+    return context
+
+
+def default_workers() -> int:
+    """Number of worker processes to use if not specified: the number of CPUs minus one"""
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def bounded_map(executor: Executor, calls: Iterable[Tuple], max_pending: int) -> Iterator[Any]:
+    """Submit the calls to the executor and yield their results in the order of the calls
+
+    The calls are submitted while their results are consumed, with at most
+    ``max_pending`` calls submitted but not yet yielded. This way, the arguments
+    (e.g. chunks of a result file) and results of all calls are never in memory at
+    once. When the iteration is stopped by an exception or by closing the generator
+    (e.g. with ``contextlib.closing``), the calls that have not started are cancelled.
+
+    :param calls: iterable of (function, *args) tuples
+    """
+    pending = deque()
+    try:
+        for function, *args in calls:
+            pending.append(executor.submit(function, *args))
+            while len(pending) >= max_pending or (pending and pending[0].done()):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()